@@ -34,44 +34,18 @@ def load_semantic_engine():
 
 wikisearch = load_semantic_engine()
 
-@st.cache_data
-def query_bm25(query, lang='en', top_n=10):
-    try:
-        return wikisearch.with_bm25(query, lang=lang, top_n=top_n)
-    except (Exception) as e:
-        st.error(f'Querying Engine Error {e}')
-
-
-@st.cache_data
-def query_neartext(query, lang='en', top_n=10):
-    try:
-        return wikisearch.with_neartext(query, lang=lang, top_n=top_n)
-    except (Exception) as e:
-        st.error(f'Querying Engine Error {e}')
-
-
-@st.cache_data
-def query_hybrid(query, lang='en', top_n=10):
-    try:
-        return wikisearch.with_hybrid(query, lang=lang, top_n=top_n)
-    except (Exception) as e:
-        st.error(f'Querying Engine Error {e}')
-
-
-def query_llm(context, query, temperature, model, lang="english"):
-    try:
-        response = wikisearch.with_llm(
-            context=context, query=query, temperature=temperature, model=model, lang=lang)
-        text = response.generations[0].text
-        return text
-    except (Exception) as e:
-        st.error(f'Querying Engine Error {e}')
-        
 
 def onclick_sample_query(query):
     st.session_state.user_query_txt = query
 
 
+search_modes = {
+    'Dense Retrieval': 'neartext',
+    'Keyword Search': 'bm25',
+    'Hybrid Mode': 'hybrid',
+    'Fusion Mode': 'fusion'
+}
+
 languages = {
     'Arabic': 'ar',
     'Chinese': 'zh',
@@ -108,9 +82,9 @@ with st.sidebar.expander("🤖 COHERE-SETTINGS", expanded=True):
                             max_value=15, value=10, step=1)
 
 with st.sidebar.expander("🔧 WEAVIATE-SETTINGS", expanded=True):
-    options = ["Dense Retrieval", "Keyword Search", "Hybrid Mode"]
-    search_mode = st.radio("Select your preferred Search Mode:", options, key="search-mode", index=0)
+    search_mode = st.radio("Select your preferred Search Mode:", list(search_modes.keys()), key="search-mode", index=0)
     st.info("ℹ️ Note that *Dense Retrieval* and *Hybrid* outperform *Keyword Search* on complex queries!")
+    st.info("ℹ️ *Fusion Mode* runs *Keyword Search* and *Dense Retrieval* in parallel, and merges them with Reciprocal Rank Fusion.")
     
 with st.expander("ℹ️ ABOUT-THIS-APP", expanded=False):
     st.write("""
@@ -158,15 +132,9 @@ with col4:
         st.session_state.btn_ai = True
 
 if query:
-    if search_mode == "Dense Retrieval":
-        data = query_neartext(query, lang=lang_code, top_n=max_results)
-    elif search_mode == "Keyword Search":
-        data = query_bm25(query, lang=lang_code, top_n=max_results)
-    elif search_mode == "Hybrid Mode":
-        data = query_hybrid(query, lang=lang_code, top_n=max_results)
-    else:
+    if search_mode not in search_modes:
         st.info(
-            "ℹ️ Select your preferred Search Mode (Dense Retrieval, Keyword Search, or Hybrid)!")
+            "ℹ️ Select your preferred Search Mode (Dense Retrieval, Keyword Search, Hybrid, or Fusion)!")
         st.stop()
 
     st.divider()
@@ -174,40 +142,63 @@ if query:
 
     with col1:
         st.subheader("🔎 1. Pre-Search")
-
-        if data is None:
-            st.warning(
-                "⚠️ No results found! Note that this App uses a Wikipedia subset")
-            st.stop()
-        for idx, doc in enumerate(data):
-            with st.expander(f'**{doc["title"]} [Rank: {idx+1}**]', expanded=False):
-                st.markdown(
-                    f'"*{doc["text"][:800]} [...]*" [Source]({doc["url"]})')
-
+        presearch = st.container()
     with col2:
         st.subheader("🏆 2. Ranking")
+        ranking = st.container()
+    with col3:
+        st.subheader("📝 3. LLM Generation")
+        answer = st.empty()
+        generation = st.container()
 
-        with st.spinner("Reranking..."):
-            data_ranked = wikisearch.rerank(
-                query=query, documents=data, top_n=max_results, model=rank_model)
-        if data_ranked is None:
-            st.warning(
+    pipeline = wikisearch.run_pipeline(query, mode=search_modes[search_mode], lang=lang_code, top_n=max_results,
+                                       rank_model=rank_model, gen_model=gen_model, temperature=temperature,
+                                       gen_lang=lang)
+    try:
+        with answer, st.spinner("Searching..."):
+            stage = next(pipeline)
+
+        data = stage.data
+        if not data:
+            presearch.warning(
                 "⚠️ No results found! Note that this App uses a Wikipedia subset")
             st.stop()
-        for idx, r in enumerate(data_ranked):
-            doc = r.document
-            expanded = False
-            if idx == 0:
-                expanded = True
-            with st.expander(f'**{doc["title"]} [Previous Rank: {r.index + 1} - Relevance: {r.relevance_score:.3f}**]', expanded=expanded):
-                st.markdown(
-                    f'"*{doc["text"][:800]} [...]*" [Source]({doc["url"]})')
-
-    with col3:
-        st.subheader("📝 3. LLM Generation")
+        with presearch:
+            for idx, doc in enumerate(data):
+                with st.expander(f'**{doc["title"]} [Rank: {idx+1}**]', expanded=False):
+                    st.markdown(
+                        f'"*{doc["text"][:800]} [...]*" [Source]({doc["url"]})')
+
+        with answer, st.spinner("Reranking..."):
+            stage = next(pipeline)
+
+        with ranking:
+            if stage.data.meta and stage.data.meta.get("fallback"):
+                st.warning("⚠️ Ranking is unavailable, showing the Pre-Search order")
+            for idx, r in enumerate(stage.data):
+                doc = r.document
+                expanded = False
+                if idx == 0:
+                    expanded = True
+                relevance = f"{r.relevance_score:.3f}" if r.relevance_score is not None else "n/a"
+                with st.expander(f'**{doc["title"]} [Previous Rank: {r.index + 1} - Relevance: {relevance}**]', expanded=expanded):
+                    st.markdown(
+                        f'"*{doc["text"][:800]} [...]*" [Source]({doc["url"]})')
+
+        with answer, st.spinner("Deep Diving..."):
+            stage = next(pipeline)
+        text = ""
+        while stage.stage == "token":
+            text += stage.data
+            answer.success(f"🪄 {text}")
+            stage = next(pipeline)
+
+        timings = next(pipeline).data
+    except (Exception) as e:
+        st.error(f'Querying Engine Error {e}')
+        st.stop()
 
-        with st.spinner("Deep Diving..."):
-            r = query_llm(context=data_ranked[:5], query=query,
-                          temperature=temperature, model=gen_model, lang=lang)
-        st.success(f"🪄 {r}")
+    with generation:
+        st.caption(f"⏱️ Pre-Search {timings['presearch']:.2f}s · Ranking {timings['rerank']:.2f}s · "
+                   f"First token {timings['ttfb']:.2f}s · Generation {timings['generation']:.2f}s")
         st.info("ℹ️ Some references might appear to be duplicated while referring to different paragraphs of the same article.")
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the Wikipedia SearchEngine, run against local stand-ins for Weaviate and Cohere.
+Run from the repository root, e.g. `python -m bench.bench_async`.
+"""
@@ -0,0 +1,64 @@
+"""
+Queries/sec of the blocking `with_bm25` (one thread per caller) vs. the async `awith_bm25`
+(one shared event loop) at 1, 16 and 128 concurrent callers against a local GraphQL stand-in.
+
+Usage: python -m bench.bench_async [--latency 0.05] [--queries 512]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fakes import FakeCohere, FakeWeaviate, engine_for
+
+CONCURRENCY = [1, 16, 128]
+
+
+def cold(engine):
+    engine.cache.clear()
+    engine.embedding_cache.clear()
+
+
+def bench_sync(engine, callers, queries) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        list(pool.map(lambda i: engine.with_bm25(f"query {i}"), range(queries)))
+    return queries / (time.perf_counter() - start)
+
+
+async def bench_async(engine, callers, queries) -> float:
+    pending = iter(range(queries))
+
+    async def caller():
+        for i in pending:
+            await engine.awith_bm25(f"query {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(callers)))
+    return queries / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.05, help="Injected server latency in seconds")
+    parser.add_argument("--queries", type=int, default=512, help="Queries per measurement")
+    args = parser.parse_args()
+
+    with FakeWeaviate(latency=args.latency) as weaviate, FakeCohere() as cohere:
+        engine = engine_for(weaviate, cohere)
+        logging.getLogger().setLevel(logging.ERROR)
+        print(f"{'callers':>8} {'sync q/s':>10} {'async q/s':>10}")
+        for callers in CONCURRENCY:
+            queries = max(args.queries, callers)
+            # cold caches, so that both passes send every query instead of measuring cache hits
+            cold(engine)
+            sync_qps = bench_sync(engine, callers, queries)
+            cold(engine)
+            async_qps = engine.run(bench_async(engine, callers, queries))
+            print(f"{callers:>8} {sync_qps:>10.1f} {async_qps:>10.1f}")
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
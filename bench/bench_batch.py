@@ -0,0 +1,44 @@
+"""
+Per-query cost of one `with_neartext` request per query vs. `search_batch`, which packs many
+aliased `Get { Articles }` blocks into each GraphQL document, against a local GraphQL stand-in.
+
+Usage: python -m bench.bench_batch [--latency 0.01] [--queries 1000] [--batch-size 32]
+"""
+import argparse
+import logging
+import time
+
+from bench.fakes import FakeCohere, FakeWeaviate, engine_for
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.01, help="Injected server latency in seconds")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of queries")
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per GraphQL document")
+    args = parser.parse_args()
+    queries = [f"question {i}" for i in range(args.queries)]
+
+    with FakeWeaviate(latency=args.latency) as weaviate, FakeCohere() as cohere:
+        engine = engine_for(weaviate, cohere)
+        logging.getLogger().setLevel(logging.ERROR)
+
+        print(f"{'method':>14} {'requests':>9} {'total s':>8} {'ms/query':>9}")
+        for name, run in [
+            ("with_neartext", lambda: [engine.with_neartext(q) for q in queries]),
+            ("search_batch", lambda: engine.search_batch(queries, batch_size=args.batch_size)),
+        ]:
+            # cold caches, so that both methods send every query
+            engine.cache.clear()
+            engine.embedding_cache.clear()
+            weaviate.requests = 0
+            start = time.perf_counter()
+            results = run()
+            elapsed = time.perf_counter() - start
+            assert len(results) == len(queries)
+            print(f"{name:>14} {weaviate.requests:>9} {elapsed:>8.2f} {1000 * elapsed / len(queries):>9.2f}")
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Latency and recall of the local BM25 index (bm25.py) on a synthetic corpus whose term frequencies
+follow Zipf's law, compared with an exhaustive (unpruned, unquantized) BM25 evaluation.
+
+Usage: python -m bench.bench_bm25 [--docs 1000000] [--length 30] [--vocab 500000] [--queries 500] [--stopwords 100]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import bm25
+
+
+def zipf(rng, vocab, size, exponent=1.1):
+    """
+    Term ids in [0, vocab) with frequency proportional to 1 / (id + 1) ** exponent.
+    """
+    cdf = np.cumsum(1.0 / np.arange(1, vocab + 1) ** exponent)
+    return np.searchsorted(cdf, rng.random(size) * cdf[-1])
+
+
+def corpus(docs, length, vocab, seed):
+    rng = np.random.default_rng(seed)
+    lengths = np.maximum(rng.poisson(length, docs), 1)
+    tokens = int(lengths.sum())
+    words = zipf(rng, vocab, tokens)
+    owners = np.repeat(np.arange(docs, dtype=np.int64), lengths)
+    pairs, tfs = np.unique(owners * vocab + words, return_counts=True)
+    return pairs % vocab, pairs // vocab, tfs, lengths
+
+
+def queries(count, vocab, stopwords, seed):
+    """
+    Queries of 2 to 4 terms drawn from the corpus distribution: content queries skip the `stopwords`
+    most frequent terms, stopword queries only use them (every passage matches, nothing can be pruned).
+    """
+    rng = np.random.default_rng(seed + 1)
+    content, common = [], []
+    while len(content) < count:
+        words = zipf(rng, vocab, rng.integers(2, 5))
+        if (words >= stopwords).all():
+            content.append(np.unique(words))
+    for _ in range(count):
+        common.append(np.unique(rng.integers(0, stopwords, rng.integers(2, 5))))
+    return {"content": content, "stopwords": common}
+
+
+def exhaustive(query, postings, starts, docs, scores, num_docs, k):
+    total = np.zeros(num_docs, dtype=np.float64)
+    for term in query:
+        lo, hi = starts[term], starts[term + 1]
+        np.add.at(total, docs[postings[lo:hi]], scores[postings[lo:hi]])
+    return set(np.argsort(-total, kind="stable")[:k].tolist()) if total.any() else set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=1_000_000, help="Number of passages")
+    parser.add_argument("--length", type=int, default=30, help="Mean passage length in terms")
+    parser.add_argument("--vocab", type=int, default=500_000, help="Vocabulary size")
+    parser.add_argument("--queries", type=int, default=500, help="Number of queries")
+    parser.add_argument("--stopwords", type=int, default=100, help="Most frequent terms treated as stopwords")
+    parser.add_argument("--top-n", type=int, default=10, help="Results per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    terms, docs, tfs, lengths = corpus(args.docs, args.length, args.vocab, args.seed)
+    vocab = {f"w{i}": i for i in range(args.vocab)}
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        index = bm25.BM25Index.write(path, vocab, terms, docs, tfs, lengths)
+        built = time.perf_counter() - start
+        size = {name: os.path.getsize(os.path.join(path, f"{name}.npy")) for name in index.ARRAYS}
+        payload = size["gaps"] + size["impacts"]
+        print(f"passages={args.docs} postings={len(terms)} build={built:.1f}s "
+              f"postings={payload / 2 ** 20:.1f} MiB ({8 * payload / len(terms):.1f} bits/posting) "
+              f"blocks+terms={(sum(size.values()) - payload) / 2 ** 20:.1f} MiB")
+
+        # exhaustive float BM25 over the same postings, as ground truth
+        df = np.bincount(terms, minlength=args.vocab)
+        idf = np.log1p((args.docs - df + 0.5) / (df + 0.5))
+        norm = index.k1 * (1 - index.b + index.b * lengths / lengths.mean())
+        scores = idf[terms] * tfs * (index.k1 + 1) / (tfs + norm[docs])
+        postings = np.argsort(terms, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(df)))
+
+        for kind, batch in queries(args.queries, args.vocab, args.stopwords, args.seed).items():
+            latencies, recall = [], 0.0
+            for query in batch:
+                text = " ".join(f"w{term}" for term in query)
+                start = time.perf_counter()
+                ids, _ = index.search(text, k=args.top_n)
+                latencies.append(1000 * (time.perf_counter() - start))
+                expected = exhaustive(query, postings, starts, docs, scores, args.docs, args.top_n)
+                recall += len(expected & set(ids.tolist())) / max(len(expected), 1)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            print(f"{kind:>9} queries={len(batch)} recall@{args.top_n}={recall / len(batch):.3f} "
+                  f"mean={np.mean(latencies):.2f}ms p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms")
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Latency percentiles of `with_neartext` with and without hedged Weaviate queries (HEDGE_QUERIES=true),
+against a local GraphQL stand-in whose response times follow a long-tailed distribution, and the
+extra requests hedging costs.
+
+Distributions (base latency --latency):
+- lognormal: log-normally distributed around the base latency (sigma 0.5);
+- bimodal: the base latency, and --slow-fraction of the responses 20x slower (a busy node);
+- pareto: Pareto-distributed (shape 2) above the base latency.
+
+Usage: python -m bench.bench_hedging [--queries 2000] [--callers 2] [--distributions lognormal bimodal pareto]
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bench.fakes import FakeCohere, FakeWeaviate, engine_for, latency_distribution
+
+
+def run(engine, queries, callers, label):
+    def timed(i):
+        start = time.perf_counter()
+        engine.with_neartext(f"{label} query {i}")
+        return time.perf_counter() - start
+    with ThreadPoolExecutor(callers) as pool:
+        return np.array(list(pool.map(timed, range(queries)))) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=2000, help="Queries per run")
+    parser.add_argument("--callers", type=int, default=2, help="Concurrent callers")
+    parser.add_argument("--latency", type=float, default=0.01, help="Base server latency in seconds")
+    parser.add_argument("--slow-fraction", type=float, default=0.03, help="Slow responses of the bimodal distribution")
+    parser.add_argument("--percentile", type=float, default=95, help="HEDGE_PERCENTILE")
+    parser.add_argument("--distributions", nargs="+", default=["lognormal", "bimodal", "pareto"],
+                        choices=["lognormal", "bimodal", "pareto"], help="Latency distributions to simulate")
+    args = parser.parse_args()
+    os.environ["HEDGE_PERCENTILE"] = str(args.percentile)
+
+    print(f"{'distribution':>12} {'hedging':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'p99.9 ms':>8} "
+          f"{'extra req':>9} {'hedge won':>9}")
+    for kind in args.distributions:
+        for hedge in ("false", "true"):
+            os.environ["HEDGE_QUERIES"] = hedge
+            with FakeWeaviate(latency=latency_distribution(kind, args.latency, args.slow_fraction)) as weaviate, \
+                    FakeCohere() as cohere:
+                engine = engine_for(weaviate, cohere)
+                logging.getLogger().setLevel(logging.ERROR)
+                # the stand-in logs every request whose connection a cancelled hedge closed
+                logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+                # warms the connections and, with hedging, the latency histogram
+                run(engine, 200, args.callers, "warmup")
+                weaviate.requests = 0
+                latencies = run(engine, args.queries, args.callers, "bench")
+                stats = engine.hedge_stats().get("neartext", {})
+                engine.close()
+            p50, p95, p99, p999 = np.percentile(latencies, [50, 95, 99, 99.9])
+            extra = weaviate.requests / args.queries - 1
+            won = stats.get("backup_won", 0) / max(stats.get("hedged", 0), 1)
+            print(f"{kind:>12} {'on' if hedge == 'true' else 'off':>7} {p50:>7.1f} {p95:>7.1f} {p99:>7.1f} "
+                  f"{p999:>8.1f} {extra:>9.1%} {won:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
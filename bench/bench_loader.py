@@ -0,0 +1,64 @@
+"""
+Import throughput of one `data_object.create` request per object vs. `loader.BulkLoader` with
+several worker threads, against a local Weaviate stand-in that takes time per object and answers
+429 above a number of concurrent imports.
+
+Usage: python -m bench.bench_loader [--objects 20000] [--latency 0.005] [--object-latency 0.0002] [--capacity 8]
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import weaviate
+from weaviate.util import generate_uuid5
+
+from bench.fakes import FakeWeaviate
+from loader import BulkLoader
+
+
+def objects(count, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        url = f"https://en.wikipedia.org/wiki?curid={i}"
+        properties = {"text": f"passage {i}", "title": f"Article {i}", "url": url, "views": i, "lang": "en"}
+        yield properties, rng.standard_normal(dim).astype(np.float32).tolist(), generate_uuid5(url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=20_000, help="Number of objects imported by the bulk loader")
+    parser.add_argument("--single-objects", type=int, default=1000, help="Number of objects imported one at a time")
+    parser.add_argument("--dim", type=int, default=64, help="Vector dimension")
+    parser.add_argument("--latency", type=float, default=0.005, help="Injected latency per request in seconds")
+    parser.add_argument("--object-latency", type=float, default=0.0002, help="Injected latency per object in seconds")
+    parser.add_argument("--capacity", type=int, default=8, help="Concurrent imports before the server answers 429")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16], help="Worker threads to compare")
+    parser.add_argument("--target-latency", type=float, default=0.1, help="Batch latency above which batches shrink")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"{'method':>16} {'objects/s':>10} {'batch size':>11} {'p50 ms':>7} {'p95 ms':>7} {'retries':>8} {'429s':>5}")
+    with FakeWeaviate(latency=args.latency, object_latency=args.object_latency, capacity=args.capacity) as server:
+        client = weaviate.Client(server.url)
+        start = time.perf_counter()
+        for properties, vector, uuid in objects(args.single_objects, args.dim):
+            client.data_object.create(properties, "Articles", uuid=uuid, vector=vector)
+        rate = args.single_objects / (time.perf_counter() - start)
+        print(f"{'one at a time':>16} {rate:>10.0f} {1:>11} {'':>7} {'':>7} {0:>8} {server.rejected:>5}")
+
+        for workers in args.workers:
+            server.objects.clear()
+            server.rejected = 0
+            with BulkLoader(client, "Articles", workers=workers, target_latency=args.target_latency) as loader:
+                for properties, vector, uuid in objects(args.objects, args.dim):
+                    loader.add(properties, vector=vector, uuid=uuid)
+            stats = loader.stats()
+            assert len(server.objects) == args.objects and stats["failed"] == 0
+            print(f"{f'bulk, {workers} workers':>16} {stats['objects_per_sec']:>10.0f} "
+                  f"{stats['mean_batch_size']:>11.0f} {1000 * stats['batch_latency_p50']:>7.1f} "
+                  f"{1000 * stats['batch_latency_p95']:>7.1f} {stats['retries']:>8} {server.rejected:>5}")
+
+
+if __name__ == "__main__":
+    main()
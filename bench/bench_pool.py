@@ -0,0 +1,84 @@
+"""
+Latency and connections opened by the stock Weaviate and Cohere clients vs. the pooled keep-alive
+clients of transport.py, under concurrent synchronous callers (like Streamlit sessions sharing one
+engine), against local stand-ins. Every new connection costs `--connect-latency` seconds on the
+client side, as a TLS handshake to a remote endpoint would.
+
+Usage: python -m bench.bench_pool [--requests 2000] [--threads 1 16 64] [--connect-latency 0.02]
+"""
+import argparse
+import logging
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cohere
+import numpy as np
+import weaviate
+
+import transport
+from bench.fakes import FakeCohere, FakeWeaviate
+
+DOCUMENTS = [f"passage {i} about the history of the city" for i in range(20)]
+
+
+def slow_connect(delay):
+    # every new socket connection pays the delay, like a remote TCP + TLS handshake
+    connect = socket.socket.connect
+
+    def patched(sock, address):
+        time.sleep(delay)
+        return connect(sock, address)
+    socket.socket.connect = patched
+
+
+def run(call, requests, threads):
+    def timed(i):
+        start = time.perf_counter()
+        call(i)
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = np.array(list(pool.map(timed, range(requests)))) * 1000
+    elapsed = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return requests / elapsed, p50, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per run")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 16, 64], help="Concurrent callers")
+    parser.add_argument("--latency", type=float, default=0.005, help="Injected server latency in seconds")
+    parser.add_argument("--connect-latency", type=float, default=0.02, help="Seconds per new connection")
+    parser.add_argument("--pool-size", type=int, default=64, help="Connections per pooled client")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    slow_connect(args.connect_latency)
+
+    print(f"{'client':>22} {'threads':>7} {'req/s':>7} {'p50 ms':>7} {'p99 ms':>7} {'connections':>11}")
+    with FakeWeaviate(latency=args.latency) as server, FakeCohere(latency=args.latency) as co:
+        stock = weaviate.Client(server.url)
+        pooled = weaviate.Client(server.url)
+        transport.PooledAdapter(args.pool_size).mount(pooled._connection._session)
+        clients = [
+            ("weaviate.Client", lambda i: stock.query.get("Articles", ["title"]).with_bm25(f"q{i}").with_limit(10).do(),
+             server),
+            ("weaviate.Client pooled", lambda i: pooled.query.get("Articles", ["title"]).with_bm25(f"q{i}")
+             .with_limit(10).do(), server),
+        ]
+        for name, client in [("cohere.Client", cohere.Client("bench", api_url=co.url, check_api_key=False)),
+                             ("cohere.Client pooled", transport.PooledCohereClient("bench", pool_size=args.pool_size,
+                                                                                   api_url=co.url, check_api_key=False))]:
+            clients.append((name, lambda i, client=client: client.rerank(query=f"q{i}", documents=DOCUMENTS,
+                                                                          top_n=10, model="rerank-multilingual-v2.0"),
+                            co))
+        for name, call, fake in clients:
+            for threads in args.threads:
+                fake.peers.clear()
+                rate, p50, p99 = run(call, args.requests, threads)
+                print(f"{name:>22} {threads:>7} {rate:>7.0f} {p50:>7.1f} {p99:>7.1f} {fake.connections:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Recall, memory and latency of the quantized dense indexes (quantization.py) on synthetic embeddings,
+compared with a brute-force scan of the float32 and float16 vectors.
+
+The vectors are clustered and have a decaying spectrum in a random basis, like sentence embeddings,
+so that the variance is unevenly spread across dimensions (which OPQ's rotation corrects).
+
+Usage: python -m bench.bench_quantization [--vectors 100000] [--dim 768] [--queries 200] [--m 64] [--candidates 100]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import quantization
+import vectorstore
+
+
+def embeddings(count, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    basis, _ = np.linalg.qr(rng.standard_normal((dim, dim)))
+    spectrum = (1.0 / np.arange(1, dim + 1) ** 0.5).astype(np.float32)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32) * spectrum
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, quantization.CHUNK_SIZE):
+        size = min(quantization.CHUNK_SIZE, count - start)
+        points = centers[rng.integers(0, clusters, size)] + rng.standard_normal((size, dim)).astype(np.float32) * spectrum
+        vectors[start:start + size] = points @ basis.astype(np.float32)
+    return vectorstore.normalize(vectors), basis.astype(np.float32), spectrum
+
+
+def brute_force(vectors, query, k):
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), quantization.INT8_CHUNK_SIZE):
+        scores[start:start + quantization.INT8_CHUNK_SIZE] = \
+            np.asarray(vectors[start:start + quantization.INT8_CHUNK_SIZE], dtype=np.float32) @ query
+    return np.argsort(-scores, kind="stable")[:k]
+
+
+def report(name, nbytes, count, built, latencies, recall, k):
+    p50, p95 = np.percentile(latencies, [50, 95])
+    print(f"{name:>8} bytes/vector={nbytes / count:6.0f} total={nbytes / 2 ** 20:8.1f} MiB build={built:6.1f}s "
+          f"recall@{k}={recall:.3f} p50={p50:6.2f}ms p95={p95:6.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100_000, help="Number of vectors")
+    parser.add_argument("--dim", type=int, default=768, help="Vector dimension")
+    parser.add_argument("--clusters", type=int, default=1000, help="Number of clusters of the synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--m", type=int, default=64, help="Bytes per PQ/OPQ code")
+    parser.add_argument("--candidates", type=int, default=100, help="ADC candidates re-scored exactly")
+    parser.add_argument("--train-size", type=int, default=65536, help="Vectors sampled to train the quantizers")
+    parser.add_argument("--opq-iterations", type=int, default=8, help="Rotation updates of OPQ")
+    parser.add_argument("--top-n", type=int, default=10, help="Results per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors, basis, spectrum = embeddings(args.vectors, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    # queries are perturbed copies of indexed vectors, so their neighborhoods are populated
+    noise = rng.standard_normal((args.queries, args.dim)).astype(np.float32) * spectrum @ basis
+    queries = vectorstore.normalize(vectors[rng.integers(0, args.vectors, args.queries)] + 0.05 * noise)
+    expected = [set(brute_force(vectors, query, args.top_n).tolist()) for query in queries]
+
+    for dtype in (np.float32, np.float16):
+        stored = vectors.astype(dtype)
+        latencies, recall = [], 0.0
+        for query, truth in zip(queries, expected):
+            start = time.perf_counter()
+            ids = brute_force(stored, query, args.top_n)
+            latencies.append(1000 * (time.perf_counter() - start))
+            recall += len(truth & set(ids.tolist())) / args.top_n
+        report(np.dtype(dtype).name, stored.nbytes, args.vectors, 0.0, latencies, recall / args.queries, args.top_n)
+        del stored
+
+    for kind in quantization.QuantizedIndex.KINDS:
+        with tempfile.TemporaryDirectory() as path:
+            start = time.perf_counter()
+            index = quantization.QuantizedIndex.build(vectors, path, kind=kind, m=args.m, train_size=args.train_size,
+                                                      opq_iterations=args.opq_iterations, seed=args.seed)
+            built = time.perf_counter() - start
+            latencies, recall, adc = [], 0.0, 0.0
+            for query, truth in zip(queries, expected):
+                start = time.perf_counter()
+                ids, _ = index.search(query, vectors, k=args.top_n, candidates=args.candidates)
+                latencies.append(1000 * (time.perf_counter() - start))
+                recall += len(truth & set(ids.tolist())) / args.top_n
+                # recall of the codes alone, without exact re-scoring
+                approximate = np.argsort(-index.scores(query), kind="stable")[:args.top_n]
+                adc += len(truth & set(approximate.tolist())) / args.top_n
+            report(kind, index.nbytes, args.vectors, built, latencies, recall / args.queries, args.top_n)
+            print(f"{'':>8} ADC only recall@{args.top_n}={adc / args.queries:.3f}")
+            del index
+
+
+if __name__ == "__main__":
+    main()
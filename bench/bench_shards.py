@@ -0,0 +1,109 @@
+"""
+Latency and recall of language-filtered HNSW searches on a single mixed-language index, compared with
+unfiltered searches on per-language shards (shards.py), and of cross-lingual searches over several
+languages in one process vs. on a process pool.
+
+Languages get Zipf-like shares of a synthetic clustered corpus, like the Wikipedia editions, so that
+the filtered searches on the small languages have to walk past many passages of other languages.
+
+Usage: python -m bench.bench_shards [--vectors 20000] [--dim 128] [--queries 100] [--processes 4]
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import local
+import shards
+import vectorstore
+
+LANGS = ["en", "de", "fr", "es", "it", "ja", "zh", "ar", "ko", "hi"]
+
+
+def corpus(path, count, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    shares = 1.0 / np.arange(1, len(LANGS) + 1)
+    langs = rng.choice(len(LANGS), count, p=shares / shares.sum())
+    rows = [{"text": f"passage {i}", "title": f"Article {i}", "url": f"https://{LANGS[lang]}.wikipedia.org/{i}",
+             "views": i, "lang": LANGS[lang]} for i, lang in enumerate(langs)]
+    with vectorstore.VectorStoreWriter(path, dim) as writer:
+        writer.append(vectors, rows)
+    return centers, rng
+
+
+def brute_force(store, query, lang, k):
+    mask = local.lang_filter(store, lang)
+    rows = np.flatnonzero(mask) if mask is not None else np.arange(len(store))
+    scores = np.asarray(store.vectors[rows]) @ query
+    return rows[np.argsort(-scores, kind="stable")[:k]]
+
+
+def run(search, queries, expected, k):
+    latencies, recall = [], 0.0
+    for query, truth in zip(queries, expected):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append(1000 * (time.perf_counter() - start))
+        urls = {article["url"] for article in found}
+        recall += len(truth & urls) / max(len(truth), 1)
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return f"recall@{k}={recall / len(queries):.3f} p50={p50:6.2f}ms p95={p95:6.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20_000, help="Number of passages")
+    parser.add_argument("--dim", type=int, default=128, help="Vector dimension")
+    parser.add_argument("--clusters", type=int, default=200, help="Number of clusters of the synthetic vectors")
+    parser.add_argument("--queries", type=int, default=100, help="Queries per language")
+    parser.add_argument("--ef", type=int, default=64, help="HNSW candidate list size")
+    parser.add_argument("--processes", type=int, default=4, help="Worker processes of cross-lingual searches")
+    parser.add_argument("--top-n", type=int, default=10, help="Results per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        centers, rng = corpus(path, args.vectors, args.dim, args.clusters, args.seed)
+        start = time.perf_counter()
+        local.build_dense_index(path)
+        mixed_build = time.perf_counter() - start
+        start = time.perf_counter()
+        shards.split_store(path)
+        for shard in shards.shard_dirs(path).values():
+            local.build_dense_index(shard)
+        print(f"passages={args.vectors} build mixed={mixed_build:.1f}s shards={time.perf_counter() - start:.1f}s")
+
+        store = vectorstore.VectorStore(path)
+        mixed = local.LocalDenseBackend(path, ef=args.ef, store=store)
+        sharded = shards.ShardedBackend(path, "hnsw", {"ef": args.ef})
+        queries = vectorstore.normalize(centers[rng.integers(0, args.clusters, args.queries)]
+                                        + 0.5 * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+        url = lambda row: store.metadata(row)["url"]
+        for lang in (LANGS[0], LANGS[len(LANGS) // 2], LANGS[-1]):
+            expected = [{url(row) for row in brute_force(store, query, lang, args.top_n)} for query in queries]
+            share = store.lang_mask(lang).mean()
+            print(f"{lang} ({share:.1%} of passages)")
+            print(f"  filtered mixed index: {run(lambda q: mixed.search(q, lang, args.top_n), queries, expected, args.top_n)}")
+            print(f"  unfiltered shard:     {run(lambda q: sharded.search(q, lang, args.top_n), queries, expected, args.top_n)}")
+
+        # the smaller editions, where filtering the mixed index costs the most
+        langs = LANGS[len(LANGS) // 2:]
+        expected = [{url(row) for row in brute_force(store, query, langs, args.top_n)} for query in queries]
+        print(f"cross-lingual ({', '.join(langs)}: {local.lang_filter(store, langs).mean():.1%} of passages)")
+        print(f"  filtered mixed index: {run(lambda q: mixed.search(q, langs, args.top_n), queries, expected, args.top_n)}")
+        print(f"  shards, 1 process:    {run(lambda q: sharded.search(q, langs, args.top_n), queries, expected, args.top_n)}")
+        with ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pooled = shards.ShardedBackend(path, "hnsw", {"ef": args.ef}, pool=pool)
+            pooled.search(queries[0], langs, args.top_n)  # open the shards in the workers
+            print(f"  shards, {args.processes} processes:  "
+                  f"{run(lambda q: pooled.search(q, langs, args.top_n), queries, expected, args.top_n)}")
+        del mixed, sharded, store
+
+
+if __name__ == "__main__":
+    main()
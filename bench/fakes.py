@@ -0,0 +1,310 @@
+"""
+Local stand-in servers that mimic the parts of the Weaviate and Cohere HTTP APIs used by
+`wikipedia.SearchEngine`, with injectable latency so benchmarks run fully offline.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+
+from aiohttp import web
+
+
+DISTRIBUTIONS = ["fixed", "lognormal", "bimodal", "pareto"]
+
+
+def latency_distribution(kind, base, slow_fraction=0.03):
+    """
+    A function sampling server latencies around a base latency.
+
+    Parameters:
+    - kind (str): 'fixed', 'lognormal' (sigma 0.5 around the base), 'bimodal' (`slow_fraction` of
+      the responses 20x slower, like a busy node) or 'pareto' (shape 2, above the base).
+    - base (float): The base latency, in seconds.
+    - slow_fraction (float, optional): The slow responses of the bimodal distribution. Default is 0.03.
+
+    Returns:
+    - callable: Returns a latency in seconds at every call.
+    """
+    if kind == "fixed":
+        return lambda: base
+    if kind == "lognormal":
+        return lambda: base * random.lognormvariate(0, 0.5)
+    if kind == "bimodal":
+        return lambda: base * (20 if random.random() < slow_fraction else 1)
+    if kind == "pareto":
+        return lambda: base * random.paretovariate(2)
+    raise ValueError(f"Unknown latency distribution '{kind}', expected one of {DISTRIBUTIONS}")
+
+
+def parse_latency(spec):
+    """
+    Parses a latency option: seconds ('0.01'), or a distribution and its base latency ('lognormal:0.01').
+
+    Returns:
+    - float | callable: A fixed latency, or a function sampling one (see `latency_distribution`).
+    """
+    kind, _, base = spec.rpartition(":")
+    if not kind:
+        return float(base)
+    return latency_distribution(kind, float(base))
+
+
+class FakeServer:
+    """
+    Runs an aiohttp web application on a background thread and a random local port.
+    """
+    def __init__(self, latency=0.0, host="127.0.0.1"):
+        self.latency = latency
+        self.host = host
+        self.port = None
+        self.requests = 0
+        # (host, port) of the client side of every connection accepted
+        self.peers = set()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def routes(self) -> list:
+        raise NotImplementedError
+
+    async def delay(self):
+        self.requests += 1
+        # a fixed latency, or a function sampling one per request
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+
+    def start(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    @property
+    def connections(self):
+        return len(self.peers)
+
+    async def _start(self):
+        @web.middleware
+        async def count_connections(request, handler):
+            self.peers.add(request.transport.get_extra_info("peername"))
+            return await handler(request)
+
+        app = web.Application(client_max_size=64 * 1024 ** 2, middlewares=[count_connections])
+        app.add_routes(self.routes())
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeWeaviate(FakeServer):
+    """
+    Answers `Get { Articles }` GraphQL documents (including aliased multi-get documents) with
+    synthetic articles of the same shape as the Weaviate Wikipedia demo dataset.
+
+    Object imports take `object_latency` seconds per object on top of `latency`, and are rejected
+    with 429 while more than `capacity` imports are in flight, like an overloaded server.
+    """
+    BLOCK = re.compile(r"(?:(\w+):\s*)?Articles\(")
+    LIMIT = re.compile(r"limit:\s*(\d+)")
+
+    def __init__(self, latency=0.0, text_bytes=800, object_latency=0.0, capacity=None, **kwargs):
+        super().__init__(latency=latency, **kwargs)
+        self.text_bytes = text_bytes
+        self.object_latency = object_latency
+        self.capacity = capacity
+        self.objects = {}
+        self.rejected = 0
+        self._in_flight = 0
+
+    def routes(self) -> list:
+        return [
+            web.get("/v1/.well-known/ready", self.ready),
+            web.get("/v1/meta", self.meta),
+            web.post("/v1/graphql", self.graphql),
+            web.post("/v1/objects", self.create_object),
+            web.post("/v1/batch/objects", self.batch_objects),
+            web.patch("/v1/objects/{class_name}/{id}", self.patch_object),
+            web.delete("/v1/batch/objects", self.delete_objects),
+        ]
+
+    async def ready(self, request):
+        return web.Response(status=200)
+
+    async def meta(self, request):
+        return web.json_response({"hostname": self.url, "version": "1.21.2", "modules": {}})
+
+    async def graphql(self, request):
+        await self.delay()
+        gql = (await request.json())["query"]
+        blocks = list(self.BLOCK.finditer(gql))
+        data = {}
+        for i, block in enumerate(blocks):
+            end = blocks[i + 1].start() if i + 1 < len(blocks) else len(gql)
+            limit = self.LIMIT.search(gql, block.end(), end)
+            top_n = int(limit.group(1)) if limit else 10
+            data[block.group(1) or "Articles"] = self.articles(gql[block.end():end], top_n)
+        return web.json_response({"data": {"Get": data}})
+
+    async def create_object(self, request):
+        return await self.store([await request.json()], lambda results: results[0])
+
+    async def batch_objects(self, request):
+        return await self.store((await request.json())["objects"], lambda results: results)
+
+    async def patch_object(self, request):
+        await self.delay()
+        obj = self.objects.get(request.match_info["id"])
+        if obj is None:
+            return web.Response(status=404)
+        obj["properties"].update((await request.json())["properties"])
+        return web.Response(status=204)
+
+    async def delete_objects(self, request):
+        # only the `id ContainsAny` filter of deletes by uuid
+        await self.delay()
+        where = (await request.json())["match"]["where"]
+        deleted = [id for id in where["valueTextArray"] if self.objects.pop(id, None) is not None]
+        return web.json_response({"results": {"matches": len(deleted), "successful": len(deleted), "failed": 0}})
+
+    async def store(self, objects, respond):
+        if self.capacity is not None and self._in_flight >= self.capacity:
+            self.rejected += 1
+            return web.json_response({"error": [{"message": "too many requests"}]}, status=429)
+        self._in_flight += 1
+        try:
+            await self.delay()
+            if self.object_latency:
+                await asyncio.sleep(self.object_latency * len(objects))
+        finally:
+            self._in_flight -= 1
+        results = []
+        for obj in objects:
+            obj = dict(obj, id=obj.get("id") or hashlib.sha1(json.dumps(obj).encode()).hexdigest())
+            self.objects[obj["id"]] = obj
+            results.append(dict(obj, result={}))
+        return web.json_response(respond(results))
+
+    def articles(self, seed, top_n) -> list:
+        digest = hashlib.sha1(seed.encode()).hexdigest()[:8]
+        filler = ("lorem ipsum dolor sit amet " * (self.text_bytes // 27 + 1))[:self.text_bytes]
+        return [{
+            "text": f"{digest}-{rank} {filler}",
+            "title": f"Article {digest}-{rank}",
+            "url": f"https://en.wikipedia.org/wiki?curid={digest}{rank}",
+            "views": 1000 - rank,
+            "lang": "en",
+            "_additional": {"distance": 0.1 + rank / 100, "score": str(10.0 - rank / 10)},
+        } for rank in range(top_n)]
+
+
+class FakeCohere(FakeServer):
+    """
+    Answers the Cohere API endpoints the SearchEngine relies on. Generations are `tokens` words long,
+    streamed with `token_latency` seconds between chunks when requested with `stream: true`.
+    """
+    def __init__(self, latency=0.0, tokens=50, token_latency=0.0, dim=768, **kwargs):
+        super().__init__(latency=latency, **kwargs)
+        self.tokens = tokens
+        self.token_latency = token_latency
+        self.dim = dim
+
+    def routes(self) -> list:
+        return [
+            web.post("/v1/check-api-key", self.check_api_key),
+            web.post("/v1/rerank", self.rerank),
+            web.post("/v1/generate", self.generate),
+            web.post("/v1/embed", self.embed),
+        ]
+
+    async def check_api_key(self, request):
+        return web.json_response({"valid": True})
+
+    async def rerank(self, request):
+        await self.delay()
+        body = await request.json()
+        scores = [self.relevance(body["query"], doc["text"]) for doc in body["documents"]]
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        results = [{"index": i, "relevance_score": scores[i]} for i in order]
+        return web.json_response({"id": "rerank", "results": results[:body.get("top_n") or len(results)],
+                                  "meta": {"api_version": {"version": "1"}}})
+
+    def relevance(self, query, text) -> float:
+        # deterministic per (query, document), like a real cross-encoder score
+        return int(hashlib.sha1(f"{query}\n{text}".encode()).hexdigest()[:8], 16) / 0xffffffff
+
+    async def embed(self, request):
+        await self.delay()
+        body = await request.json()
+        return web.json_response({"id": "embed", "texts": body["texts"],
+                                  "embeddings": [self.embedding(text) for text in body["texts"]],
+                                  "meta": {"api_version": {"version": "1"}}})
+
+    def embedding(self, text) -> list:
+        # hashed bag of words: texts sharing words get similar embeddings
+        vector = [0.0] * self.dim
+        for word in text.lower().split():
+            digest = hashlib.sha1(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        return vector
+
+    async def generate(self, request):
+        await self.delay()
+        body = await request.json()
+        words = [f"word{i} " for i in range(self.tokens)]
+        generation = {"id": "generation", "generations": [{"id": "g0", "text": "".join(words)}],
+                      "prompt": body["prompt"], "meta": {"api_version": {"version": "1"}}}
+        if not body.get("stream"):
+            return web.json_response(generation)
+
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for word in words:
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            await response.write((json.dumps({"text": word, "is_finished": False}) + "\n").encode())
+        await response.write((json.dumps({"is_finished": True, "finish_reason": "COMPLETE",
+                                          "response": generation}) + "\n").encode())
+        return response
+
+
+def engine_for(weaviate, cohere):
+    """
+    Builds a `SearchEngine` wired to running stand-in servers.
+
+    Parameters:
+    - weaviate (FakeWeaviate): Running Weaviate stand-in.
+    - cohere (FakeCohere): Running Cohere stand-in.
+
+    Returns:
+    - wikipedia.SearchEngine: Engine whose clients point at the stand-ins.
+    """
+    os.environ.update({
+        "WEAVIATE_URL": weaviate.url,
+        "WEAVIATE_API_KEY": "bench",
+        "COHERE_API_KEY": "bench",
+        "CO_API_URL": cohere.url,
+    })
+    import wikipedia
+    return wikipedia.SearchEngine()
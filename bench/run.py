@@ -0,0 +1,142 @@
+"""
+End-to-end benchmark of the `SearchEngine` stages against local Weaviate and Cohere stand-ins:
+throughput and p50/p95/p99 latency of `with_bm25`, `with_neartext`, `with_hybrid`, `rerank` and
+`with_llm`, with configurable server latencies and payload sizes. Every request uses a new query,
+so that the engine caches miss.
+
+Latencies are seconds ('0.01') or a distribution and its base latency ('lognormal:0.01', see
+`bench.fakes.latency_distribution`).
+
+Results can be written as JSON (--json) and compared with an earlier run (--baseline): the exit
+status is 1 when a stage got slower than the baseline by more than --tolerance.
+
+Usage:
+    python -m bench.run [--requests 500] [--concurrency 4] [--stages with_bm25 rerank]
+    python -m bench.run --weaviate-latency lognormal:0.01 --cohere-latency 0.02 --json results.json
+    python -m bench.run --baseline results.json --tolerance 0.2
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from bench.fakes import FakeCohere, FakeWeaviate, engine_for, parse_latency
+
+STAGES = ["with_bm25", "with_neartext", "with_hybrid", "rerank", "with_llm"]
+# compared with the baseline
+METRICS = ["p50_ms", "p95_ms", "p99_ms"]
+
+
+def stage_call(engine, stage, documents):
+    # the call of a stage for the i-th request
+    if stage == "rerank":
+        return lambda i: engine.rerank(f"rerank query {i}", documents, top_n=len(documents))
+    if stage == "with_llm":
+        return lambda i: engine.with_llm(documents[:5], f"llm query {i}")
+    search = getattr(engine, stage)
+    return lambda i: search(f"{stage} query {i}")
+
+
+def measure(call, requests, concurrency) -> dict:
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    succeeded = np.array([latency for latency in latencies if latency is not None]) * 1000
+    p50, p95, p99 = np.percentile(succeeded, [50, 95, 99]) if len(succeeded) else (float("nan"),) * 3
+    return {
+        "requests": requests,
+        "errors": requests - len(succeeded),
+        "throughput": len(succeeded) / elapsed,
+        "mean_ms": float(succeeded.mean()) if len(succeeded) else float("nan"),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def regressions(results, baseline, tolerance) -> list:
+    """
+    Returns:
+    - list: (stage, metric, baseline, current) of the metrics more than `tolerance` above the baseline.
+    """
+    found = []
+    for stage, metrics in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before is None:
+            continue
+        for metric in METRICS:
+            if metrics[metric] > before[metric] * (1 + tolerance):
+                found.append((stage, metric, before[metric], metrics[metric]))
+        if metrics["errors"] > before["errors"]:
+            found.append((stage, "errors", before["errors"], metrics["errors"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES, help="Stages to measure")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per stage")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent callers")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests per stage")
+    parser.add_argument("--weaviate-latency", default="0.005", help="Weaviate stand-in latency")
+    parser.add_argument("--cohere-latency", default="0.005", help="Cohere stand-in latency")
+    parser.add_argument("--text-bytes", type=int, default=800, help="Bytes of text per article")
+    parser.add_argument("--top-n", type=int, default=10, help="Articles per search, documents per rerank")
+    parser.add_argument("--tokens", type=int, default=50, help="Words per generated answer")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown over the baseline, e.g. 0.2 (20%%)")
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "baseline", "tolerance")},
+        "stages": {},
+    }
+    with FakeWeaviate(latency=parse_latency(args.weaviate_latency), text_bytes=args.text_bytes) as weaviate, \
+            FakeCohere(latency=parse_latency(args.cohere_latency), tokens=args.tokens, dim=args.dim) as cohere:
+        engine = engine_for(weaviate, cohere)
+        logging.getLogger().setLevel(logging.ERROR)
+        documents = weaviate.articles("bench documents", args.top_n)
+        print(f"{'stage':>14} {'req/s':>8} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for stage in args.stages:
+            call = stage_call(engine, stage, documents)
+            measure(lambda i: call(-1 - i), args.warmup, args.concurrency)
+            metrics = measure(call, args.requests, args.concurrency)
+            results["stages"][stage] = metrics
+            print(f"{stage:>14} {metrics['throughput']:>8.1f} {metrics['mean_ms']:>8.1f} {metrics['p50_ms']:>8.1f} "
+                  f"{metrics['p95_ms']:>8.1f} {metrics['p99_ms']:>8.1f} {metrics['errors']:>6}")
+        engine.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for stage, metric, before, now in found:
+            print(f"REGRESSION {stage} {metric}: {before:.1f} -> {now:.1f}")
+        if found:
+            sys.exit(1)
+        print(f"No regression over {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Compressed inverted index with BM25 scoring and block-max MaxScore top-k evaluation, tokenizing
+each passage according to its language (see `languages` in app.py).
+
+Postings are grouped per term in blocks of 128. Each block stores the d-gaps of its document ids
+in the narrowest unsigned width that fits (1, 2 or 4 bytes), one uint8 BM25 impact per posting
+(quantized per term), its last document id and its maximum impact, so that blocks that cannot
+change the top-k are never decoded.
+"""
+import json
+import os
+import re
+import unicodedata
+from array import array
+from collections import Counter
+
+import numpy as np
+
+BLOCK_SIZE = 128
+
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+WORDS = re.compile(r"\w+")
+DEVANAGARI_WORDS = re.compile("[\\w\u0900-\u097f]+")
+CJK_WORDS = re.compile(f"[{CJK}]+|[^\\W{CJK}]+")
+CJK_RUN = re.compile(f"[{CJK}]+")
+ARABIC_MARKS = re.compile("[\u0640\u064b-\u065f\u0670]")
+
+
+def tokenize(text, lang="en") -> list:
+    """
+    Splits text into index terms: case-folded words for alphabetic scripts, words including
+    combining vowel signs for Hindi, words without diacritics for Arabic, and overlapping character
+    bigrams for Chinese and Japanese, which are written without spaces.
+
+    Parameters:
+    - text (str): The text to tokenize.
+    - lang (str, optional): The language code of the text. Default is 'en'.
+
+    Returns:
+    - list: The terms, in order.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    if lang == "ar":
+        text = ARABIC_MARKS.sub("", text)
+    if lang == "hi":
+        return DEVANAGARI_WORDS.findall(text)
+    if lang not in ("zh", "ja"):
+        return WORDS.findall(text)
+    terms = []
+    for word in CJK_WORDS.findall(text):
+        if CJK_RUN.fullmatch(word) and len(word) > 1:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            terms.append(word)
+    return terms
+
+
+class BM25Index:
+    """
+    Read-only BM25 index stored as memory-mapped arrays in a directory (see `build`).
+    """
+    ARRAYS = ["term_blocks", "term_scale", "block_last", "block_max", "block_count",
+              "block_width", "block_offset", "block_start", "gaps", "impacts"]
+
+    def __init__(self, path, mmap_mode="r"):
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.vocab = meta["vocab"]
+        self.num_docs = meta["num_docs"]
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return self.num_docs
+
+    @classmethod
+    def build(cls, documents, path, k1=1.2, b=0.75):
+        """
+        Tokenizes and indexes passages, using their position as document id.
+
+        Parameters:
+        - documents (iterable): Dicts with the `title`, `text` and `lang` of each passage.
+        - path (str): The index directory.
+        - k1 (float, optional): BM25 term frequency saturation. Default is 1.2.
+        - b (float, optional): BM25 document length normalization. Default is 0.75.
+
+        Returns:
+        - BM25Index: The index.
+        """
+        vocab = {}
+        terms, docs, tfs, lengths = array("I"), array("I"), array("I"), array("I")
+        for doc, document in enumerate(documents):
+            counts = Counter(tokenize(f"{document['title']} {document['text']}", document.get("lang", "en")))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                terms.append(vocab.setdefault(term, len(vocab)))
+                docs.append(doc)
+                tfs.append(tf)
+        return cls.write(path, vocab, np.frombuffer(terms, dtype=np.uint32), np.frombuffer(docs, dtype=np.uint32),
+                         np.frombuffer(tfs, dtype=np.uint32), np.frombuffer(lengths, dtype=np.uint32), k1=k1, b=b)
+
+    @classmethod
+    def write(cls, path, vocab, terms, docs, tfs, lengths, k1=1.2, b=0.75):
+        """
+        Writes an index from (term id, document id, term frequency) triples, whose document ids
+        must be increasing for each term, and the length in terms of every document.
+        """
+        order = np.argsort(terms, kind="stable")
+        terms, docs, tfs = terms[order].astype(np.int64), docs[order].astype(np.int64), tfs[order].astype(np.float32)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        num_docs, postings = len(lengths), len(terms)
+
+        df = np.bincount(terms, minlength=len(vocab))
+        idf = np.log1p((num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(float(lengths.mean()), 1e-9))
+        scores = idf[terms] * tfs * (k1 + 1) / (tfs + norm[docs])
+        term_start = np.concatenate(([0], np.cumsum(df)))
+        term_scale = np.zeros(len(vocab), dtype=np.float32)
+        seen = df > 0
+        term_scale[seen] = np.maximum.reduceat(scores, term_start[:-1][seen]) / 255
+        impacts = np.clip(np.rint(scores / term_scale[terms]), 1, 255).astype(np.uint8)
+
+        rank = np.arange(postings) - term_start[terms]
+        term_blocks = np.concatenate(([0], np.cumsum((df + BLOCK_SIZE - 1) // BLOCK_SIZE)))
+        block = term_blocks[terms] + rank // BLOCK_SIZE
+        block_start = np.flatnonzero(rank % BLOCK_SIZE == 0)
+        block_end = np.append(block_start[1:], postings)
+        previous = np.concatenate(([0], docs[:-1]))
+        previous[term_start[:-1][seen]] = 0
+        gaps = docs - previous
+        gap_max = np.maximum.reduceat(gaps, block_start)
+        block_width = np.where(gap_max < 1 << 8, 1, np.where(gap_max < 1 << 16, 2, 4)).astype(np.uint8)
+        block_bytes = (block_end - block_start) * block_width
+        block_offset = np.concatenate(([0], np.cumsum(block_bytes)[:-1]))
+        width = block_width[block].astype(np.int64)
+        position = block_offset[block] + (rank % BLOCK_SIZE) * width
+        data = np.zeros(int(block_bytes.sum()), dtype=np.uint8)
+        for byte in range(4):
+            wide = width > byte
+            data[position[wide] + byte] = (gaps[wide] >> (8 * byte)) & 0xFF
+
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "term_blocks": term_blocks.astype(np.int64),
+            "term_scale": term_scale,
+            "block_last": docs[block_end - 1].astype(np.uint32),
+            "block_max": np.maximum.reduceat(impacts, block_start),
+            "block_count": (block_end - block_start).astype(np.uint8),
+            "block_width": block_width,
+            "block_offset": block_offset.astype(np.int64),
+            "block_start": block_start.astype(np.int64),
+            "gaps": data,
+            "impacts": impacts,
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), values)
+        with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({"num_docs": num_docs, "k1": k1, "b": b, "vocab": vocab}, f, ensure_ascii=False)
+        return cls(path)
+
+    def search(self, query, lang="en", k=10, allowed=None) -> tuple:
+        """
+        Finds the k passages with the highest BM25 score with block-max MaxScore: query terms are
+        visited from the highest to the lowest maximum impact, and a block is only decoded if it holds
+        a current candidate or if its maximum impact plus the bound of the remaining terms can still
+        beat the k-th best score so far.
+
+        Parameters:
+        - query (str): The search query.
+        - lang (str, optional): The language code of the query. Default is 'en'.
+        - k (int, optional): The number of passages to return. Default is 10.
+        - allowed (np.ndarray, optional): Boolean mask of the passages that may be returned. Default is None (all).
+
+        Returns:
+        - tuple: Document ids and BM25 scores, best first, ties going to the lowest document id.
+        """
+        counts = Counter(term for term in tokenize(query, lang) if term in self.vocab)
+        terms = sorted(((self.vocab[term], float(self.term_scale[self.vocab[term]]) * tf)
+                        for term, tf in counts.items() if self.term_scale[self.vocab[term]] > 0),
+                       key=lambda term: -term[1])
+        bounds = np.cumsum([255 * weight for _, weight in reversed(terms)])[::-1].tolist() + [0.0]
+        candidates = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float32)
+        threshold = 0.0
+        for (term, weight), rest in zip(terms, bounds[1:]):
+            lo, hi = int(self.term_blocks[term]), int(self.term_blocks[term + 1])
+            block_max = self.block_max[lo:hi] * weight
+            lookup = np.empty(0, dtype=np.int64)
+            if len(candidates):
+                keep = scores + 255 * weight + rest >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+                # block of each candidate: the first block whose last document is not before it
+                ends = np.searchsorted(candidates, self.block_last[lo:hi], side="right")
+                found = np.repeat(np.arange(hi - lo + 1), np.diff(ends, prepend=0, append=len(candidates)))
+                inside = found < hi - lo
+                upper = scores + rest + np.where(inside, block_max[np.minimum(found, hi - lo - 1)], 0)
+                keep = upper >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+                lookup = np.unique(found[keep & inside])
+            opened = block_max + rest >= threshold
+            blocks = np.union1d(lookup, np.flatnonzero(opened)) if len(lookup) else np.flatnonzero(opened)
+            if not len(blocks):
+                continue
+            ids, impacts, counts = self.__decode(blocks + lo, lo)
+            fresh = np.repeat(opened[blocks], counts)
+            if allowed is not None:
+                fresh &= allowed[ids]
+            candidates, scores = self.__merge(candidates, scores, ids, (impacts * weight).astype(np.float32), fresh)
+            if len(scores) >= k:
+                threshold = float(np.partition(scores, len(scores) - k)[len(scores) - k])
+        top = np.arange(len(scores))
+        if len(scores) > k:
+            # every passage tied with the k-th score, so that ties go to the lowest document ids
+            top = np.flatnonzero(scores >= np.partition(scores, len(scores) - k)[len(scores) - k])
+        top = top[np.lexsort((candidates[top], -scores[top]))][:k]
+        return candidates[top], scores[top]
+
+    def __decode(self, blocks, first) -> tuple:
+        """
+        Decodes the document ids and impacts of sorted blocks of one term whose first block is `first`.
+        """
+        counts = self.block_count[blocks].astype(np.int64)
+        total = int(counts.sum())
+        widths = self.block_width[blocks]
+        base = 0 if blocks[0] == first else int(self.block_last[blocks[0] - 1])
+        if blocks[-1] - blocks[0] + 1 == len(blocks) and (widths == widths[0]).all():
+            # a run of consecutive blocks of the same width is one contiguous little-endian array
+            offset = int(self.block_offset[blocks[0]])
+            gaps = self.gaps[offset:offset + total * int(widths[0])].view(f"<u{widths[0]}")
+            start = int(self.block_start[blocks[0]])
+            return base + np.cumsum(gaps, dtype=np.int64), self.impacts[start:start + total], counts
+        starts = np.cumsum(counts) - counts
+        within = np.arange(total) - np.repeat(starts, counts)
+        width = np.repeat(widths.astype(np.int64), counts)
+        position = np.repeat(self.block_offset[blocks], counts) + within * width
+        gaps = self.gaps[position].astype(np.int64)
+        for byte in (1, 2, 3):
+            wide = np.flatnonzero(width > byte)
+            if not len(wide):
+                break
+            gaps[wide] |= self.gaps[position[wide] + byte].astype(np.int64) << (8 * byte)
+        base = np.where(blocks == first, 0, self.block_last[np.maximum(blocks - 1, 0)].astype(np.int64))
+        sums = np.cumsum(gaps)
+        ids = sums - np.repeat(sums[starts] - gaps[starts] - base, counts)
+        impacts = self.impacts[np.repeat(self.block_start[blocks], counts) + within]
+        return ids, impacts, counts
+
+    @staticmethod
+    def __merge(candidates, scores, ids, contributions, fresh) -> tuple:
+        """
+        Adds the contributions of postings to the candidates of the same document and appends the
+        postings marked `fresh` as new candidates. Both inputs are sorted by document id, so the stable
+        sort below is a linear merge of two runs.
+        """
+        keys = np.concatenate((candidates, ids))
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        values = np.concatenate((scores, contributions))[order]
+        keep = np.concatenate((np.ones(len(candidates), dtype=bool), fresh))[order]
+        merged = np.flatnonzero(keys[1:] == keys[:-1])
+        values[merged] += values[merged + 1]
+        keep[merged + 1] = False
+        return keys[keep], values[keep]
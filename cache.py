@@ -0,0 +1,417 @@
+"""
+Result caches for the SearchEngine: a thread-safe in-memory LRU with time-to-live, an on-disk
+SQLite cache shared by every process on the host, and a tiered combination of both.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+import tracing
+
+
+def normalize_query(query) -> str:
+    """
+    Normalizes a query so that trivially different spellings share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def document_id(doc) -> str:
+    """
+    Content hash identifying an article paragraph (several paragraphs share the same `url`).
+    """
+    if isinstance(doc, str):
+        return hashlib.sha1(doc.encode()).hexdigest()
+    return hashlib.sha1(f"{doc.get('url', '')}\n{doc['text']}".encode()).hexdigest()
+
+
+def cache_key(*parts) -> str:
+    """
+    Serializes the parts of a cache key into a string usable by every cache backend.
+    """
+    return json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+
+
+class CacheStats:
+    """
+    Counters of cache lookups and removals.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class NullCache:
+    """
+    Cache that stores nothing, used when caching is disabled.
+    """
+    def __init__(self):
+        self._stats = CacheStats()
+
+    def get(self, key, default=None):
+        self._stats.misses += 1
+        return default
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+    def stats(self) -> dict:
+        return dict(self._stats.as_dict(), size=0, maxsize=0)
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache evicting the least recently used entry beyond `maxsize` entries.
+    Entries older than `ttl` seconds are dropped on lookup.
+    """
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                self._stats.expirations += 1
+                self._stats.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return dict(self._stats.as_dict(), size=len(self), maxsize=self.maxsize)
+
+
+class SQLiteCache:
+    """
+    On-disk cache in a SQLite database (WAL mode), shared by every process and replica mounting the
+    same file, and surviving redeploys. Values are stored as JSON. Beyond `maxsize` entries, the least
+    recently accessed entries are evicted.
+    """
+    EVICTION_INTERVAL = 64
+
+    def __init__(self, path, maxsize=100000, ttl=None, table="cache"):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.RLock()
+        self._stats = CacheStats()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         "(key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)")
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)")
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats.misses += 1
+                return default
+            value, expires = row
+            if expires is not None and expires < now:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._stats.expirations += 1
+                self._stats.misses += 1
+                return default
+            self._db.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            self._stats.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._db.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False), expires, now))
+            self._writes += 1
+            if self._writes % self.EVICTION_INTERVAL == 0:
+                self.__evict()
+
+    def __evict(self):
+        # counting rows is linear in the table size, so the size limit is enforced every few writes
+        overflow = len(self) - self.maxsize
+        if overflow > 0:
+            self._db.execute(f"DELETE FROM {self.table} WHERE key IN "
+                             f"(SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)", (overflow,))
+            self._stats.evictions += overflow
+
+    def clear(self):
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> dict:
+        return dict(self._stats.as_dict(), size=len(self), maxsize=self.maxsize)
+
+
+class TieredCache:
+    """
+    In-memory LRU in front of a shared on-disk cache: lookups missing the front are served by the
+    back (and promoted), and writes go to both.
+    """
+    def __init__(self, front, back):
+        self.front = front
+        self.back = back
+
+    def get(self, key, default=None):
+        value = self.front.get(key)
+        if value is None:
+            value = self.back.get(key)
+            if value is None:
+                return default
+            self.front.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.front.set(key, value)
+        self.back.set(key, value)
+
+    def clear(self):
+        self.front.clear()
+        self.back.clear()
+
+    def __len__(self):
+        return len(self.back)
+
+    def stats(self) -> dict:
+        return {"memory": self.front.stats(), "disk": self.back.stats()}
+
+
+class GenerationCache:
+    """
+    Cache of generated answers with two tiers:
+    - exact: answers keyed on (model, temperature bucket, lang, ordered context document ids, normalized query).
+    - semantic (optional): reuses an answer generated for the same context when the cosine similarity
+      between the query embeddings is at least `threshold`. Kept in memory, for the `maxsize` most
+      recently used contexts.
+    Every answer stored after a lookup failed on both tiers counts as a miss.
+    """
+    def __init__(self, exact, threshold=None, maxsize=256, per_context=64):
+        self.exact = exact
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.per_context = per_context
+        self._semantic = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    @property
+    def semantic(self) -> bool:
+        return self.threshold is not None
+
+    @staticmethod
+    def context_key(model, temperature, lang, context) -> str:
+        """
+        Identifies a generation setting: the model, the temperature rounded to one decimal, the
+        answer language and the ordered ids of the context documents (dicts, strings or rerank results).
+        """
+        ids = [document_id(getattr(doc, "document", None) or doc) for doc in context]
+        return cache_key("generation", model, round(float(temperature), 1), lang, ids)
+
+    def get(self, context_key, query):
+        """
+        Looks up the answer generated for the exact (normalized) query.
+
+        Returns:
+        - dict: The cached {'text', 'latency'} entry, or None.
+        """
+        entry = self.exact.get(cache_key(context_key, normalize_query(query)))
+        return self.__hit(entry, semantic=False) if entry is not None else None
+
+    def get_similar(self, context_key, embedding):
+        """
+        Looks up the answer generated on the same context for the most similar query embedding.
+
+        Returns:
+        - dict: The cached {'text', 'latency'} entry if its similarity reaches the threshold, or None.
+        """
+        entry = self.__nearest(context_key, embedding) if self.semantic else None
+        return self.__hit(entry, semantic=True) if entry is not None else None
+
+    def set(self, context_key, query, text, latency, embedding=None):
+        """
+        Stores a generated answer and the seconds it took to generate.
+        """
+        entry = {"text": text, "latency": latency}
+        with self._lock:
+            self.misses += 1
+        self.exact.set(cache_key(context_key, normalize_query(query)), entry)
+        if self.semantic and embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            with self._lock:
+                vectors, entries = self._semantic.pop(context_key, (np.empty((0, len(vector)), np.float32), []))
+                vectors = np.vstack([vectors, vector])[-self.per_context:]
+                entries = (entries + [entry])[-self.per_context:]
+                self._semantic[context_key] = (vectors, entries)
+                while len(self._semantic) > self.maxsize:
+                    self._semantic.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0,
+            "latency_saved": self.latency_saved,
+            "exact": self.exact.stats(),
+            "semantic_contexts": len(self._semantic),
+        }
+
+    def __nearest(self, context_key, embedding):
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            if context_key not in self._semantic:
+                return None
+            self._semantic.move_to_end(context_key)
+            vectors, entries = self._semantic[context_key]
+        similarities = vectors @ query
+        best = int(np.argmax(similarities))
+        return entries[best] if similarities[best] >= self.threshold else None
+
+    def __hit(self, entry, semantic):
+        with self._lock:
+            if semantic:
+                self.hits_semantic += 1
+            else:
+                self.hits_exact += 1
+            self.latency_saved += entry["latency"]
+        return entry
+
+
+def create_cache(backend="memory", path=None, maxsize=1024, ttl=None, table="cache"):
+    """
+    Creates a cache from its configuration.
+
+    Parameters:
+    - backend (str, optional): 'memory', 'sqlite' (memory in front of SQLite) or 'none'. Default is 'memory'.
+    - path (str, optional): The SQLite database file, required by the 'sqlite' backend.
+    - maxsize (int, optional): The maximum number of entries. Default is 1024.
+    - ttl (float, optional): Seconds before an entry expires. Default is None (never).
+    - table (str, optional): The SQLite table, so that several caches can share a database file. Default is 'cache'.
+
+    Returns:
+    - The cache.
+    """
+    if backend == "none":
+        return NullCache()
+    if backend == "memory":
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+    if backend == "sqlite":
+        return TieredCache(LRUCache(maxsize=min(maxsize, 1024), ttl=ttl), SQLiteCache(path, maxsize=maxsize, ttl=ttl, table=table))
+    raise ValueError(f"Unknown cache backend '{backend}', expected 'memory', 'sqlite' or 'none'")
+
+
+def lookups(stats) -> tuple:
+    """
+    Returns:
+    - tuple: (hits, misses) of a cache from its `stats()`, whatever its kind: the disk tier of a
+      `TieredCache` serves the misses of its memory tier, and a `GenerationCache` hits exact or
+      semantic matches.
+    """
+    if "memory" in stats:
+        return stats["memory"]["hits"] + stats["disk"]["hits"], stats["disk"]["misses"]
+    if "hits_exact" in stats:
+        return stats["hits_exact"] + stats["hits_semantic"], stats["misses"]
+    return stats["hits"], stats["misses"]
+
+
+def cached_search(mode):
+    """
+    Decorates a (sync or async) `SearchEngine` retrieval method `(query, lang, top_n)` so that its
+    results are looked up in, and stored to, `self.cache`.
+
+    Parameters:
+    - mode (str): The search mode, part of the cache key.
+    """
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, query, lang='en', top_n=10):
+                key = cache_key(mode, normalize_query(query), lang, top_n)
+                result = self.cache.get(key)
+                tracing.current_span().set("cache.hit", result is not None)
+                if result is None:
+                    result = await method(self, query, lang=lang, top_n=top_n)
+                    self.cache.set(key, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, query, lang='en', top_n=10):
+            key = cache_key(mode, normalize_query(query), lang, top_n)
+            result = self.cache.get(key)
+            tracing.current_span().set("cache.hit", result is not None)
+            if result is None:
+                result = method(self, query, lang=lang, top_n=top_n)
+                self.cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,91 @@
+"""
+Client-side fusion of ranked result lists returned by the sparse (bm25) and dense (neartext) searches.
+"""
+import numpy as np
+
+
+def document_key(doc) -> tuple:
+    """
+    Identity of an article paragraph across result lists: several paragraphs share the same `url`.
+    """
+    return doc["url"], doc["text"]
+
+
+def reciprocal_rank_fusion(result_lists, top_n=10, k=60, weights=None) -> list:
+    """
+    Fuses result lists with Reciprocal Rank Fusion: score(d) = sum_i w_i / (k + rank_i(d)).
+
+    Parameters:
+    - result_lists (list): Lists of articles, each ordered by decreasing relevance.
+    - top_n (int, optional): The number of fused results to return. Default is 10.
+    - k (int, optional): RRF smoothing constant. Default is 60.
+    - weights (list, optional): Per-list weights. Default is 1 for every list.
+
+    Returns:
+    - list: Top articles by fused score, with the score in `_additional.score`.
+    """
+    weights = weights or [1.0] * len(result_lists)
+    docs, positions = _union(result_lists)
+    scores = np.zeros(len(docs))
+    for ids, weight in zip(positions, weights):
+        scores[ids] += weight / (k + np.arange(1, len(ids) + 1))
+    return _top(docs, scores, top_n)
+
+
+def weighted_score_fusion(sparse, dense, top_n=10, alpha=0.5) -> list:
+    """
+    Fuses bm25 and neartext results by a weighted sum of their min-max normalized scores, using
+    `_additional.score` for bm25 and `1 - _additional.distance` for neartext.
+
+    Parameters:
+    - sparse (list): Articles returned by the keyword search.
+    - dense (list): Articles returned by the semantic search.
+    - top_n (int, optional): The number of fused results to return. Default is 10.
+    - alpha (float, optional): Weight of the dense score, 1 - alpha weights the sparse score. Default is 0.5.
+
+    Returns:
+    - list: Top articles by fused score, with the score in `_additional.score`.
+    """
+    docs, (sparse_ids, dense_ids) = _union([sparse, dense])
+    scores = np.zeros(len(docs))
+    scores[sparse_ids] += (1 - alpha) * _normalize([_number(d["_additional"].get("score"), 0) for d in sparse])
+    scores[dense_ids] += alpha * _normalize([1 - _number(d["_additional"].get("distance"), 1) for d in dense])
+    return _top(docs, scores, top_n)
+
+
+def _union(result_lists) -> tuple:
+    """
+    Deduplicates articles across lists, returning them with each list's positions into the union.
+    """
+    index, docs, positions = {}, [], []
+    for results in result_lists:
+        ids = []
+        for doc in results:
+            i = index.setdefault(document_key(doc), len(docs))
+            if i == len(docs):
+                docs.append(doc)
+            ids.append(i)
+        positions.append(np.array(ids, dtype=np.intp))
+    return docs, positions
+
+
+def _number(value, default) -> float:
+    """
+    A score or distance of Weaviate (a number or its string), `default` when it is missing: a
+    distance of 0 is an exact match, not a missing one.
+    """
+    return default if value is None else float(value)
+
+
+def _normalize(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return values
+    spread = values.max() - values.min()
+    return (values - values.min()) / spread if spread > 0 else np.ones_like(values)
+
+
+def _top(docs, scores, top_n) -> list:
+    order = np.argsort(-scores, kind="stable")[:top_n]
+    return [dict(docs[i], _additional=dict(docs[i].get("_additional") or {}, score=str(score)))
+            for i, score in zip(order.tolist(), scores[order].tolist())]
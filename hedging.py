@@ -0,0 +1,159 @@
+"""
+Hedged requests: when a request has not completed after a high percentile of the recent latencies
+of its kind, a duplicate is sent and whichever completes first is used, the other being cancelled.
+Occasional slow responses (a busy shard, a garbage collection pause, a lost packet) then cost the
+hedge delay plus a normal response time instead of their full latency, for a few percent of extra
+requests (those slower than the percentile).
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    The latencies of the last `window` requests of a kind.
+    """
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+
+    def percentile(self, p) -> float:
+        return float(np.percentile(self.latencies, p))
+
+    def __len__(self):
+        return len(self.latencies)
+
+
+class Hedger:
+    """
+    Sends a second attempt of a request once the first has been pending for the `percentile` of
+    the recent latencies of its kind, bounded by `min_delay` and `max_delay`. Requests are not
+    hedged until `min_samples` latencies of their kind are known.
+
+    The latencies are those of the first attempts: a first attempt cancelled because the second
+    one completed first counts with the time it had been pending, a lower bound of its latency.
+    Leaving out these slowest attempts would lower the percentile, and hedge more requests than
+    `100 - percentile` percent of them.
+
+    Usage:
+        hedger = Hedger(percentile=95)
+        data = await hedger.call("neartext", lambda: transport.query(gql))
+    """
+    def __init__(self, percentile=95, window=1000, min_samples=20, min_delay=0.002, max_delay=1.0):
+        """
+        Parameters:
+        - percentile (float, optional): Percentile of the recent latencies after which a request is hedged. Default is 95.
+        - window (int, optional): Number of recent latencies per kind of request. Default is 1000.
+        - min_samples (int, optional): Latencies needed before hedging a kind of request. Default is 20.
+        - min_delay (float, optional): Smallest hedge delay, in seconds. Default is 0.002.
+        - max_delay (float, optional): Largest hedge delay, in seconds. Default is 1.
+        """
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def delay(self, name):
+        """
+        Returns:
+        - float: Seconds after which a request of this kind is hedged, or None while too few of its latencies are known.
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None or len(histogram) < self.min_samples:
+                return None
+            return min(self.max_delay, max(self.min_delay, histogram.percentile(self.percentile)))
+
+    async def call(self, name, fn):
+        """
+        Awaits `fn()`, and a second `fn()` if the first is slower than the hedge delay of `name`.
+
+        Parameters:
+        - name (str): The kind of request, whose latencies are tracked together.
+        - fn (callable): Returns a new awaitable of the request at every call.
+
+        Returns:
+        - The result of the first attempt to complete successfully. If both attempts fail, the
+          error of the first one is raised.
+        """
+        delay = self.delay(name)
+        self.__count(name, "calls")
+        primary = self.__attempt(name, fn, recorded=True)
+        if delay is None:
+            return await primary
+        primary = asyncio.ensure_future(primary)
+        primary.add_done_callback(_retrieve)
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        self.__count(name, "hedged")
+        backup = asyncio.ensure_future(self.__attempt(name, fn, recorded=False))
+        backup.add_done_callback(_retrieve)
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is backup:
+                            self.__count(name, "backup_won")
+                        return attempt.result()
+            # both failed
+            return primary.result()
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        - dict: For each kind of request, its `calls`, the `hedged` ones, those where the second
+          attempt completed first (`backup_won`), and the current hedge delay in ms (`delay_ms`).
+        """
+        with self._lock:
+            names = list(self._counters)
+        stats = {}
+        for name in names:
+            delay = self.delay(name)
+            with self._lock:
+                stats[name] = dict(self._counters[name], delay_ms=None if delay is None else delay * 1000)
+        return stats
+
+    async def __attempt(self, name, fn, recorded):
+        started = time.perf_counter()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # cancelled after the hedge won: at least this slow
+            if recorded:
+                self.__record(name, time.perf_counter() - started)
+            raise
+        if recorded:
+            self.__record(name, time.perf_counter() - started)
+        return result
+
+    def __record(self, name, latency):
+        with self._lock:
+            self._histograms.setdefault(name, LatencyHistogram(self.window)).record(latency)
+
+    def __count(self, name, counter):
+        with self._lock:
+            counters = self._counters.setdefault(name, {"calls": 0, "hedged": 0, "backup_won": 0})
+            counters[counter] += 1
+
+
+def _retrieve(attempt):
+    # the error of an attempt that lost, or failed after the other, is not raised to the caller:
+    # marks it as seen so that asyncio does not log it as never retrieved
+    if not attempt.cancelled():
+        attempt.exception()
@@ -0,0 +1,227 @@
+"""
+Hierarchical Navigable Small World (HNSW) graph for approximate nearest neighbor search over
+L2-normalized float32 or float16 vectors with cosine distance, as described by Malkov & Yashunin (2016).
+"""
+import heapq
+import json
+import math
+import os
+
+import numpy as np
+
+
+class HNSWIndex:
+    """
+    HNSW graph over the rows of a (possibly memory-mapped) matrix of L2-normalized vectors.
+    The bottom layer links every node to up to 2*M neighbors, upper layers to up to M neighbors.
+    """
+    def __init__(self, vectors, M=16, ef_construction=100):
+        # plain ndarray view of a memory map: same pages, without np.memmap's per-slice overhead
+        self.vectors = np.asarray(vectors)
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.levels = None
+        self.layer0 = None
+        self.upper = []
+        self.entry_point = None
+        self.max_level = -1
+
+    def __len__(self):
+        return 0 if self.levels is None else len(self.levels)
+
+    @classmethod
+    def build(cls, vectors, M=16, ef_construction=100, seed=42):
+        """
+        Builds the graph by inserting every row of `vectors` in order.
+
+        Parameters:
+        - vectors (np.ndarray): The L2-normalized vectors, shape (N, dim).
+        - M (int, optional): The number of neighbors per node on upper layers. Default is 16.
+        - ef_construction (int, optional): The size of the candidate list while inserting. Default is 100.
+        - seed (int, optional): Seed of the random level assignment. Default is 42.
+
+        Returns:
+        - HNSWIndex: The built index.
+        """
+        index = cls(vectors, M=M, ef_construction=ef_construction)
+        rng = np.random.default_rng(seed)
+        index.levels = np.floor(-np.log(1.0 - rng.random(len(vectors))) / math.log(M)).astype(np.int8)
+        index.upper = [{} for _ in range(int(index.levels.max(initial=0)))]
+        graph0 = {}
+        for node in range(len(vectors)):
+            index.__insert(node, graph0)
+        index.layer0 = np.full((len(vectors), index.M0), -1, dtype=np.int32)
+        for node, neighbors in graph0.items():
+            index.layer0[node, :len(neighbors)] = neighbors
+        index.upper = [{node: np.asarray(neighbors, dtype=np.int32) for node, neighbors in layer.items()}
+                       for layer in index.upper]
+        return index
+
+    def search(self, query, k=10, ef=64, allowed=None) -> tuple:
+        """
+        Finds the approximate k nearest neighbors of the query.
+
+        Parameters:
+        - query (np.ndarray): The L2-normalized query vector.
+        - k (int, optional): The number of neighbors to return. Default is 10.
+        - ef (int, optional): The size of the candidate list, trading speed for recall. Default is 64.
+        - allowed (np.ndarray, optional): Boolean mask of the nodes that may be returned. Default is None (all).
+
+        Returns:
+        - tuple: Node ids and cosine distances of the neighbors, closest first.
+        """
+        if self.entry_point is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        entry = [(self.__distances(query, [self.entry_point])[0], self.entry_point)]
+        for level in range(self.max_level, 0, -1):
+            entry = self.__search_layer(query, entry, 1, level)[:1]
+        found = self.__search_layer(query, entry, max(ef, k), 0, allowed)[:k]
+        return (np.array([node for _, node in found], dtype=np.int64),
+                np.array([distance for distance, _ in found], dtype=np.float32))
+
+    def save(self, path):
+        """
+        Saves the graph to a directory, with the bottom layer as a plain .npy file that can be memory-mapped.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "levels.npy"), self.levels)
+        np.save(os.path.join(path, "layer0.npy"), self.layer0)
+        upper = {}
+        for level, layer in enumerate(self.upper, start=1):
+            nodes = np.fromiter(layer.keys(), dtype=np.int32, count=len(layer))
+            adjacency = np.full((len(layer), self.M), -1, dtype=np.int32)
+            for row, neighbors in enumerate(layer.values()):
+                adjacency[row, :len(neighbors)] = neighbors
+            upper[f"nodes{level}"] = nodes
+            upper[f"adjacency{level}"] = adjacency
+        np.savez(os.path.join(path, "upper.npz"), **upper)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"M": self.M, "ef_construction": self.ef_construction,
+                       "entry_point": self.entry_point, "max_level": self.max_level}, f)
+
+    @classmethod
+    def load(cls, path, vectors, mmap_mode="r"):
+        """
+        Loads a graph saved with `save`.
+
+        Parameters:
+        - path (str): The graph directory.
+        - vectors (np.ndarray): The vectors the graph was built on.
+        - mmap_mode (str, optional): Memory-map mode of the bottom layer. Default is 'r'.
+
+        Returns:
+        - HNSWIndex: The loaded index.
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        index = cls(vectors, M=meta["M"], ef_construction=meta["ef_construction"])
+        index.entry_point = meta["entry_point"]
+        index.max_level = meta["max_level"]
+        index.levels = np.load(os.path.join(path, "levels.npy"), mmap_mode=mmap_mode)
+        index.layer0 = np.load(os.path.join(path, "layer0.npy"), mmap_mode=mmap_mode)
+        with np.load(os.path.join(path, "upper.npz")) as upper:
+            index.upper = []
+            for level in range(1, index.max_level + 1):
+                nodes, adjacency = upper[f"nodes{level}"], upper[f"adjacency{level}"]
+                index.upper.append({int(node): row[row >= 0] for node, row in zip(nodes, adjacency)})
+        return index
+
+    def __rows(self, nodes) -> np.ndarray:
+        return np.asarray(self.vectors[nodes], dtype=np.float32)
+
+    def __distances(self, query, nodes) -> list:
+        return (1.0 - self.__rows(nodes) @ query).tolist()
+
+    def __neighbors(self, level, node, graph0=None):
+        if level > 0:
+            return self.upper[level - 1].get(node, ())
+        if graph0 is not None:
+            return graph0.get(node, ())
+        row = self.layer0[node]
+        return row[row >= 0].tolist()
+
+    def __search_layer(self, query, entry, ef, level, allowed=None, graph0=None) -> list:
+        """
+        Best-first search of one layer from the (distance, node) entry points, returning up to `ef`
+        (distance, node) pairs sorted by distance. Nodes outside `allowed` are traversed but not returned.
+        """
+        visited = {node for _, node in entry}
+        candidates = list(entry)
+        heapq.heapify(candidates)
+        results = [(-distance, node) for distance, node in entry if allowed is None or allowed[node]]
+        heapq.heapify(results)
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if len(results) >= ef and distance > -results[0][0]:
+                break
+            neighbors = [n for n in self.__neighbors(level, node, graph0) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            distances = 1.0 - self.__rows(neighbors) @ query
+            if len(results) >= ef:
+                closer = np.flatnonzero(distances < -results[0][0])
+                neighbors = [neighbors[i] for i in closer]
+                distances = distances[closer]
+            for distance, neighbor in zip(distances.tolist(), neighbors):
+                if len(results) < ef or distance < -results[0][0]:
+                    heapq.heappush(candidates, (distance, neighbor))
+                    if allowed is None or allowed[neighbor]:
+                        heapq.heappush(results, (-distance, neighbor))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+        return sorted((-distance, node) for distance, node in results)
+
+    def __select(self, candidates, m) -> list:
+        """
+        Neighbor selection heuristic: keeps a candidate only if it is closer to the base node than to
+        every neighbor already kept, then fills up with the closest discarded candidates.
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+        nodes = [node for _, node in candidates]
+        distances = np.array([distance for distance, _ in candidates], dtype=np.float32)
+        vectors = self.__rows(nodes)
+        between = 1.0 - vectors @ vectors.T
+        alive = np.ones(len(nodes), dtype=bool)
+        kept = []
+        for i in range(len(nodes)):
+            if alive[i]:
+                kept.append(i)
+                if len(kept) == m:
+                    break
+                alive &= between[i] > distances
+        if len(kept) < m:
+            chosen = set(kept)
+            kept += [i for i in range(len(nodes)) if i not in chosen][:m - len(kept)]
+        return [nodes[i] for i in kept]
+
+    def __connect(self, level, node, neighbors, graph0):
+        layer = graph0 if level == 0 else self.upper[level - 1]
+        m = self.M0 if level == 0 else self.M
+        layer[node] = list(neighbors)
+        for neighbor in neighbors:
+            links = layer[neighbor]
+            links.append(node)
+            if len(links) > m:
+                distances = self.__distances(self.__rows(neighbor), links)
+                layer[neighbor] = self.__select(sorted(zip(distances, links)), m)
+
+    def __insert(self, node, graph0):
+        query = self.__rows(node)
+        level = int(self.levels[node])
+        if self.entry_point is not None:
+            entry = [(self.__distances(query, [self.entry_point])[0], self.entry_point)]
+            for current in range(self.max_level, level, -1):
+                entry = self.__search_layer(query, entry, 1, current)[:1]
+            for current in range(min(level, self.max_level), -1, -1):
+                found = self.__search_layer(query, entry, self.ef_construction, current, graph0=graph0)
+                self.__connect(current, node, self.__select(found, self.M), graph0)
+                entry = found
+        for current in range(max(self.max_level + 1, 0), level + 1):
+            layer = graph0 if current == 0 else self.upper[current - 1]
+            layer[node] = []
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
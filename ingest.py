@@ -0,0 +1,496 @@
+"""
+Offline ingestion of a Wikipedia corpus: streams a MediaWiki XML dump or a JSON lines file of
+paragraphs, chunks the text into passages, embeds them with Cohere in large batches with bounded
+concurrency, and writes them to the local vector store or imports them into Weaviate.
+
+Memory stays bounded: records are read lazily and at most `concurrency` batches are in flight,
+and only the next passage position of each url is kept (see `passages`).
+Batches are written in input order and a checkpoint records the number of input records whose
+passages are all written, so an interrupted ingestion resumes from its last checkpoint. The hashes
+of the written passages are recorded for later incremental updates (see `update.py`).
+"""
+import asyncio
+import bz2
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from urllib.parse import quote
+
+import numpy as np
+from weaviate.util import generate_uuid5
+
+import resilience
+import vectorstore
+from loader import BulkLoader
+
+CHUNK_WORDS = 200
+PROPERTIES = ["text", "title", "url", "views", "lang"]
+HASHES_FILE = "hashes.sqlite"
+
+COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+REF = re.compile(r"<ref[^>]*/>|<ref[^>]*>.*?</ref>", re.DOTALL | re.IGNORECASE)
+TEMPLATE = re.compile(r"\{\{[^{}]*\}\}")
+TABLE = re.compile(r"\{\|.*?\|\}", re.DOTALL)
+NAMESPACED_LINK = re.compile(r"\[\[[^\[\]|:]+:(?:[^\[\]]|\[\[[^\[\]]*\]\])*\]\]")
+LINK = re.compile(r"\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]")
+EXTERNAL_LINK = re.compile(r"\[[a-z]+://[^\s\]]*\s?([^\]]*)\]")
+HEADING = re.compile(r"^=+.*?=+\s*$", re.MULTILINE)
+TAG = re.compile(r"<[^>]+>")
+EMPHASIS = re.compile(r"'{2,}")
+LIST_MARKER = re.compile(r"^[*#:;]+\s*", re.MULTILINE)
+
+
+def open_text(path):
+    """
+    Opens a text file for reading, decompressing .gz and .bz2 files on the fly.
+    """
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def read_jsonl(path):
+    """
+    Streams the records of a JSON lines file with `text`, `title`, `url`, `views` and `lang`
+    (and optionally a unique passage `id`).
+    """
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def clean_wikitext(text) -> str:
+    """
+    Strips the markup of a wikitext article, keeping the prose: templates, tables, references,
+    files and categories are dropped, links are replaced with their label and headings with
+    paragraph breaks.
+    """
+    text = REF.sub("", COMMENT.sub("", text))
+    previous = None
+    while previous != text:
+        previous, text = text, TEMPLATE.sub("", text)
+    text = TABLE.sub("", text)
+    text = NAMESPACED_LINK.sub("", text)
+    text = LINK.sub(r"\1", text)
+    text = EXTERNAL_LINK.sub(r"\1", text)
+    text = HEADING.sub("\n", text)
+    text = EMPHASIS.sub("", TAG.sub("", text))
+    return LIST_MARKER.sub("", text)
+
+
+def read_dump(path, lang):
+    """
+    Streams the articles of a MediaWiki XML dump (e.g. enwiki-latest-pages-articles.xml.bz2),
+    skipping redirects and pages outside the main namespace. Dumps have no page views, so `views` is 0.
+
+    Parameters:
+    - path (str): The dump, optionally compressed.
+    - lang (str): The language code of the Wikipedia edition.
+    """
+    with open_text(path) as f:
+        events = ET.iterparse(f, events=("start", "end"))
+        _, root = next(events)
+        for event, element in events:
+            if event != "end" or element.tag.rsplit("}", 1)[-1] != "page":
+                continue
+            fields = {child.tag.rsplit("}", 1)[-1]: child for child in element.iter()}
+            if fields.get("ns") is not None and fields["ns"].text == "0" and "redirect" not in fields:
+                title = fields["title"].text or ""
+                yield {
+                    "text": clean_wikitext(fields["text"].text or "") if "text" in fields else "",
+                    "title": title,
+                    "url": f"https://{lang}.wikipedia.org/wiki/{quote(title.replace(' ', '_'))}",
+                    "views": 0,
+                    "lang": lang,
+                }
+            # drop the parsed pages, so that memory does not grow with the dump
+            root.clear()
+
+
+def read_corpus(path, lang=None):
+    """
+    Streams the records of a MediaWiki XML dump (.xml, .xml.bz2, .xml.gz, requires `lang`) or of a
+    JSON lines file.
+    """
+    if re.search(r"\.xml(\.bz2|\.gz)?$", path):
+        if not lang:
+            raise ValueError("The language of a Wikipedia dump is required")
+        return read_dump(path, lang)
+    return read_jsonl(path)
+
+
+def chunk(text, max_words=CHUNK_WORDS) -> list:
+    """
+    Splits a text into passages of at most `max_words` words: consecutive paragraphs are packed
+    together, and longer paragraphs are cut into consecutive windows.
+
+    Parameters:
+    - text (str): The text, with paragraphs separated by blank lines.
+    - max_words (int, optional): The maximum number of words per passage. Default is 200.
+
+    Returns:
+    - list: The passages.
+    """
+    passages, current = [], []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if current and len(current) + len(words) > max_words:
+            passages.append(" ".join(current))
+            current = []
+        while len(words) > max_words:
+            passages.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        current += words
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def passages(records, max_words=CHUNK_WORDS):
+    """
+    Chunks records into passages, identified by their url and their position among the passages of
+    every record with that url so far (e.g. '<url>#3'), or by the record `id` when there is one
+    (suffixed with the position within the record if it has several passages). The records of a
+    url need not be consecutive: the passages of a url that comes back later in the input follow
+    its earlier ones, instead of overwriting them.
+
+    Returns:
+    - generator: (record number, list of passages) tuples, one per record.
+    """
+    # the position of the next passage of every url
+    positions = {}
+    for number, record in enumerate(records):
+        url = record["url"]
+        position = positions.get(url, 0)
+        texts = chunk(record["text"], max_words)
+        found = []
+        for i, text in enumerate(texts):
+            passage = {key: record[key] for key in PROPERTIES}
+            passage["text"] = text
+            if "id" not in record:
+                passage["id"] = f"{url}#{position + i}"
+            else:
+                passage["id"] = str(record["id"]) if len(texts) == 1 else f"{record['id']}#{i}"
+            found.append(passage)
+        positions[url] = position + len(texts)
+        yield number, found
+
+
+def batches(chunked, batch_size=96, skip=0):
+    """
+    Groups the passages of whole records into batches of at least `batch_size` passages (or the rest).
+
+    Parameters:
+    - chunked (generator): The (record number, passages) tuples of `passages`.
+    - batch_size (int, optional): The number of passages per batch. Default is 96.
+    - skip (int, optional): The number of records already ingested. Default is 0.
+
+    Returns:
+    - generator: (number of records ingested after the batch, passages) tuples.
+    """
+    batch, end, last = [], skip, skip
+    for number, found in chunked:
+        if number < skip:
+            continue
+        batch += found
+        end = number + 1
+        if len(batch) >= batch_size:
+            yield end, batch
+            batch, last = [], end
+    # trailing records, possibly without any passage
+    if end > last:
+        yield end, batch
+
+
+def cohere_embedder(client, model, concurrency=8, max_texts=96, retry_policy=None):
+    """
+    Wraps a `cohere.AsyncClient` into an async function embedding a list of texts, in requests of
+    at most `max_texts` texts with at most `concurrency` requests in flight. Requests are retried
+    on transient errors only, so that a bad request or key fails the ingestion at once.
+
+    Parameters:
+    - retry_policy (resilience.RetryPolicy, optional): The retries of each request. Default is None
+      (5 attempts within 120s, with backoffs of 1s to 5s).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    retry_policy = retry_policy or resilience.RetryPolicy(max_attempts=5, deadline=120.0, base_delay=1.0, max_delay=5.0)
+
+    async def request(texts):
+        async with semaphore:
+            response = await retry_policy.acall("embed", lambda: client.embed(texts=texts, model=model))
+            return response.embeddings
+
+    async def embed(texts):
+        results = await asyncio.gather(*(request(texts[start:start + max_texts])
+                                         for start in range(0, len(texts), max_texts)))
+        return [vector for result in results for vector in result]
+    return embed
+
+
+def load_checkpoint(path, source) -> dict:
+    """
+    Reads the ingestion checkpoint of an input.
+
+    Parameters:
+    - path (str): The checkpoint file.
+    - source (str): The input being ingested.
+
+    Returns:
+    - dict: The `records` and `passages` ingested so far and whether the ingestion is `done`.
+    """
+    if not os.path.exists(path):
+        return {"source": source, "records": 0, "passages": 0, "done": False}
+    with open(path) as f:
+        state = json.load(f)
+    if state["source"] != source:
+        raise ValueError(f"Checkpoint {path} belongs to {state['source']}, not {source}")
+    return state
+
+
+def save_checkpoint(path, state):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def passage_hashes(passage) -> tuple:
+    """
+    The hash of the text of a passage, which its embedding depends on, and of its other properties.
+    """
+    text = hashlib.sha1(passage["text"].encode("utf-8")).hexdigest()
+    properties = json.dumps([passage[key] for key in PROPERTIES if key != "text"], ensure_ascii=False)
+    return text, hashlib.sha1(properties.encode("utf-8")).hexdigest()
+
+
+class PassageHashes:
+    """
+    The hashes of the ingested passages (see `passage_hashes`) in a SQLite database, by passage id
+    (the url and position of the passage, see `passages`), so that `update.py` can tell which
+    passages of a newer dump changed. Every ingestion or update is a run, and each passage records
+    the last run that wrote or saw it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # a commit per batch without an fsync, which WAL keeps consistent on a crash
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS passages "
+                         "(id TEXT PRIMARY KEY, url TEXT, text_hash TEXT, properties_hash TEXT, run INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS passages_url ON passages (url)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, started REAL)")
+        # the urls found in the input of the current run
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY)")
+        self._db.commit()
+        self.run = self._db.execute("SELECT COALESCE(MAX(run), 0) FROM runs").fetchone()[0]
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+
+    def copy(self, path):
+        """
+        Copies the database to a new file.
+
+        Returns:
+        - PassageHashes: The copy.
+        """
+        copy = PassageHashes(path)
+        self._db.backup(copy._db)
+        copy.run = self.run
+        return copy
+
+    def begin_run(self) -> int:
+        """
+        Starts a new run, forgetting the urls seen by the previous one.
+        """
+        self._db.execute("DELETE FROM seen")
+        self.run = self._db.execute("INSERT INTO runs (started) VALUES (?)", (time.time(),)).lastrowid
+        self._db.commit()
+        return self.run
+
+    def lookup(self, ids) -> dict:
+        """
+        The recorded (text hash, properties hash) of the given passage ids that are known.
+        """
+        ids = list(ids)
+        found = {}
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            found.update((id, (text, properties)) for id, text, properties in self._db.execute(
+                f"SELECT id, text_hash, properties_hash FROM passages WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk))
+        return found
+
+    def see(self, urls, ids):
+        """
+        Records that the input of the current run holds the given urls and (unchanged) passage ids.
+        """
+        self._db.executemany("INSERT OR IGNORE INTO seen (url) VALUES (?)", ((url,) for url in urls))
+        self._db.executemany("UPDATE passages SET run = ? WHERE id = ?", ((self.run, id) for id in ids))
+        self._db.commit()
+
+    def record(self, passages):
+        """
+        Records the hashes of written passages.
+        """
+        self._db.executemany("INSERT OR REPLACE INTO passages (id, url, text_hash, properties_hash, run) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             ((p["id"], p["url"], *passage_hashes(p), self.run) for p in passages))
+        self._db.commit()
+
+    def stale(self, everywhere=False) -> list:
+        """
+        The passage ids that the input of the current run no longer holds: those of the seen urls
+        past their new last passage, or every passage not seen when the input is a full corpus.
+        """
+        if everywhere:
+            rows = self._db.execute("SELECT id FROM passages WHERE run < ?", (self.run,))
+        else:
+            rows = self._db.execute("SELECT p.id FROM passages p JOIN seen s ON p.url = s.url WHERE p.run < ?",
+                                    (self.run,))
+        return [id for id, in rows]
+
+    def remove(self, ids):
+        """
+        Forgets deleted passages.
+        """
+        self._db.executemany("DELETE FROM passages WHERE id = ?", ((id,) for id in ids))
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+class StoreSink:
+    """
+    Writes the passages to the vector store of a local index directory.
+    """
+    def __init__(self, path, dtype="float32", resume_at=0, hashes=None):
+        self.path = path
+        self.dtype = dtype
+        self.hashes = hashes
+        self.writer = vectorstore.VectorStoreWriter.resume(path, resume_at) if resume_at else None
+
+    def write(self, vectors, passages):
+        if self.writer is None:
+            self.writer = vectorstore.VectorStoreWriter(self.path, len(vectors[0]), dtype=self.dtype)
+        self.writer.append(np.asarray(vectors, dtype=np.float32), [{key: p[key] for key in PROPERTIES} for p in passages],
+                           ids=[p["id"] for p in passages])
+        if self.hashes is not None:
+            self.hashes.record(passages)
+
+    def checkpoint(self):
+        if self.writer is not None:
+            self.writer.checkpoint()
+
+    def close(self):
+        if self.writer is not None:
+            store = self.writer.close()
+            logging.info(f"Wrote {len(store)} passages to {self.path}")
+
+
+class WeaviateSink:
+    """
+    Imports the passages into a Weaviate class with a `loader.BulkLoader`. Object uuids derive
+    from the passage ids, so passages imported again after a resume overwrite the same objects.
+    The hashes of the passages are recorded at checkpoints, once the loader has imported them,
+    and only for those it did not fail, so that an update adds the failed ones again.
+    """
+    def __init__(self, client, class_name="Articles", workers=4, batch_size=100, hashes=None):
+        self.class_name = class_name
+        self.hashes = hashes
+        self.loader = BulkLoader(client, class_name, workers=workers, batch_size=batch_size)
+        self.written = []
+
+    def write(self, vectors, passages):
+        for vector, passage in zip(vectors, passages):
+            self.loader.add({key: passage[key] for key in PROPERTIES}, vector=vector,
+                            uuid=generate_uuid5(passage["id"]))
+        if self.hashes is not None:
+            self.written.extend(passages)
+
+    def checkpoint(self):
+        rejected = self.loader.flush()
+        written, self.written = self.written, []
+        if self.hashes is not None:
+            self.hashes.record(p for p in written if generate_uuid5(p["id"]) not in rejected)
+
+    def close(self):
+        self.checkpoint()
+        self.loader.close()
+        failed = self.loader.stats()["failed"]
+        if failed:
+            logging.warning(f"{failed} passages failed to import into {self.class_name}")
+
+
+async def aingest(records, sink, embed, checkpoint=None, state=None, batch_size=96, concurrency=8,
+                  max_words=CHUNK_WORDS, checkpoint_every=10000) -> dict:
+    """
+    Chunks, embeds and writes a stream of records. Batches are embedded concurrently, and written
+    to the sink in input order.
+
+    Parameters:
+    - records (iterable): The records (`text`, `title`, `url`, `views`, `lang`), e.g. from `read_corpus`.
+    - sink (StoreSink | WeaviateSink): Where the passages are written.
+    - embed (coroutine function): Embeds a list of texts, e.g. from `cohere_embedder`.
+    - checkpoint (str, optional): The checkpoint file. Default is None (no checkpoints).
+    - state (dict, optional): The checkpoint to resume from, from `load_checkpoint`. Default is None (start over).
+    - batch_size (int, optional): Passages per batch. Default is 96.
+    - concurrency (int, optional): Batches embedded concurrently. Default is 8.
+    - max_words (int, optional): The maximum number of words per passage. Default is 200.
+    - checkpoint_every (int, optional): Passages written between checkpoints. Default is 10000.
+
+    Returns:
+    - dict: The final state, with the throughput of this run in `docs_per_sec` and `passages_per_sec`.
+    """
+    state = dict(state or {"records": 0, "passages": 0, "done": False})
+    loop = asyncio.get_running_loop()
+    started, first = time.perf_counter(), dict(state)
+    pending, checkpointed = deque(), state["passages"]
+
+    def progress():
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        state["docs_per_sec"] = (state["records"] - first["records"]) / elapsed
+        state["passages_per_sec"] = (state["passages"] - first["passages"]) / elapsed
+        logging.info(f"Ingested {state['records']} docs ({state['passages']} passages): "
+                     f"{state['docs_per_sec']:.1f} docs/s, {state['passages_per_sec']:.1f} passages/s")
+
+    async def save():
+        await loop.run_in_executor(None, sink.checkpoint)
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, {key: state[key] for key in ("source", "records", "passages", "done")
+                                         if key in state})
+        progress()
+
+    async def drain():
+        nonlocal checkpointed
+        end, batch, vectors = pending.popleft()
+        vectors = await vectors
+        if batch:
+            await loop.run_in_executor(None, sink.write, vectors, batch)
+        state["records"], state["passages"] = end, state["passages"] + len(batch)
+        if state["passages"] - checkpointed >= checkpoint_every:
+            await save()
+            checkpointed = state["passages"]
+
+    for end, batch in batches(passages(records, max_words), batch_size, skip=state["records"]):
+        pending.append((end, batch, asyncio.ensure_future(embed([passage["text"] for passage in batch]))))
+        if len(pending) >= concurrency:
+            await drain()
+    while pending:
+        await drain()
+    state["done"] = True
+    await save()
+    await loop.run_in_executor(None, sink.close)
+    return state
@@ -0,0 +1,317 @@
+"""
+Bulk import into a Weaviate class (e.g. the `Articles` class queried by `SearchEngine`) on top of
+an existing `weaviate.Client`.
+
+Objects are queued by the caller and posted to `/v1/batch/objects` by several worker threads. The
+batch size adapts to the server (additive increase while batches finish under the target latency,
+multiplicative decrease when they are slow or fail), and so does the number of batches in flight:
+server errors (429, 5xx, timeouts, lost connections) halve it and pause every worker with an
+exponential backoff before the batch is retried, and it grows back as batches succeed. The queue
+is bounded, so a slow server blocks the producer instead of buffering the whole corpus.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import requests
+from weaviate.batch.requests import ObjectsBatchRequest
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class BatchSizer:
+    """
+    Additive increase / multiplicative decrease of the batch size, from the latency and outcome of
+    each batch.
+    """
+    def __init__(self, initial=100, minimum=10, maximum=1000, target_latency=1.0, step=None, decrease=0.5):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.step = step or max(minimum, initial // 10)
+        self.decrease = decrease
+        self._lock = threading.Lock()
+
+    def success(self, latency):
+        with self._lock:
+            if latency <= self.target_latency:
+                self.size = min(self.maximum, self.size + self.step)
+            else:
+                self.size = max(self.minimum, int(self.size * self.target_latency / latency))
+
+    def failure(self):
+        with self._lock:
+            self.size = max(self.minimum, int(self.size * self.decrease))
+
+
+class LoaderStats:
+    """
+    Counters of a `BulkLoader`, and the latency of its most recent batches.
+    """
+    def __init__(self, window=1000):
+        self.started = time.perf_counter()
+        self.objects = 0
+        self.failed = 0
+        self.batches = 0
+        self.retries = 0
+        self.errors = {}
+        self.latencies = deque(maxlen=window)
+        self.sizes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def batch(self, size, latency, failed):
+        with self._lock:
+            self.batches += 1
+            self.objects += size - failed
+            self.failed += failed
+            self.latencies.append(latency)
+            self.sizes.append(size)
+
+    def error(self, kind, retried):
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            self.retries += retried
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+            return {
+                "objects": self.objects,
+                "failed": self.failed,
+                "batches": self.batches,
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "objects_per_sec": self.objects / elapsed if elapsed else 0.0,
+                "mean_batch_size": float(np.mean(self.sizes)) if self.sizes else 0.0,
+                "batch_latency_p50": float(np.percentile(latencies, 50)),
+                "batch_latency_p95": float(np.percentile(latencies, 95)),
+            }
+
+
+class BulkLoader:
+    """
+    Imports objects into a Weaviate class with parallel, dynamically sized batches.
+
+    Usage:
+        with BulkLoader(client, "Articles", workers=8) as loader:
+            for properties, vector, uuid in objects:
+                loader.add(properties, vector=vector, uuid=uuid)
+        print(loader.stats())
+    """
+    def __init__(self, client, class_name="Articles", workers=4, batch_size=100, min_batch_size=10,
+                 max_batch_size=1000, target_latency=1.0, max_retries=5, max_backoff=30.0, linger=0.05,
+                 on_result=None):
+        """
+        Parameters:
+        - client (weaviate.Client): The client whose connection (url, authentication, headers) is used.
+        - class_name (str, optional): The class of the objects. Default is 'Articles'.
+        - workers (int, optional): The number of threads sending batches. Default is 4.
+        - batch_size (int, optional): The initial number of objects per batch. Default is 100.
+        - min_batch_size (int, optional): The smallest batch size. Default is 10.
+        - max_batch_size (int, optional): The largest batch size. Default is 1000.
+        - target_latency (float, optional): Seconds per batch above which batches shrink. Default is 1.0.
+        - max_retries (int, optional): Retries of a batch after server errors. Default is 5.
+        - max_backoff (float, optional): The longest pause after server errors, in seconds. Default is 30.
+        - linger (float, optional): Seconds a worker waits for a batch to fill up. Default is 0.05.
+        - on_result (callable, optional): Called with the per-object results of every batch. Default is None.
+        """
+        self.client = client
+        self.class_name = class_name
+        self.sizer = BatchSizer(batch_size, min_batch_size, max_batch_size, target_latency)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.linger = linger
+        self.on_result = on_result
+        self.__stats = LoaderStats()
+        # uuids of the objects that failed since the last flush
+        self.__rejected = set()
+        self.__rejected_lock = threading.Lock()
+        self.__queue = queue.Queue(maxsize=2 * workers * max_batch_size)
+        self.__stop = threading.Event()
+        self.__backoff_lock = threading.Lock()
+        self.__resume_at = 0.0
+        self.__consecutive_errors = 0
+        self.__slots = threading.Condition()
+        self.__concurrency = float(workers)
+        self.__in_flight = 0
+        self.workers = workers
+        self.__workers = [threading.Thread(target=self.__work, name=f"bulk-loader-{i}", daemon=True)
+                          for i in range(workers)]
+        for worker in self.__workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, properties, vector=None, uuid=None):
+        """
+        Queues an object, blocking while the queue is full.
+
+        Parameters:
+        - properties (dict): The properties of the object.
+        - vector (list, optional): Its vector. Default is None (vectorized by the server).
+        - uuid (str, optional): Its uuid, replacing an existing object with the same uuid. Default is None (random).
+        """
+        self.__queue.put((properties, vector, uuid))
+
+    def flush(self) -> set:
+        """
+        Blocks until every queued object is imported (or failed).
+
+        Returns:
+        - set: The uuids of the objects that failed since the previous flush, i.e. that are not
+          (or not certainly) in the class.
+        """
+        self.__queue.join()
+        with self.__rejected_lock:
+            rejected, self.__rejected = self.__rejected, set()
+        return rejected
+
+    def close(self):
+        """
+        Flushes the queue and stops the workers.
+        """
+        self.flush()
+        self.__stop.set()
+        for worker in self.__workers:
+            worker.join()
+        stats = self.stats()
+        logging.info(f"Imported {stats['objects']} objects into {self.class_name} "
+                     f"({stats['failed']} failed, {stats['objects_per_sec']:.0f} objects/s)")
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        - dict: Imported and failed objects, batches, retries, errors by kind, objects/sec, the current
+          and mean batch size, the current limit of batches in flight, and the p50/p95 latency of the
+          recent batches.
+        """
+        return dict(self.__stats.as_dict(), batch_size=self.sizer.size, concurrency=int(self.__concurrency))
+
+    def __work(self):
+        while not self.__stop.is_set():
+            items = self.__take(self.sizer.size)
+            if not items:
+                continue
+            try:
+                self.__send(items)
+            except Exception as error:
+                logging.error(f"Batch of {len(items)} objects failed: {error!r}")
+                self.__reject(uuid for _, _, uuid in items)
+                self.__stats.batch(len(items), 0.0, len(items))
+            finally:
+                for _ in items:
+                    self.__queue.task_done()
+
+    def __take(self, size):
+        try:
+            items = [self.__queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.linger
+        while len(items) < size:
+            try:
+                items.append(self.__queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return items
+
+    def __send(self, items, attempt=0):
+        body = ObjectsBatchRequest()
+        for properties, vector, uuid in items:
+            body.add(properties, self.class_name, uuid=uuid, vector=vector)
+        self.__wait_backoff()
+        self.__acquire()
+        started = time.perf_counter()
+        try:
+            # the client's own `batch` keeps a single shared buffer, so each worker posts its
+            # requests on the client's (pooled, authenticated) connection instead
+            response = self.client._connection.post(path="/batch/objects", weaviate_object=body.get_request_body())
+        except (requests.ConnectionError, requests.Timeout) as error:
+            kind, status = type(error).__name__, None
+        else:
+            kind, status = f"http_{response.status_code}", response.status_code
+        finally:
+            latency = time.perf_counter() - started
+            self.__release()
+        if status == 200:
+            self.__succeeded(items, response.json(), latency)
+            return
+        if (status is not None and status not in RETRYABLE_STATUS) or attempt >= self.max_retries:
+            reason = response.text[:200] if status is not None else kind
+            logging.error(f"Batch of {len(items)} objects failed after {attempt} retries: {reason}")
+            self.__stats.error(kind, 0)
+            self.__reject(uuid for _, _, uuid in items)
+            self.__stats.batch(len(items), latency, len(items))
+            return
+        self.__stats.error(kind, 1)
+        self.__failed(status)
+        # retried in batches of the reduced size
+        size = self.sizer.size
+        for start in range(0, len(items), size):
+            self.__send(items[start:start + size], attempt + 1)
+
+    def __succeeded(self, items, results, latency):
+        rejected = [result for result in results if (result.get("result") or {}).get("errors")]
+        if rejected:
+            logging.warning(f"{len(rejected)} of {len(items)} objects rejected by Weaviate, "
+                            f"e.g. {rejected[0]['result']['errors']}")
+            self.__reject(result.get("id") for result in rejected)
+        if self.on_result is not None:
+            self.on_result(results)
+        self.__stats.batch(len(items), latency, len(rejected))
+        self.sizer.success(latency)
+        with self.__slots:
+            # grows by about one batch in flight per round of successful batches
+            self.__concurrency = min(float(self.workers), self.__concurrency + 1.0 / self.__concurrency)
+            self.__slots.notify_all()
+        with self.__backoff_lock:
+            self.__consecutive_errors = 0
+
+    def __reject(self, uuids):
+        with self.__rejected_lock:
+            self.__rejected.update(str(uuid) for uuid in uuids if uuid is not None)
+
+    def __failed(self, status):
+        # a 429 asks for fewer requests, other errors may also come from batches too large to
+        # finish in time
+        if status != 429:
+            self.sizer.failure()
+        with self.__slots:
+            self.__concurrency = max(1.0, self.__concurrency / 2)
+        # every worker pauses, since the server is overloaded rather than this batch being wrong;
+        # the batches that failed together only count once
+        with self.__backoff_lock:
+            now = time.monotonic()
+            if now < self.__resume_at:
+                return
+            self.__consecutive_errors += 1
+            backoff = min(self.max_backoff, 0.1 * 2 ** self.__consecutive_errors) * (0.5 + np.random.random() / 2)
+            self.__resume_at = now + backoff
+
+    def __acquire(self):
+        with self.__slots:
+            while self.__in_flight >= int(self.__concurrency):
+                self.__slots.wait()
+            self.__in_flight += 1
+
+    def __release(self):
+        with self.__slots:
+            self.__in_flight -= 1
+            self.__slots.notify()
+
+    def __wait_backoff(self):
+        while True:
+            with self.__backoff_lock:
+                delay = self.__resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
@@ -0,0 +1,337 @@
+"""
+Open-loop load generator replaying a query log against the full `SearchEngine` pipeline (Pre-Search,
+Rerank, Generation), to size the replicas of a deployment.
+
+Queries arrive at a target rate whatever the response times (open loop), with Poisson or uniform
+inter-arrival times, so that a saturated engine shows as growing latencies rather than as a lower
+request rate. Latencies are measured from the scheduled arrival of each query, so queueing in
+the load generator is included.
+
+The queries run on threads sharing one engine (like Streamlit sessions), as coroutines on the
+engine's event loop, or on worker processes with one engine each (like replicas).
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import cycle, islice
+
+import numpy as np
+
+import cache
+
+MODELS = ["threads", "asyncio", "processes"]
+STAGES = ["end_to_end", "total", "presearch", "rerank", "ttfb", "generation"]
+# upper bounds of the latency histogram buckets, in ms
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf")]
+PERCENTILES = [50, 90, 95, 99]
+
+# engine of a worker process
+_engine = None
+
+
+def read_queries(path, mode="neartext", lang="en", top_n=10) -> list:
+    """
+    Reads a query log.
+
+    Parameters:
+    - path (str): JSON lines file with a `query` per line, and optionally its `lang`, `mode` and `top_n`.
+    - mode (str, optional): The search mode of the lines without one. Default is 'neartext'.
+    - lang (str, optional): The language of the lines without one. Default is 'en'.
+    - top_n (int, optional): The number of results of the lines without one. Default is 10.
+
+    Returns:
+    - list: One dict of `run_pipeline` arguments (query, mode, lang, top_n) per line.
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not record.get("query"):
+                raise ValueError(f"{path}:{number} has no query")
+            queries.append({"query": record["query"], "mode": record.get("mode") or mode,
+                            "lang": record.get("lang") or lang, "top_n": int(record.get("top_n") or top_n)})
+    if not queries:
+        raise ValueError(f"{path} holds no queries")
+    return queries
+
+
+def arrivals(rate, count, process="poisson", seed=None) -> np.ndarray:
+    """
+    Returns:
+    - np.ndarray: The arrival times of `count` queries at `rate` queries per second, in seconds
+      from the start, with exponential (poisson) or constant (uniform) inter-arrival times.
+    """
+    if process == "uniform":
+        return np.arange(count) / rate
+    if process != "poisson":
+        raise ValueError(f"Unknown arrival process '{process}', expected 'poisson' or 'uniform'")
+    return np.cumsum(np.random.default_rng(seed).exponential(1 / rate, count)) - 1 / rate
+
+
+class LoadReport:
+    """
+    Latencies per stage, errors and cache lookups of a load test.
+    """
+    def __init__(self, rate, model, concurrency):
+        self.rate = rate
+        self.model = model
+        self.concurrency = concurrency
+        self.latencies = {stage: [] for stage in STAGES}
+        self.errors = Counter()
+        self.completed = 0
+        self.lag = 0.0
+        self.elapsed = 0.0
+        self.caches = {}
+        self._lock = threading.Lock()
+
+    def record(self, end_to_end, timings=None, error=None):
+        """
+        Records a completed query.
+
+        Parameters:
+        - end_to_end (float): Seconds from the scheduled arrival of the query to its completion.
+        - timings (dict, optional): The stage timings of the pipeline 'done' event, in seconds.
+        - error (str, optional): The name of the error raised by the pipeline.
+        """
+        with self._lock:
+            self.completed += 1
+            if error is not None:
+                self.errors[error] += 1
+                return
+            self.latencies["end_to_end"].append(end_to_end)
+            for stage, seconds in timings.items():
+                self.latencies[stage].append(seconds)
+
+    def dispatched(self, lag):
+        # seconds the load generator sent a query after its scheduled arrival
+        with self._lock:
+            self.lag = max(self.lag, lag)
+
+    def as_dict(self) -> dict:
+        stages = {}
+        for stage, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            ms = np.array(latencies) * 1000
+            stages[stage] = dict(
+                {f"p{p}_ms": float(value) for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES))},
+                count=len(ms), mean_ms=float(ms.mean()), max_ms=float(ms.max()),
+                histogram=dict(zip([str(bound) for bound in BUCKETS_MS],
+                                   np.bincount(np.searchsorted(BUCKETS_MS, ms), minlength=len(BUCKETS_MS)).tolist())))
+        failed = sum(self.errors.values())
+        return {
+            "model": self.model,
+            "concurrency": self.concurrency,
+            "offered_qps": self.rate,
+            "achieved_qps": (self.completed - failed) / self.elapsed if self.elapsed else 0.0,
+            "completed": self.completed,
+            "error_rate": failed / self.completed if self.completed else 0.0,
+            "errors": dict(self.errors),
+            "max_dispatch_lag_ms": self.lag * 1000,
+            "stages": stages,
+            "cache_hit_rates": self.caches,
+        }
+
+    def summary(self) -> str:
+        report = self.as_dict()
+        lines = [
+            f"{report['completed']} queries in {self.elapsed:.1f}s, {self.model} x {self.concurrency}: "
+            f"offered {report['offered_qps']:.1f} q/s, achieved {report['achieved_qps']:.1f} q/s, "
+            f"errors {report['error_rate']:.1%}" + (f" {report['errors']}" if report["errors"] else ""),
+            f"{'stage':>12} {'count':>6} " + " ".join(f"{f'p{p} ms':>8}" for p in PERCENTILES) + f" {'max ms':>8}",
+        ]
+        for stage, metrics in report["stages"].items():
+            lines.append(f"{stage:>12} {metrics['count']:>6} "
+                         + " ".join(f"{metrics[f'p{p}_ms']:>8.1f}" for p in PERCENTILES) + f" {metrics['max_ms']:>8.1f}")
+        if report["cache_hit_rates"]:
+            lines.append("cache hit rates: " + ", ".join(f"{name} {rate:.0%}"
+                                                         for name, rate in report["cache_hit_rates"].items()))
+        if report["max_dispatch_lag_ms"] > 100:
+            lines.append(f"the load generator fell {report['max_dispatch_lag_ms']:.0f}ms behind the arrival "
+                         f"schedule, the offered rate was not sustained")
+        return "\n".join(lines)
+
+
+def cache_lookups(stats) -> dict:
+    """
+    Returns:
+    - dict: (hits, misses) of each cache, from `SearchEngine.cache_stats()`.
+    """
+    return {name: cache.lookups(cache_stats) for name, cache_stats in stats.items()}
+
+
+def hit_rates(before, after) -> dict:
+    rates = {}
+    for name, (hits, misses) in after.items():
+        hits -= before.get(name, (0, 0))[0]
+        misses -= before.get(name, (0, 0))[1]
+        rates[name] = hits / (hits + misses) if hits + misses else 0.0
+    return rates
+
+
+def pipeline_timings(engine, request) -> dict:
+    """
+    Runs a query through the whole pipeline, consuming its events like the web app does.
+
+    Returns:
+    - dict: The stage timings of the 'done' event.
+    """
+    for event in engine.run_pipeline(request["query"], mode=request["mode"], lang=request["lang"],
+                                     top_n=request["top_n"]):
+        if event.stage == "done":
+            return event.data
+
+
+async def apipeline_timings(engine, request) -> dict:
+    """
+    Asynchronous counterpart of `pipeline_timings`.
+    """
+    async for event in engine.arun_pipeline(request["query"], mode=request["mode"], lang=request["lang"],
+                                            top_n=request["top_n"]):
+        if event.stage == "done":
+            return event.data
+
+
+def _init_worker(level, ready):
+    global _engine
+    import wikipedia
+    _engine = wikipedia.SearchEngine()
+    logging.getLogger().setLevel(level)
+    ready.wait()
+
+
+def _run_in_worker(request):
+    # timings or error, and the cumulative cache lookups of the worker's engine
+    try:
+        result = (pipeline_timings(_engine, request), None)
+    except Exception as e:
+        result = (None, type(e).__name__)
+    return result, os.getpid(), cache_lookups(_engine.cache_stats())
+
+
+def run_threads(engine, requests, offsets, concurrency, report):
+    started = time.perf_counter()
+
+    def run(request, scheduled):
+        try:
+            timings = pipeline_timings(engine, request)
+        except Exception as e:
+            report.record(time.perf_counter() - scheduled, error=type(e).__name__)
+            return
+        report.record(time.perf_counter() - scheduled, timings)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for request, offset in zip(requests, offsets):
+            scheduled = started + offset
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+            report.dispatched(time.perf_counter() - scheduled)
+            pool.submit(run, request, scheduled)
+    return started
+
+
+async def run_coroutines(engine, requests, offsets, concurrency, report):
+    started = time.perf_counter()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(request, scheduled):
+        try:
+            async with slots:
+                timings = await apipeline_timings(engine, request)
+        except Exception as e:
+            report.record(time.perf_counter() - scheduled, error=type(e).__name__)
+            return
+        report.record(time.perf_counter() - scheduled, timings)
+
+    tasks = []
+    for request, offset in zip(requests, offsets):
+        scheduled = started + offset
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        report.dispatched(time.perf_counter() - scheduled)
+        tasks.append(asyncio.ensure_future(run(request, scheduled)))
+    await asyncio.gather(*tasks)
+    return started
+
+
+def run_processes(requests, offsets, concurrency, report):
+    workers = {}
+
+    def done(future, scheduled):
+        try:
+            (timings, error), pid, lookups = future.result()
+        except Exception as e:
+            report.record(time.perf_counter() - scheduled, error=type(e).__name__)
+            return
+        report.record(time.perf_counter() - scheduled, timings, error)
+        workers[pid] = lookups
+
+    # spawned rather than forked, as the parent may run threads
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(concurrency + 1)
+    with ProcessPoolExecutor(max_workers=concurrency, mp_context=context, initializer=_init_worker,
+                             initargs=(logging.getLogger().level, ready)) as pool:
+        # every worker creates its engine before the clock starts
+        for _ in range(concurrency):
+            pool.submit(os.getpid)
+        ready.wait(timeout=300)
+        started = time.perf_counter()
+        for request, offset in zip(requests, offsets):
+            scheduled = started + offset
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+            report.dispatched(time.perf_counter() - scheduled)
+            pool.submit(_run_in_worker, request).add_done_callback(lambda future, scheduled=scheduled:
+                                                                   done(future, scheduled))
+    totals = {}
+    for lookups in workers.values():
+        for name, (hits, misses) in lookups.items():
+            totals[name] = (totals.get(name, (0, 0))[0] + hits, totals.get(name, (0, 0))[1] + misses)
+    report.caches = hit_rates({}, totals)
+    return started
+
+
+def loadtest(queries, rate, count=None, model="threads", concurrency=16, process="poisson", seed=None,
+             engine=None) -> LoadReport:
+    """
+    Replays queries against the pipeline at an open-loop arrival rate.
+
+    Parameters:
+    - queries (list): The queries, e.g. from `read_queries`, replayed in order and from the start again when exhausted.
+    - rate (float): Arrivals per second.
+    - count (int, optional): Number of queries to send. Default is None (each query once).
+    - model (str, optional): 'threads', 'asyncio' or 'processes'. Default is 'threads'.
+    - concurrency (int, optional): Threads, queries in flight on the event loop, or worker processes. Default is 16.
+    - process (str, optional): 'poisson' or 'uniform' arrivals. Default is 'poisson'.
+    - seed (int, optional): Seed of the Poisson arrivals. Default is None.
+    - engine (wikipedia.SearchEngine, optional): The engine of the threads and asyncio models. Default is None (a new one).
+
+    Returns:
+    - LoadReport: Latencies, errors and cache hit rates.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown concurrency model '{model}', expected one of {MODELS}")
+    count = count or len(queries)
+    requests = list(islice(cycle(queries), count))
+    offsets = arrivals(rate, count, process, seed)
+    report = LoadReport(rate, model, concurrency)
+    logging.info(f"Sending {count} queries at {rate} q/s ({process}) over {offsets[-1]:.0f}s, {model} x {concurrency}")
+    if model == "processes":
+        started = run_processes(requests, offsets, concurrency, report)
+    else:
+        if engine is None:
+            import wikipedia
+            engine = wikipedia.SearchEngine()
+        before = cache_lookups(engine.cache_stats())
+        if model == "threads":
+            started = run_threads(engine, requests, offsets, concurrency, report)
+        else:
+            started = engine.run(run_coroutines(engine, requests, offsets, concurrency, report))
+        report.caches = hit_rates(before, cache_lookups(engine.cache_stats()))
+    report.elapsed = time.perf_counter() - started
+    return report
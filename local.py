@@ -0,0 +1,254 @@
+"""
+In-process retrieval backends that answer with the same article shape as the Weaviate `Get { Articles }`
+queries in `wikipedia.py`, so they can replace the network round-trip on the hot path.
+
+A local index directory is a vector store (see `vectorstore.py`) holding the passage embeddings and
+metadata, plus:
+- hnsw/: the HNSW graph built over the store's vectors (see `build_dense_index`).
+- bm25/: the inverted index built over the store's metadata (see `build_sparse_index`).
+- quantized/: PQ, OPQ or int8 codes of the store's vectors (see `build_quantized_index`).
+"""
+import json
+import logging
+import os
+import time
+from itertools import islice
+
+import numpy as np
+
+import bm25
+import hnsw
+import quantization
+import vectorstore
+
+
+def article(metadata, distance=None, score=None) -> dict:
+    """
+    Formats a passage like the `Articles` objects returned by Weaviate.
+    """
+    return {
+        "text": metadata["text"],
+        "title": metadata["title"],
+        "url": metadata["url"],
+        "views": metadata["views"],
+        "lang": metadata["lang"],
+        "_additional": {
+            "distance": distance,
+            "score": score,
+        },
+    }
+
+
+def lang_filter(store, lang):
+    """
+    Mask of the rows of a store in the given language(s), or None when the store only holds those
+    languages (e.g. a per-language shard), so that the search runs unfiltered.
+    """
+    langs = [lang] if isinstance(lang, str) else list(lang)
+    if set(store.lang_codes) <= set(langs):
+        return None
+    if len(langs) == 1:
+        return store.lang_mask(langs[0])
+    return np.logical_or.reduce([store.lang_mask(code) for code in langs])
+
+
+def merge(results, top_n=10) -> list:
+    """
+    Merges the articles found in several languages or shards into the overall top_n, by ascending
+    distance for semantic search and by descending score for keyword search.
+
+    Parameters:
+    - results (list): Lists of articles, each sorted best first.
+    - top_n (int, optional): The number of top results to return. Default is 10.
+
+    Returns:
+    - list: The top articles of all lists, best first.
+    """
+    articles = [article for found in results for article in found]
+    if articles and articles[0]["_additional"]["distance"] is not None:
+        articles.sort(key=lambda article: article["_additional"]["distance"])
+    else:
+        articles.sort(key=lambda article: -float(article["_additional"]["score"]))
+    return articles[:top_n]
+
+
+def import_store(index_dir, vectors_path, metadata_path, dtype="float32", batch_size=65536) -> vectorstore.VectorStore:
+    """
+    Creates the vector store of a local index directory from a .npy matrix of embeddings and a JSON
+    lines file with the metadata of each row, streaming both.
+
+    Parameters:
+    - index_dir (str): The local index directory.
+    - vectors_path (str): The .npy file of embeddings, shape (N, dim).
+    - metadata_path (str): The JSON lines file with `text`, `title`, `url`, `views`, `lang` (and optionally `id`).
+    - dtype (str, optional): 'float32' or 'float16' storage. Default is 'float32'.
+    - batch_size (int, optional): Rows written at a time. Default is 65536.
+
+    Returns:
+    - vectorstore.VectorStore: The created store.
+    """
+    vectors = np.load(vectors_path, mmap_mode="r")
+    writer = vectorstore.VectorStoreWriter(index_dir, vectors.shape[1], dtype=dtype)
+    with open(metadata_path, encoding="utf-8") as f:
+        rows = (json.loads(line) for line in f if line.strip())
+        for start in range(0, len(vectors), batch_size):
+            batch = list(islice(rows, min(batch_size, len(vectors) - start)))
+            if len(batch) < min(batch_size, len(vectors) - start):
+                raise ValueError(f"{metadata_path} has fewer rows than the {len(vectors)} vectors of {vectors_path}")
+            ids = [row.pop("id", start + i) for i, row in enumerate(batch)]
+            writer.append(vectors[start:start + batch_size], batch, ids=ids)
+    store = writer.close()
+    logging.info(f"Imported {len(store)} vectors ({dtype}) into {index_dir}")
+    return store
+
+
+def build_dense_index(index_dir, M=16, ef_construction=100) -> hnsw.HNSWIndex:
+    """
+    Builds the HNSW graph of a local index directory.
+
+    Parameters:
+    - index_dir (str): The local index directory.
+    - M (int, optional): The number of neighbors per node on upper layers. Default is 16.
+    - ef_construction (int, optional): The size of the candidate list while inserting. Default is 100.
+
+    Returns:
+    - hnsw.HNSWIndex: The built graph.
+    """
+    store = vectorstore.VectorStore(index_dir)
+    started = time.perf_counter()
+    graph = hnsw.HNSWIndex.build(store.vectors, M=M, ef_construction=ef_construction)
+    graph.save(os.path.join(index_dir, "hnsw"))
+    logging.info(f"Built HNSW graph over {len(store)} vectors in {time.perf_counter() - started:.1f}s")
+    return graph
+
+
+def build_sparse_index(index_dir, k1=1.2, b=0.75) -> bm25.BM25Index:
+    """
+    Builds the BM25 index of a local index directory from the metadata of its vector store.
+
+    Parameters:
+    - index_dir (str): The local index directory.
+    - k1 (float, optional): BM25 term frequency saturation. Default is 1.2.
+    - b (float, optional): BM25 document length normalization. Default is 0.75.
+
+    Returns:
+    - bm25.BM25Index: The built index.
+    """
+    store = vectorstore.VectorStore(index_dir)
+    started = time.perf_counter()
+    index = bm25.BM25Index.build(store.iter_metadata(), os.path.join(index_dir, "bm25"), k1=k1, b=b)
+    logging.info(f"Built BM25 index over {len(index)} passages in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+def build_quantized_index(index_dir, kind="opq", m=64, train_size=65536, opq_iterations=8) -> quantization.QuantizedIndex:
+    """
+    Builds the quantized codes of a local index directory.
+
+    Parameters:
+    - index_dir (str): The local index directory.
+    - kind (str, optional): 'pq', 'opq' or 'int8'. Default is 'opq'.
+    - m (int, optional): Bytes per PQ/OPQ code. Default is 64.
+    - train_size (int, optional): The number of vectors the quantizer is trained on. Default is 65536.
+    - opq_iterations (int, optional): Rotation updates of OPQ. Default is 8.
+
+    Returns:
+    - quantization.QuantizedIndex: The built index.
+    """
+    store = vectorstore.VectorStore(index_dir)
+    started = time.perf_counter()
+    index = quantization.QuantizedIndex.build(store.vectors, os.path.join(index_dir, "quantized"), kind=kind, m=m,
+                                              train_size=train_size, opq_iterations=opq_iterations)
+    logging.info(f"Built {kind} index over {len(store)} vectors in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+class LocalDenseBackend:
+    """
+    Semantic search over a local HNSW graph. Query vectors come from the same embedding model
+    that produced the store's vectors (see `SearchEngine.embed_queries`).
+    """
+    def __init__(self, index_dir, ef=64, store=None):
+        self.ef = ef
+        self.store = store or vectorstore.VectorStore(index_dir)
+        self.index = hnsw.HNSWIndex.load(os.path.join(index_dir, "hnsw"), self.store.vectors)
+        logging.info(f"Loaded local HNSW index with {len(self.index)} vectors from {index_dir}")
+
+    def search(self, vector, lang='en', top_n=10) -> list:
+        """
+        Finds the passages closest to the query vector.
+
+        Parameters:
+        - vector (list): The query embedding.
+        - lang (str | list, optional): The language of the articles, or several for a cross-lingual search. Default is 'en'.
+        - top_n (int, optional): The number of top results to return. Default is 10.
+
+        Returns:
+        - list: List of top articles based on semantic similarity, closest first.
+        """
+        ids, distances = self.index.search(vectorstore.normalize(vector), k=top_n, ef=max(self.ef, top_n),
+                                           allowed=lang_filter(self.store, lang))
+        return [article(self.store.metadata(i), distance=float(d)) for i, d in zip(ids, distances)]
+
+
+class LocalSparseBackend:
+    """
+    Keyword search over a local BM25 index, tokenizing queries like the passages of their language.
+    """
+    def __init__(self, index_dir, store=None):
+        self.store = store or vectorstore.VectorStore(index_dir)
+        self.index = bm25.BM25Index(os.path.join(index_dir, "bm25"))
+        logging.info(f"Loaded local BM25 index with {len(self.index)} passages from {index_dir}")
+
+    def search(self, query, lang='en', top_n=10) -> list:
+        """
+        Finds the passages with the highest BM25 score for the query.
+
+        Parameters:
+        - query (str): The search query.
+        - lang (str | list, optional): The language of the articles, or several for a cross-lingual search. Default is 'en'.
+        - top_n (int, optional): The number of top results to return. Default is 10.
+
+        Returns:
+        - list: List of top articles based on BM25 scoring, best first.
+        """
+        if not isinstance(lang, str):
+            return merge([self.search(query, lang=code, top_n=top_n) for code in lang], top_n)
+        ids, scores = self.index.search(query, lang=lang, k=top_n, allowed=lang_filter(self.store, lang))
+        return [article(self.store.metadata(i), score=str(float(s))) for i, s in zip(ids, scores)]
+
+
+class LocalQuantizedBackend:
+    """
+    Semantic search over the quantized codes of a local index: the codes are scanned with asymmetric
+    distance computation and the best candidates are re-scored against the store's full-precision vectors.
+    """
+    def __init__(self, index_dir, candidates=100, store=None):
+        self.candidates = candidates
+        self.store = store or vectorstore.VectorStore(index_dir)
+        self.index = quantization.QuantizedIndex.load(os.path.join(index_dir, "quantized"))
+        logging.info(f"Loaded local {self.index.kind} index with {len(self.index)} vectors from {index_dir}")
+
+    def search(self, vector, lang='en', top_n=10) -> list:
+        """
+        Finds the passages closest to the query vector.
+
+        Parameters:
+        - vector (list): The query embedding.
+        - lang (str | list, optional): The language of the articles, or several for a cross-lingual search. Default is 'en'.
+        - top_n (int, optional): The number of top results to return. Default is 10.
+
+        Returns:
+        - list: List of top articles based on semantic similarity, closest first.
+        """
+        ids, distances = self.index.search(vectorstore.normalize(vector), self.store.vectors, k=top_n,
+                                           candidates=self.candidates, allowed=lang_filter(self.store, lang))
+        return [article(self.store.metadata(i), distance=float(d)) for i, d in zip(ids, distances)]
+
+
+# local backends by the name used in DENSE_BACKEND / SPARSE_BACKEND
+BACKENDS = {
+    "hnsw": LocalDenseBackend,
+    "quantized": LocalQuantizedBackend,
+    "bm25": LocalSparseBackend,
+}
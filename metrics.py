@@ -0,0 +1,344 @@
+"""
+Metrics of the `SearchEngine` in the Prometheus text exposition format: counters, latency
+histograms and gauges of the calls of its methods, labeled by method, model and lang, and the
+state of its caches, connection pools, retries, circuit breakers and hedges, served over HTTP
+for Prometheus to scrape.
+
+Counters, histograms and gauges are aggregated per thread: every thread updates its own values
+without taking a lock, and a scrape sums the values of all threads. So metrics can stay on in
+the hot path, at the cost of a dictionary update per observation. The values of the threads that
+ended are folded into the metric.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# latency buckets in seconds, from a cache hit to a long generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Shard:
+    # the values of a metric updated by one thread
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        self.values = {}
+
+
+class Metric:
+    """
+    A metric with per-thread values, keyed by the tuple of its label values.
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        """
+        Parameters:
+        - name (str): The metric name, e.g. 'wikisearch_requests_total'.
+        - help (str): The description of the metric.
+        - labels (tuple, optional): The label names. Default is () (no labels).
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        # the values of every live thread, while the thread-local shard keeps them alive
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def samples(self) -> list:
+        """
+        Returns:
+        - list: (suffix, labels, value) of the samples of the metric, summed over the threads.
+        """
+        merged = {}
+        with self._lock:
+            shards = [values.copy() for values in self._shards] + [self._retired.copy()]
+        for values in shards:
+            for key, value in values.items():
+                self._merge(merged, key, value)
+        return [(suffix, dict(zip(self.labels, key), **extra), value)
+                for key in sorted(merged) for suffix, extra, value in self._expand(merged[key])]
+
+    def _values(self) -> dict:
+        # the values of the calling thread
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard.values)
+            weakref.finalize(shard, self.__retire, shard.values)
+            return shard.values
+
+    def _merge(self, into, key, value):
+        into[key] = into.get(key, 0) + value
+
+    def _expand(self, value) -> list:
+        return [("", {}, value)]
+
+    def __retire(self, values):
+        # the thread ended: its values are kept in the metric
+        with self._lock:
+            self._shards = [live for live in self._shards if live is not values]
+            for key, value in values.items():
+                self._merge(self._retired, key, value)
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. the calls of a method.
+    """
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, e.g. the calls in flight. It is only moved by `inc` and `dec`,
+    since the values of the threads add up; values read from elsewhere are `Registry.collector`s.
+    """
+    kind = "gauge"
+
+    def inc(self, labels=(), amount=1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, e.g. latencies, over cumulative `le` buckets.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels, value):
+        values = self._values()
+        # one count per bucket, the +Inf one included, then the sum
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, into, key, value):
+        total = into.setdefault(key, [0] * len(value))
+        for i, count in enumerate(value):
+            total[i] += count
+
+    def _expand(self, value) -> list:
+        samples, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), value):
+            cumulative += count
+            samples.append(("_bucket", {"le": format_value(bound)}, cumulative))
+        return samples + [("_sum", {}, value[-1]), ("_count", {}, cumulative)]
+
+
+class Collector:
+    """
+    A metric whose values are read when scraped, e.g. the size of a cache.
+    """
+    def __init__(self, name, help, kind, labels, read):
+        """
+        Parameters:
+        - name (str): The metric name.
+        - help (str): The description of the metric.
+        - kind (str): 'counter' or 'gauge'.
+        - labels (tuple): The label names.
+        - read (callable): Returns a dict of {label values tuple: value}.
+        """
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.read = read
+
+    def samples(self) -> list:
+        return [("", dict(zip(self.labels, key)), value) for key, value in sorted(self.read().items())]
+
+
+class Registry:
+    """
+    The metrics of a process, rendered together in the Prometheus text format.
+
+    Usage:
+        registry = Registry()
+        calls = registry.counter("wikisearch_requests_total", "Calls", ("method",))
+        calls.inc(("with_bm25",))
+        print(registry.render())
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, name, help, kind, labels, read) -> Collector:
+        return self.register(Collector(name, help, kind, labels, read))
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns:
+        - str: Every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # a failing collector does not hide the other metrics
+                logging.warning(f"Failed to collect metric {metric.name}: {e!r}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class RequestMetrics:
+    """
+    The calls, latency and calls in flight of the `SearchEngine` methods, labeled by method, model
+    and lang (see `measured`).
+    """
+    def __init__(self, registry, prefix="wikisearch"):
+        self.requests = registry.counter(f"{prefix}_requests_total", "Calls of the search engine methods, by outcome",
+                                         ("method", "model", "lang", "status"))
+        self.latency = registry.histogram(f"{prefix}_request_duration_seconds",
+                                          "Latency of the search engine methods", ("method", "model", "lang"))
+        self.in_flight = registry.gauge(f"{prefix}_requests_in_flight", "Calls of the search engine methods in progress",
+                                        ("method",))
+
+    def started(self, method):
+        self.in_flight.inc((method,))
+
+    def finished(self, method, model, lang, seconds, status):
+        self.in_flight.dec((method,))
+        self.requests.inc((method, model, lang, status))
+        self.latency.observe((method, model, lang), seconds)
+
+
+def measured(method_name, labels):
+    """
+    Records the calls of a (sync or async) method of an instance with `request_metrics` (see
+    `RequestMetrics`), under `method_name`, so that a method and its asynchronous counterpart are
+    counted together.
+
+    Parameters:
+    - method_name (str): The `method` label.
+    - labels (callable): Maps the instance and the arguments of the method to its (model, lang) labels.
+    """
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                model, lang = labels(self, *args, **kwargs)
+                self.request_metrics.started(method_name)
+                started, status = time.perf_counter(), "error"
+                try:
+                    result = await method(self, *args, **kwargs)
+                    status = "ok"
+                    return result
+                finally:
+                    self.request_metrics.finished(method_name, model, lang, time.perf_counter() - started, status)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            model, lang = labels(self, *args, **kwargs)
+            self.request_metrics.started(method_name)
+            started, status = time.perf_counter(), "error"
+            try:
+                result = method(self, *args, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                self.request_metrics.finished(method_name, model, lang, time.perf_counter() - started, status)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """
+    Serves `GET /metrics` of a registry from a daemon thread, for Prometheus to scrape.
+    """
+    def __init__(self, registry, port=9100, host="0.0.0.0"):
+        """
+        Parameters:
+        - registry (Registry): The metrics to serve.
+        - port (int, optional): The port to listen on. Default is 9100.
+        - host (str, optional): The address to listen on. Default is '0.0.0.0' (every interface).
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"metrics: {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name="wikisearch-metrics", daemon=True)
+        self._thread.start()
+        logging.info(f"Serving metrics on http://{host}:{self.port}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
@@ -0,0 +1,274 @@
+"""
+Compressed vector indexes for dense retrieval over L2-normalized vectors: product quantization (PQ),
+optimized product quantization (OPQ, PQ after a learned rotation) and int8 scalar quantization.
+Queries are scored against the compressed codes with asymmetric distance computation (the query
+stays in float32), and the best candidates are re-scored exactly against the full-precision vectors
+of the memory-mapped store.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+CHUNK_SIZE = 65536
+# int8 codes are widened to float32 in small chunks that stay in cache
+INT8_CHUNK_SIZE = 4096
+
+
+def kmeans(x, k, iterations=20, seed=0) -> np.ndarray:
+    """
+    Lloyd's k-means with squared euclidean distance.
+
+    Parameters:
+    - x (np.ndarray): The training points, shape (n, dim).
+    - k (int): The number of centroids.
+    - iterations (int, optional): The number of assignment/update rounds. Default is 20.
+    - seed (int, optional): Seed of the initial centroids. Default is 0.
+
+    Returns:
+    - np.ndarray: The centroids, shape (k, dim).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=len(x) < k)].copy()
+    for _ in range(iterations):
+        assignment = nearest(x, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.stack([np.bincount(assignment, weights=x[:, d], minlength=k) for d in range(x.shape[1])], axis=1)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # re-seed empty clusters on random points
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return centroids
+
+
+def nearest(x, centroids) -> np.ndarray:
+    """
+    Index of the closest centroid of every point.
+    """
+    distances = (centroids ** 2).sum(axis=1) - 2 * x @ centroids.T
+    return distances.argmin(axis=1)
+
+
+class ProductQuantizer:
+    """
+    Splits (optionally rotated) vectors into `m` sub-vectors, each encoded as the id of the closest of
+    256 centroids learned on that subspace, i.e. `m` bytes per vector.
+    """
+    def __init__(self, codebooks, rotation=None):
+        self.codebooks = codebooks
+        self.rotation = rotation
+        self.m, self.k, self.dsub = codebooks.shape
+
+    @classmethod
+    def train(cls, x, m, opq_iterations=0, iterations=20, seed=0):
+        """
+        Learns the codebooks, and for OPQ the rotation that minimizes the quantization error by
+        alternating PQ training and orthogonal Procrustes.
+
+        Parameters:
+        - x (np.ndarray): The training vectors, shape (n, dim), dim divisible by m.
+        - m (int): The number of subspaces (bytes per code).
+        - opq_iterations (int, optional): Rotation updates, 0 for plain PQ. Default is 0.
+        - iterations (int, optional): k-means rounds per subspace. Default is 20.
+        - seed (int, optional): Random seed. Default is 0.
+
+        Returns:
+        - ProductQuantizer: The trained quantizer.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.shape[1] % m:
+            raise ValueError(f"Vector dimension {x.shape[1]} is not divisible by m={m}")
+        rotation = np.eye(x.shape[1], dtype=np.float32) if opq_iterations else None
+        for _ in range(opq_iterations):
+            quantizer = cls.__train_codebooks(x @ rotation, m, max(iterations // 4, 4), seed)
+            reconstruction = quantizer.decode(quantizer.encode(x @ rotation))
+            u, _, vt = np.linalg.svd(x.T @ reconstruction)
+            rotation = (u @ vt).astype(np.float32)
+        quantizer = cls.__train_codebooks(x @ rotation if rotation is not None else x, m, iterations, seed)
+        return cls(quantizer.codebooks, rotation)
+
+    @classmethod
+    def __train_codebooks(cls, x, m, iterations, seed):
+        dsub = x.shape[1] // m
+        return cls(np.stack([kmeans(x[:, j * dsub:(j + 1) * dsub], 256, iterations, seed + j) for j in range(m)]))
+
+    def encode(self, x) -> np.ndarray:
+        """
+        Encodes vectors, shape (n, dim), as codes of shape (n, m).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if self.rotation is not None:
+            x = x @ self.rotation
+        return np.stack([nearest(x[:, j * self.dsub:(j + 1) * self.dsub], self.codebooks[j])
+                         for j in range(self.m)], axis=1).astype(np.uint8)
+
+    def decode(self, codes) -> np.ndarray:
+        """
+        Reconstructs (rotated) vectors from codes of shape (n, m).
+        """
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def tables(self, query) -> np.ndarray:
+        """
+        Inner products of the query sub-vectors with every centroid of pairs of consecutive subspaces,
+        shape (m / 2, 65536), indexed by `code[2j] + 256 * code[2j + 1]`.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.rotation is not None:
+            query = query @ self.rotation
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(self.m, self.dsub))
+        return (table[1::2, :, None] + table[0::2, None, :]).reshape(self.m // 2, -1)
+
+
+class ScalarQuantizer:
+    """
+    Encodes every dimension as a signed byte with a per-dimension scale, i.e. `dim` bytes per vector.
+    """
+    def __init__(self, scale):
+        self.scale = scale
+
+    @classmethod
+    def train(cls, x):
+        scale = np.abs(np.asarray(x, dtype=np.float32)).max(axis=0) / 127
+        return cls(np.maximum(scale, 1e-12).astype(np.float32))
+
+    def encode(self, x) -> np.ndarray:
+        return np.clip(np.rint(np.asarray(x, dtype=np.float32) / self.scale), -127, 127).astype(np.int8)
+
+
+class QuantizedIndex:
+    """
+    Flat index of quantized codes, stored in a directory with memory-mapped codes.
+    The PQ/OPQ codes are stored as (m / 2, N) uint16 pairs so that ADC is a sum of m / 2 table lookups.
+    """
+    KINDS = ("pq", "opq", "int8")
+
+    def __init__(self, kind, quantizer, codes):
+        self.kind = kind
+        self.quantizer = quantizer
+        self.codes = codes
+
+    def __len__(self):
+        return self.codes.shape[1] if self.kind != "int8" else self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.size * self.codes.itemsize
+
+    @classmethod
+    def build(cls, vectors, path, kind="opq", m=64, train_size=65536, opq_iterations=8, seed=0):
+        """
+        Trains a quantizer on a sample of the vectors and encodes all of them.
+
+        Parameters:
+        - vectors (np.ndarray): The L2-normalized vectors, shape (N, dim), e.g. a memory-mapped store.
+        - path (str): The index directory.
+        - kind (str, optional): 'pq', 'opq' or 'int8'. Default is 'opq'.
+        - m (int, optional): Bytes per PQ/OPQ code, an even divisor of dim. Default is 64.
+        - train_size (int, optional): The number of training vectors. Default is 65536.
+        - opq_iterations (int, optional): Rotation updates of OPQ. Default is 8.
+        - seed (int, optional): Random seed. Default is 0.
+
+        Returns:
+        - QuantizedIndex: The built index.
+        """
+        if kind not in cls.KINDS:
+            raise ValueError(f"Unknown quantization '{kind}', expected one of {list(cls.KINDS)}")
+        if kind != "int8" and m % 2:
+            raise ValueError(f"m={m} must be even")
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(vectors), min(train_size, len(vectors)), replace=False))
+        train = np.asarray(vectors[sample], dtype=np.float32)
+        os.makedirs(path, exist_ok=True)
+        if kind == "int8":
+            quantizer = ScalarQuantizer.train(train)
+            np.save(os.path.join(path, "scale.npy"), quantizer.scale)
+            codes = np.lib.format.open_memmap(os.path.join(path, "codes.npy"), mode="w+", dtype=np.int8,
+                                              shape=vectors.shape)
+        else:
+            quantizer = ProductQuantizer.train(train, m, opq_iterations=opq_iterations if kind == "opq" else 0,
+                                               seed=seed)
+            np.save(os.path.join(path, "codebooks.npy"), quantizer.codebooks)
+            if quantizer.rotation is not None:
+                np.save(os.path.join(path, "rotation.npy"), quantizer.rotation)
+            codes = np.lib.format.open_memmap(os.path.join(path, "codes.npy"), mode="w+", dtype=np.uint16,
+                                              shape=(m // 2, len(vectors)))
+        for start in range(0, len(vectors), CHUNK_SIZE):
+            chunk = quantizer.encode(vectors[start:start + CHUNK_SIZE])
+            if kind == "int8":
+                codes[start:start + len(chunk)] = chunk
+            else:
+                pairs = chunk[:, 0::2].astype(np.uint16) + (chunk[:, 1::2].astype(np.uint16) << 8)
+                codes[:, start:start + len(chunk)] = pairs.T
+        codes.flush()
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"kind": kind, "m": m if kind != "int8" else vectors.shape[1], "count": len(vectors)}, f)
+        logging.info(f"Built {kind} index over {len(vectors)} vectors ({codes.nbytes / len(vectors):.0f} bytes/vector)")
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["kind"] == "int8":
+            quantizer = ScalarQuantizer(np.load(os.path.join(path, "scale.npy")))
+        else:
+            rotation = os.path.join(path, "rotation.npy")
+            quantizer = ProductQuantizer(np.load(os.path.join(path, "codebooks.npy")),
+                                         np.load(rotation) if os.path.exists(rotation) else None)
+        return cls(meta["kind"], quantizer, np.load(os.path.join(path, "codes.npy"), mmap_mode=mmap_mode))
+
+    def scores(self, query) -> np.ndarray:
+        """
+        Approximate inner products of the query with every encoded vector (ADC).
+
+        Parameters:
+        - query (np.ndarray): The L2-normalized float32 query.
+
+        Returns:
+        - np.ndarray: One float32 score per vector.
+        """
+        scores = np.empty(len(self), dtype=np.float32)
+        if self.kind == "int8":
+            weights = np.asarray(query, dtype=np.float32) * self.quantizer.scale
+            for start in range(0, len(self), INT8_CHUNK_SIZE):
+                chunk = self.codes[start:start + INT8_CHUNK_SIZE]
+                scores[start:start + INT8_CHUNK_SIZE] = chunk.astype(np.float32) @ weights
+            return scores
+        tables = self.quantizer.tables(query)
+        for start in range(0, len(self), CHUNK_SIZE):
+            chunk = scores[start:start + CHUNK_SIZE]
+            codes = self.codes[:, start:start + CHUNK_SIZE]
+            np.take(tables[0], codes[0], out=chunk)
+            for table, column in zip(tables[1:], codes[1:]):
+                chunk += table.take(column)
+        return scores
+
+    def search(self, query, vectors, k=10, candidates=100, allowed=None) -> tuple:
+        """
+        Finds the k nearest neighbors: the best `candidates` by ADC are re-scored exactly against the
+        full-precision vectors.
+
+        Parameters:
+        - query (np.ndarray): The L2-normalized query vector.
+        - vectors (np.ndarray): The full-precision vectors the index was built on (e.g. `VectorStore.vectors`).
+        - k (int, optional): The number of neighbors to return. Default is 10.
+        - candidates (int, optional): The number of ADC candidates re-scored exactly. Default is 100.
+        - allowed (np.ndarray, optional): Boolean mask of the vectors that may be returned. Default is None (all).
+
+        Returns:
+        - tuple: Ids and cosine distances of the neighbors, closest first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.scores(query)
+        if allowed is not None:
+            scores[~allowed] = -np.inf
+        candidates = min(max(candidates, k), len(scores))
+        ids = np.sort(np.argpartition(-scores, candidates - 1)[:candidates])
+        ids = ids[np.isfinite(scores[ids])]
+        exact = np.asarray(vectors[ids], dtype=np.float32) @ query
+        top = np.argsort(-exact, kind="stable")[:k]
+        return ids[top], 1.0 - exact[top]
@@ -0,0 +1,473 @@
+"""
+Retry policy of the remote calls of `SearchEngine` (Weaviate and Cohere), replacing fixed
+per-method retries:
+- only errors that another attempt can fix are retried (lost connections, timeouts, 408/429/5xx),
+  never 4xx or malformed requests;
+- every call has a deadline covering all of its attempts and backoffs, shared with the retried
+  calls it makes (e.g. `with_neartext` embedding its query): no attempt starts, and no backoff
+  ends, past the deadline. Asynchronous attempts are also cancelled at the deadline, so a flaky
+  dependency delays a user by at most the deadline; a synchronous attempt in progress is only cut
+  short by the HTTP timeouts (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), so a sync call may
+  overrun its deadline by up to one attempt;
+- a token bucket bounds retries to a fraction of the calls, so an outage does not multiply the
+  load on the failing service by the number of attempts;
+- retries, failures and exhausted budgets and deadlines are counted per method.
+
+Circuit breakers of the Cohere dependencies (embed, rerank, generate) stop calling a dependency
+whose recent calls mostly failed or were slow, so that the engine falls back to a degraded answer
+at once instead of waiting for every call to run out of its attempts.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import aiohttp
+import requests
+from cohere.error import CohereAPIError, CohereConnectionError
+from weaviate.exceptions import UnexpectedStatusCodeException, WeaviateStartUpError
+
+import tracing
+import transport
+
+RETRYABLE_STATUS = frozenset([408, 429, 500, 502, 503, 504])
+
+# the deadline of the outermost retried call in progress, if any
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a call runs out of its deadline before one of its attempts succeeds.
+    """
+
+
+def retryable(error) -> bool:
+    """
+    Whether another attempt may succeed where this error was raised: the error is `transient` and
+    was not already retried by a nested call with the same deadline.
+    """
+    return transient(error) and not getattr(error, "retries_exhausted", False)
+
+
+def transient(error) -> bool:
+    """
+    Whether the error tells of a failing or overloaded service rather than of a bad request: the
+    connection was lost or timed out, or the server answered 408, 429 or 5xx.
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, aiohttp.ClientConnectionError,
+                          asyncio.TimeoutError, DeadlineExceeded, CohereConnectionError,
+                          WeaviateStartUpError)):
+        return True
+    if isinstance(error, CohereAPIError):
+        return error.http_status in RETRYABLE_STATUS
+    if isinstance(error, (UnexpectedStatusCodeException, requests.HTTPError)):
+        status = error.status_code if isinstance(error, UnexpectedStatusCodeException) else error.response.status_code
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (aiohttp.ClientResponseError, transport.WeaviateQueryError)):
+        return error.status in RETRYABLE_STATUS
+    return False
+
+
+class RetryBudget:
+    """
+    Token bucket of retries: every call deposits `ratio` tokens and every retry withdraws one, so
+    retries stay below `ratio` of the calls (plus `min_per_sec` retries per second when traffic is
+    low). Up to `capacity` tokens are saved for bursts of failures.
+    """
+    def __init__(self, ratio=0.1, min_per_sec=1.0, capacity=10.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.__refill()
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self.__refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._refilled) * self.min_per_sec)
+        self._refilled = now
+
+
+class RetryPolicy:
+    """
+    Retries calls on retryable errors, with full-jitter exponential backoff, within a deadline and
+    a shared `RetryBudget`.
+
+    Usage:
+        policy = RetryPolicy(max_attempts=3, deadline=10)
+        policy.call("rerank", lambda: client.rerank(...))
+        await policy.acall("arerank", lambda: aclient.rerank(...))
+    """
+    def __init__(self, max_attempts=3, deadline=10.0, base_delay=0.1, max_delay=1.0, budget=None):
+        """
+        Parameters:
+        - max_attempts (int, optional): Attempts per call, the first one included. Default is 3.
+        - deadline (float, optional): Seconds for all the attempts and backoffs of a call. Default is 10.
+        - base_delay (float, optional): Backoff cap before the first retry, doubled at every retry. Default is 0.1.
+        - max_delay (float, optional): Largest backoff cap, in seconds. Default is 1.
+        - budget (RetryBudget, optional): The retry budget. Default is None (a `RetryBudget()`).
+        """
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def call(self, name, fn):
+        """
+        Calls `fn()`, retrying it according to the policy. An attempt in progress is not
+        interrupted at the deadline (see `acall`), only no attempt is started after it.
+
+        Parameters:
+        - name (str): The name of the call in the counters, e.g. the method name.
+        - fn (callable): The call to make.
+
+        Returns:
+        - The result of `fn()`.
+        """
+        deadline, token = self.__enter(name)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return fn()
+                except Exception as error:
+                    attempt += 1
+                    delay = self.__backoff(name, error, attempt, deadline)
+                    time.sleep(delay)
+        finally:
+            _deadline.reset(token)
+
+    async def acall(self, name, fn):
+        """
+        Asynchronous counterpart of `call`, where `fn()` returns an awaitable. Attempts are also
+        cancelled when the deadline passes.
+        """
+        deadline, token = self.__enter(name)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return await asyncio.wait_for(fn(), timeout=max(deadline - time.monotonic(), 0))
+                except Exception as error:
+                    attempt += 1
+                    delay = self.__backoff(name, error, attempt, deadline)
+                    await asyncio.sleep(delay)
+        finally:
+            _deadline.reset(token)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        - dict: For each call name, its `calls`, `retries`, `failures` and the failures that were
+          not retried because the `budget_exhausted` or the `deadline_exceeded`.
+        """
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+    def __enter(self, name):
+        # nested calls share the deadline of the outermost one
+        self.__count(name, "calls")
+        outer = _deadline.get()
+        deadline = time.monotonic() + self.deadline
+        if outer is not None:
+            deadline = min(deadline, outer)
+        self.budget.deposit()
+        return deadline, _deadline.set(deadline)
+
+    def __count(self, name, counter):
+        with self._lock:
+            counters = self._counters.setdefault(name, {"calls": 0, "retries": 0, "failures": 0,
+                                                        "budget_exhausted": 0, "deadline_exceeded": 0})
+            counters[counter] += 1
+
+    def __backoff(self, name, error, attempt, deadline) -> float:
+        # the delay before the next attempt, or raises the error when the call should not be retried
+        reason = None
+        if isinstance(error, asyncio.TimeoutError) and time.monotonic() >= deadline:
+            reason = "deadline_exceeded"
+        elif not retryable(error) or attempt >= self.max_attempts:
+            reason = "failures"
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if reason is None and time.monotonic() + delay >= deadline:
+            reason = "deadline_exceeded"
+        if reason is None and not self.budget.withdraw():
+            reason = "budget_exhausted"
+        if reason is not None:
+            self.__count(name, reason)
+            if reason != "failures":
+                self.__count(name, "failures")
+            logging.warning(f"{name}() failed after {attempt} attempt(s) ({reason}): {error!r}")
+            error.retries_exhausted = True
+            if reason == "deadline_exceeded" and isinstance(error, asyncio.TimeoutError):
+                exceeded = DeadlineExceeded(f"{name}() ran out of its {self.deadline}s deadline")
+                exceeded.retries_exhausted = True
+                raise exceeded from error
+            raise error
+        self.__count(name, "retries")
+        tracing.current_span().add("retry.count")
+        logging.info(f"{name}() attempt {attempt} failed with {error!r}, retrying in {delay * 1000:.0f}ms")
+        return delay
+
+
+def retried(method):
+    """
+    Retries a (sync or async) method with the `retry_policy` of its instance, counting the calls
+    under the method name.
+    """
+    name = method.__name__.lstrip("_")
+
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            return await self.retry_policy.acall(name, lambda: method(self, *args, **kwargs))
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.retry_policy.call(name, lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+    """
+    def __init__(self, dependency):
+        super().__init__(f"{dependency} is unavailable (circuit breaker open)")
+        self.dependency = dependency
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of the last `window` calls to a dependency, and opens when at least
+    `min_calls` of them are known and `failure_rate` of them failed with a `transient` error or
+    took longer than `slow_call` seconds. Calls are then rejected with `CircuitOpenError` for
+    `reset_timeout` seconds, after which a single trial call is let through (half-open): the
+    breaker closes if it succeeds in time, and opens again otherwise.
+
+    Errors raised by the dependency, or instead of calling it, are tagged with a `dependency`
+    attribute, so that callers fall back on failures of this dependency only.
+
+    Usage:
+        breaker = CircuitBreaker("rerank")
+        ranking = breaker.call(lambda: client.rerank(...), fallback=lambda: presearch_order(...))
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, dependency, failure_rate=0.5, slow_call=5.0, window=20, min_calls=5, reset_timeout=30.0):
+        """
+        Parameters:
+        - dependency (str): The name of the dependency, e.g. 'embed'.
+        - failure_rate (float, optional): Rate of failed or slow calls opening the breaker. Default is 0.5.
+        - slow_call (float, optional): Seconds after which a successful call counts as failed, None for
+          dependencies whose latency depends on the request (e.g. generation). Default is 5.
+        - window (int, optional): Number of recent calls the rate is computed on. Default is 20.
+        - min_calls (int, optional): Calls needed in the window before the breaker may open. Default is 5.
+        - reset_timeout (float, optional): Seconds the breaker stays open before a trial call. Default is 30.
+        """
+        self.dependency = dependency
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._trial = False
+        self._counters = {"calls": 0, "failures": 0, "slow": 0, "rejected": 0, "opened": 0, "fallbacks": 0}
+        self._lock = threading.Lock()
+
+    def call(self, fn, fallback=None):
+        """
+        Calls `fn()` unless the breaker is open.
+
+        Parameters:
+        - fn (callable): The call to the dependency.
+        - fallback (callable, optional): Called instead when the breaker is open or `fn()` fails
+          with a transient error. Default is None (the error is raised).
+
+        Returns:
+        - The result of `fn()`, or of `fallback()`.
+        """
+        try:
+            self.__acquire()
+            started = time.monotonic()
+            try:
+                result = fn()
+            except Exception as error:
+                self.__failed(error)
+                raise
+            except BaseException:
+                # cancelled (e.g. a Streamlit rerun, or the deadline of an outer call): no outcome
+                self.__abandoned()
+                raise
+            self.__succeeded(time.monotonic() - started)
+            return result
+        except Exception as error:
+            return self.__fall_back(error, fallback)
+
+    async def acall(self, fn, fallback=None):
+        """
+        Asynchronous counterpart of `call`, where `fn()` returns an awaitable. `fallback` is
+        still a synchronous callable.
+        """
+        try:
+            self.__acquire()
+            started = time.monotonic()
+            try:
+                result = await fn()
+            except Exception as error:
+                self.__failed(error)
+                raise
+            except BaseException:
+                # cancelled (e.g. a Streamlit rerun, or the deadline of an outer call): no outcome
+                self.__abandoned()
+                raise
+            self.__succeeded(time.monotonic() - started)
+            return result
+        except Exception as error:
+            return self.__fall_back(error, fallback)
+
+    def record_fallback(self):
+        """
+        Counts a degraded answer given by the caller because of a failure of the dependency.
+        """
+        with self._lock:
+            self._counters["fallbacks"] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        - dict: The `state`, and the `calls`, `failures` (including slow calls), `slow` calls,
+          `rejected` calls, times `opened` and `fallbacks` of the dependency.
+        """
+        with self._lock:
+            return dict(self._counters, state=self.state)
+
+    def __acquire(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._trial):
+                self._counters["rejected"] += 1
+                raise CircuitOpenError(self.dependency)
+            self._trial = self.state == self.HALF_OPEN
+            self._counters["calls"] += 1
+
+    def __succeeded(self, latency):
+        slow = self.slow_call is not None and latency > self.slow_call
+        with self._lock:
+            if slow:
+                self._counters["slow"] += 1
+            self.__record(slow)
+        if slow:
+            logging.warning(f"{self.dependency} answered in {latency:.1f}s, over the {self.slow_call}s of a slow call")
+
+    def __abandoned(self):
+        # frees the trial of a half-open breaker for the next call
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial = False
+
+    def __failed(self, error):
+        error.dependency = self.dependency
+        with self._lock:
+            # a bad request says nothing of the health of the dependency
+            self.__record(transient(error))
+
+    def __record(self, failed):
+        if failed:
+            self._counters["failures"] += 1
+        if self.state == self.HALF_OPEN:
+            self._trial = False
+            if failed:
+                self.__open()
+            else:
+                logging.info(f"Circuit breaker of {self.dependency} closed")
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            return
+        self._outcomes.append(failed)
+        if (self.state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                and sum(self._outcomes) >= self.failure_rate * len(self._outcomes)):
+            self.__open()
+
+    def __open(self):
+        logging.warning(f"Circuit breaker of {self.dependency} opened for {self.reset_timeout}s")
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._counters["opened"] += 1
+        self._outcomes.clear()
+
+    def __fall_back(self, error, fallback):
+        if fallback is None or not (isinstance(error, CircuitOpenError) or transient(error)):
+            raise error
+        logging.warning(f"{self.dependency} failed ({error!r}), falling back")
+        self.record_fallback()
+        tracing.current_span().set("fallback", self.dependency)
+        return fallback()
+
+
+def falls_back(dependency, alternative):
+    """
+    Calls the `alternative` method of the instance, with the same arguments, when a (sync or
+    async) method fails because of `dependency`: its circuit breaker, in the instance's
+    `breakers`, is open or it failed with a transient error.
+
+    Parameters:
+    - dependency (str): The name of the dependency.
+    - alternative (str): The name of the method giving a degraded answer without the dependency.
+    """
+    def failed(self, error):
+        if getattr(error, "dependency", None) != dependency or not (isinstance(error, CircuitOpenError)
+                                                                     or transient(error)):
+            return False
+        logging.warning(f"{dependency} failed ({error!r}), falling back to {alternative}()")
+        self.breakers[dependency].record_fallback()
+        tracing.current_span().set("fallback", alternative)
+        return True
+
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                try:
+                    return await method(self, *args, **kwargs)
+                except Exception as error:
+                    if not failed(self, error):
+                        raise
+                return await getattr(self, alternative)(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            except Exception as error:
+                if not failed(self, error):
+                    raise
+            return getattr(self, alternative)(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,128 @@
+"""
+Per-language shards of a local index directory. Every shard is a complete local index directory
+(vector store, plus its HNSW / BM25 / quantized indexes) holding the passages of a single language,
+in `<index_dir>/shards/<lang>`, so that a search in one language is an unfiltered search over a
+smaller index instead of a filtered search over the mixed-language one.
+
+Cross-lingual searches query several shards in parallel on a process pool and merge their top-k.
+The shards are memory-mapped, so the worker processes share the OS page cache with each other.
+"""
+import logging
+import os
+from itertools import islice
+
+import numpy as np
+
+import local
+import vectorstore
+
+SHARDS_DIR = "shards"
+
+
+def shard_dirs(index_dir) -> dict:
+    """
+    Finds the shards of a local index directory.
+
+    Parameters:
+    - index_dir (str): The local index directory.
+
+    Returns:
+    - dict: The shard directory of each language code, sorted by code.
+    """
+    root = os.path.join(index_dir, SHARDS_DIR)
+    if not os.path.isdir(root):
+        return {}
+    return {lang: os.path.join(root, lang) for lang in sorted(os.listdir(root))
+            if os.path.exists(os.path.join(root, lang, "store.json"))}
+
+
+def split_store(index_dir, langs=None, batch_size=65536) -> dict:
+    """
+    Splits the vector store of a local index directory into one store per language, in a single
+    streaming pass. Passage ids are kept, so `VectorStore.row` works on the shards.
+
+    Parameters:
+    - index_dir (str): The local index directory.
+    - langs (list, optional): The language codes to shard. Default is None (every language of the store).
+    - batch_size (int, optional): Rows copied at a time. Default is 65536.
+
+    Returns:
+    - dict: The written `vectorstore.VectorStore` of each language.
+    """
+    store = vectorstore.VectorStore(index_dir)
+    codes = [lang for lang in store.lang_codes if langs is None or lang in langs]
+    root = os.path.join(index_dir, SHARDS_DIR)
+    writers = {store.lang_codes.index(lang): vectorstore.VectorStoreWriter(os.path.join(root, lang), store.dim,
+                                                                           dtype=store.dtype.name)
+               for lang in codes}
+    hashes = store.row_hashes()
+    rows = store.iter_metadata()
+    for start in range(0, len(store), batch_size):
+        metadata = list(islice(rows, batch_size))
+        vectors = np.asarray(store.vectors[start:start + batch_size])
+        langs_of = np.asarray(store.langs[start:start + batch_size])
+        for code, writer in writers.items():
+            selected = np.flatnonzero(langs_of == code)
+            if len(selected):
+                writer.append(vectors[selected], [metadata[i] for i in selected],
+                              id_hashes=hashes[start + selected])
+    shards = {lang: writers[store.lang_codes.index(lang)].close() for lang in codes}
+    logging.info(f"Split {len(store)} vectors of {index_dir} into shards "
+                 + ", ".join(f"{lang}={len(shard)}" for lang, shard in shards.items()))
+    return shards
+
+
+# backends opened by this process, by (kind, shard directory, options)
+_backends = {}
+
+
+def _backend(kind, path, options):
+    key = (kind, path, tuple(sorted(options.items())))
+    if key not in _backends:
+        _backends[key] = local.BACKENDS[kind](path, **options)
+    return _backends[key]
+
+
+def _search(kind, path, options, query, lang, top_n) -> list:
+    # runs in the pool's worker processes, which keep their shards open between searches
+    return _backend(kind, path, options).search(query, lang=lang, top_n=top_n)
+
+
+class ShardedBackend:
+    """
+    Searches the per-language shards of a local index directory with one of the local backends:
+    a single language is searched in-process on its shard, several languages in parallel on the
+    process pool (or one after the other without one).
+    """
+    def __init__(self, index_dir, kind, options=None, pool=None):
+        if kind not in local.BACKENDS:
+            raise ValueError(f"Unknown local backend '{kind}', expected one of {list(local.BACKENDS)}")
+        self.kind = kind
+        self.options = options or {}
+        self.pool = pool
+        self.shards = shard_dirs(index_dir)
+        if not self.shards:
+            raise FileNotFoundError(f"No shards in {os.path.join(index_dir, SHARDS_DIR)}")
+        logging.info(f"Found {kind} shards {list(self.shards)} in {index_dir}")
+
+    def search(self, query, lang='en', top_n=10) -> list:
+        """
+        Searches the shards of the given languages.
+
+        Parameters:
+        - query (str | list): The search query, or the query embedding for the dense backends.
+        - lang (str | list, optional): The language of the articles, or several for a cross-lingual search. Default is 'en'.
+        - top_n (int, optional): The number of top results to return. Default is 10.
+
+        Returns:
+        - list: List of top articles of the searched shards, best first.
+        """
+        # languages without a shard have no passages
+        langs = [code for code in ([lang] if isinstance(lang, str) else lang) if code in self.shards]
+        if len(langs) <= 1 or self.pool is None:
+            results = [_search(self.kind, self.shards[code], self.options, query, code, top_n) for code in langs]
+        else:
+            futures = [self.pool.submit(_search, self.kind, self.shards[code], self.options, query, code, top_n)
+                       for code in langs]
+            results = [future.result() for future in futures]
+        return local.merge(results, top_n)
@@ -0,0 +1,50 @@
+import json
+import logging
+import sys
+
+import pytest
+
+from bench import run
+from bench.fakes import parse_latency
+
+
+def test_parse_latency():
+    assert parse_latency("0.01") == 0.01
+    assert parse_latency("fixed:0.02")() == 0.02
+    assert parse_latency("pareto:0.01")() >= 0.01
+    with pytest.raises(ValueError):
+        parse_latency("uniform:0.01")
+
+
+def test_regressions_compare_latencies_and_errors_with_the_baseline():
+    def results(p95, errors=0):
+        return {"stages": {"rerank": {"p50_ms": 1.0, "p95_ms": p95, "p99_ms": 3.0, "errors": errors}}}
+    assert run.regressions(results(2.2), results(2.0), tolerance=0.2) == []
+    assert run.regressions(results(2.5), results(2.0), tolerance=0.2) == [("rerank", "p95_ms", 2.0, 2.5)]
+    assert run.regressions(results(2.0, errors=1), results(2.0), tolerance=0.2) == [("rerank", "errors", 0, 1)]
+    assert run.regressions(results(9.0), {"stages": {}}, tolerance=0.2) == []
+
+
+def test_a_run_writes_its_results_and_checks_them_against_a_baseline(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "results.json")
+    # the run silences the root logger
+    monkeypatch.setattr(logging.getLogger(), "level", logging.getLogger().level)
+    options = ["--requests", "5", "--warmup", "1", "--concurrency", "2", "--dim", "8", "--tokens", "3",
+               "--weaviate-latency", "0", "--cohere-latency", "0", "--stages", "with_bm25", "rerank", "with_llm"]
+    monkeypatch.setattr(sys, "argv", ["run"] + options + ["--json", path])
+    run.main()
+    with open(path) as f:
+        results = json.load(f)
+    assert list(results["stages"]) == ["with_bm25", "rerank", "with_llm"]
+    assert all(stage["errors"] == 0 and stage["throughput"] > 0 for stage in results["stages"].values())
+
+    # a baseline 1000x faster than this run is a regression
+    for stage in results["stages"].values():
+        stage.update({metric: stage[metric] / 1000 for metric in run.METRICS})
+    with open(path, "w") as f:
+        json.dump(results, f)
+    monkeypatch.setattr(sys, "argv", ["run"] + options + ["--baseline", path])
+    with pytest.raises(SystemExit) as exited:
+        run.main()
+    assert exited.value.code == 1
+    assert "REGRESSION rerank p95_ms" in capsys.readouterr().out
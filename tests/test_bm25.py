@@ -0,0 +1,80 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import bm25
+
+
+def corpus(size=3000, vocabulary=400, seed=0):
+    # Zipf-distributed words, so that frequent terms span many posting blocks
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    words = rng.choice(vocabulary, size=size * 40, p=weights / weights.sum())
+    lengths, start, documents = rng.integers(5, 80, size=size), 0, []
+    for length in lengths:
+        documents.append({"title": "", "text": " ".join(f"w{w}" for w in words[start:start + length]), "lang": "en"})
+        start += length
+    return documents
+
+
+QUERIES = ["w0 w1", "w3 w17 w250", "w2 w2 w40", "w5 w9 w80 w160 w320", "w399", "w1 missing"]
+
+
+@pytest.fixture(scope="module")
+def documents():
+    return corpus()
+
+
+@pytest.fixture(scope="module")
+def index(documents, tmp_path_factory):
+    return bm25.BM25Index.build(documents, str(tmp_path_factory.mktemp("bm25")))
+
+
+def bm25_scores(documents, query, k1=1.2, b=0.75):
+    counts = [Counter(bm25.tokenize(f"{d['title']} {d['text']}")) for d in documents]
+    lengths = np.array([sum(c.values()) for c in counts], dtype=np.float64)
+    scores = np.zeros(len(documents))
+    for term, tf_query in Counter(bm25.tokenize(query)).items():
+        tfs = np.array([c.get(term, 0) for c in counts], dtype=np.float64)
+        df = int((tfs > 0).sum())
+        idf = math.log1p((len(documents) - df + 0.5) / (df + 0.5))
+        scores += tf_query * idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths / lengths.mean()))
+    return scores
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_block_max_pruning_finds_the_exhaustive_top_k(index, query):
+    # with k as large as the index, no block can be skipped
+    every, every_scores = index.search(query, k=len(index))
+    for k in (1, 10, 100):
+        ids, scores = index.search(query, k=k)
+        assert list(ids) == list(every[:k])
+        assert np.array_equal(scores, every_scores[:k])
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_scores_are_the_quantized_bm25_scores(documents, index, query):
+    ids, scores = index.search(query, k=len(index))
+    expected = bm25_scores(documents, query)
+    # each term contributes its score rounded to its quantization step
+    step = sum(tf * float(index.term_scale[index.vocab[term]])
+               for term, tf in Counter(bm25.tokenize(query)).items() if term in index.vocab)
+    assert set(ids) == set(np.flatnonzero(expected > 0))
+    assert np.abs(scores - expected[ids]).max() <= step + 1e-4
+
+
+def test_search_only_returns_allowed_documents(index):
+    allowed = np.zeros(len(index), dtype=bool)
+    allowed[1::2] = True
+    ids, scores = index.search("w0 w1", k=10, allowed=allowed)
+    assert len(ids) == 10 and allowed[ids].all()
+    every, every_scores = index.search("w0 w1", k=len(index))
+    assert list(ids) == [i for i in every if allowed[i]][:10]
+
+
+def test_tokenize_per_language():
+    assert bm25.tokenize("Café  au LAIT") == ["café", "au", "lait"]
+    assert bm25.tokenize("东京大学", "zh") == ["东京", "京大", "大学"]
+    assert bm25.tokenize("كَتَبَ", "ar") == ["كتب"]
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+
+import cache
+
+
+def test_normalize_query():
+    assert cache.normalize_query("  What IS  the\tcapital ") == "what is the capital"
+    assert cache.normalize_query("ﬁve") == cache.normalize_query("five")
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    lru = cache.LRUCache(maxsize=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1 and lru.get("c") == 3
+    assert lru.stats()["evictions"] == 1
+    assert (lru.stats()["hits"], lru.stats()["misses"]) == (3, 1)
+
+
+def test_lru_expires_entries():
+    lru = cache.LRUCache(ttl=0.01)
+    lru.set("a", 1)
+    time.sleep(0.02)
+    assert lru.get("a", "expired") == "expired"
+    assert lru.stats()["expirations"] == 1
+
+
+def test_sqlite_cache_is_shared_by_its_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache.SQLiteCache(path).set("key", {"articles": [1, 2]})
+    assert cache.SQLiteCache(path).get("key") == {"articles": [1, 2]}
+
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    tiered = cache.create_cache("sqlite", path=str(tmp_path / "cache.sqlite"))
+    tiered.set("key", [1])
+    tiered.front.clear()
+    assert tiered.get("key") == [1]
+    assert tiered.get("key") == [1]
+    assert tiered.get("missing") is None
+    stats = tiered.stats()
+    assert (stats["memory"]["hits"], stats["disk"]["hits"]) == (1, 1)
+
+
+def test_create_cache_rejects_unknown_backends():
+    assert isinstance(cache.create_cache("none"), cache.NullCache)
+    with pytest.raises(ValueError):
+        cache.create_cache("redis")
+
+
+def test_generation_cache_reuses_answers_of_similar_queries():
+    generations = cache.GenerationCache(cache.LRUCache(), threshold=0.9)
+    key = generations.context_key("command", 0.52, "en", [{"url": "u", "text": "t"}])
+    assert key == generations.context_key("command", 0.5, "en", [{"url": "u", "text": "t"}])
+    generations.set(key, "capital of france", "Paris", latency=2.0, embedding=[1.0, 0.0])
+    assert generations.get(key, "capital of France?") is None
+    assert generations.get_similar(key, [0.99, 0.05])["text"] == "Paris"
+    assert generations.get_similar(key, [0.0, 1.0]) is None
+    assert generations.stats()["latency_saved"] == 2.0
+
+
+def test_lookups_of_every_kind_of_cache(tmp_path):
+    lru = cache.LRUCache()
+    lru.set("a", 1)
+    lru.get("a"), lru.get("b")
+    assert cache.lookups(lru.stats()) == (1, 1)
+
+    # a memory miss served by the disk is one hit, not a hit and a miss
+    tiered = cache.create_cache("sqlite", path=str(tmp_path / "cache.sqlite"))
+    tiered.set("a", 1)
+    tiered.front.clear()
+    tiered.get("a"), tiered.get("a"), tiered.get("b")
+    assert cache.lookups(tiered.stats()) == (2, 1)
+
+    generations = cache.GenerationCache(cache.LRUCache())
+    generations.set("context", "query", "answer", latency=1.0)
+    generations.get("context", "Query ")
+    assert cache.lookups(generations.stats()) == (1, 1)
+
+
+class Engine:
+    def __init__(self):
+        self.cache = cache.LRUCache()
+        self.calls = 0
+
+    @cache.cached_search("bm25")
+    def with_bm25(self, query, lang='en', top_n=10):
+        self.calls += 1
+        return [query]
+
+    @cache.cached_search("bm25")
+    async def awith_bm25(self, query, lang='en', top_n=10):
+        self.calls += 1
+        return [query]
+
+
+def test_cached_search_shares_entries_between_sync_and_async_methods():
+    engine = Engine()
+    assert engine.with_bm25("Paris") == ["Paris"]
+    assert asyncio.run(engine.awith_bm25(" paris")) == ["Paris"]
+    assert engine.with_bm25("paris", top_n=5) == ["paris"]
+    assert engine.calls == 2
@@ -0,0 +1,42 @@
+import fusion
+
+
+def article(url, text="paragraph", **additional):
+    return {"url": url, "text": text, "_additional": additional}
+
+
+def urls(results):
+    return [doc["url"] for doc in results]
+
+
+def test_reciprocal_rank_fusion_favors_documents_found_by_both_lists():
+    sparse = [article("a"), article("b"), article("c")]
+    dense = [article("c"), article("d")]
+    fused = fusion.reciprocal_rank_fusion([sparse, dense], top_n=3)
+    assert urls(fused) == ["c", "a", "b"]
+    assert float(fused[0]["_additional"]["score"]) > float(fused[1]["_additional"]["score"])
+
+
+def test_reciprocal_rank_fusion_tells_paragraphs_of_an_article_apart():
+    fused = fusion.reciprocal_rank_fusion([[article("a", "first"), article("a", "second")]])
+    assert [doc["text"] for doc in fused] == ["first", "second"]
+
+
+def test_weighted_score_fusion_ranks_an_exact_match_first():
+    # a distance of 0 is the best match, not a missing distance
+    dense = [article("far", distance="0.5"), article("exact", distance=0.0), article("missing", distance=None)]
+    assert urls(fusion.weighted_score_fusion([], dense, alpha=1.0)) == ["exact", "far", "missing"]
+
+
+def test_weighted_score_fusion_keeps_zero_scores_below_positive_ones():
+    sparse = [article("zero", score="0"), article("high", score="2.5"), article("missing", score=None)]
+    fused = fusion.weighted_score_fusion(sparse, [], alpha=0.0)
+    assert urls(fused)[0] == "high"
+    assert float(fused[-1]["_additional"]["score"]) == 0.0
+
+
+def test_weighted_score_fusion_weighs_dense_and_sparse_scores():
+    sparse = [article("keyword", score="3"), article("both", score="2"), article("other", score="1")]
+    dense = [article("both", distance="0.1"), article("semantic", distance="0.3")]
+    assert urls(fusion.weighted_score_fusion(sparse, dense, alpha=0.5))[0] == "both"
+    assert urls(fusion.weighted_score_fusion(sparse, dense, alpha=0.0))[0] == "keyword"
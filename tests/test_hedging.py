@@ -0,0 +1,89 @@
+import asyncio
+import gc
+
+import pytest
+
+import hedging
+
+
+def attempts(*latencies, error=None):
+    # the n-th attempt sleeps latencies[n], then fails with `error` if given
+    latencies, started = list(latencies), []
+
+    def fn():
+        async def attempt(n):
+            await asyncio.sleep(latencies[n])
+            if error is not None:
+                raise error
+            return n
+        started.append(len(started))
+        return attempt(started[-1])
+    fn.started = started
+    return fn
+
+
+def warm(hedger, name, latency=0.01, count=3):
+    for _ in range(count):
+        asyncio.run(hedger.call(name, attempts(latency)))
+
+
+def test_no_hedge_before_enough_latencies_are_known():
+    hedger = hedging.Hedger(min_samples=3)
+    fn = attempts(0.02)
+    assert asyncio.run(hedger.call("neartext", fn)) == 0
+    assert hedger.delay("neartext") is None
+    assert hedger.stats()["neartext"]["hedged"] == 0
+
+
+def test_a_slow_request_is_hedged_and_the_backup_wins():
+    hedger = hedging.Hedger(percentile=50, min_samples=3, min_delay=0.001)
+    warm(hedger, "neartext")
+    fn = attempts(5.0, 0.0)
+    assert asyncio.run(asyncio.wait_for(hedger.call("neartext", fn), 1)) == 1
+    assert fn.started == [0, 1]
+    assert hedger.stats()["neartext"]["hedged"] == 1
+    assert hedger.stats()["neartext"]["backup_won"] == 1
+
+
+def test_a_cancelled_primary_counts_with_its_pending_time():
+    hedger = hedging.Hedger(percentile=100, min_samples=3, min_delay=0.001)
+    warm(hedger, "neartext", latency=0.02)
+    delay = hedger.delay("neartext")
+    asyncio.run(hedger.call("neartext", attempts(5.0, 0.0)))
+    # the primary was pending for the hedge delay, not the instant latency of the backup
+    latencies = hedger._histograms["neartext"].latencies
+    assert len(latencies) == 4
+    assert latencies[-1] >= delay * 0.9
+
+
+def test_the_error_of_the_primary_is_raised_when_both_attempts_fail():
+    hedger = hedging.Hedger(percentile=50, min_samples=3, min_delay=0.001)
+    warm(hedger, "neartext")
+    with pytest.raises(KeyError):
+        asyncio.run(hedger.call("neartext", attempts(0.05, 0.0, error=KeyError("missing"))))
+
+
+def test_the_error_of_a_losing_attempt_is_not_logged_as_never_retrieved():
+    hedger = hedging.Hedger(percentile=50, min_samples=3, min_delay=0.001)
+    warm(hedger, "neartext")
+    unretrieved = []
+
+    def primary_failing_on_cancel():
+        async def attempt(n):
+            try:
+                await asyncio.sleep(5.0 if n == 0 else 0.0)
+            except asyncio.CancelledError:
+                # e.g. a connection error raised while the request is torn down
+                raise ConnectionResetError()
+            return n
+        primary_failing_on_cancel.calls += 1
+        return attempt(primary_failing_on_cancel.calls - 1)
+    primary_failing_on_cancel.calls = 0
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+        assert await hedger.call("neartext", primary_failing_on_cancel) == 1
+        await asyncio.sleep(0.01)
+        gc.collect()
+    asyncio.run(run())
+    assert unretrieved == []
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import hnsw
+
+
+def normalized(rows, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact(vectors, query, k):
+    return np.argsort(-(vectors @ query), kind="stable")[:k]
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return normalized(1000)
+
+
+@pytest.fixture(scope="module")
+def index(vectors):
+    return hnsw.HNSWIndex.build(vectors, M=8, ef_construction=64)
+
+
+def test_recall_against_exact_search(vectors, index):
+    queries, k = normalized(50, seed=1), 10
+    found = sum(len(set(index.search(q, k=k, ef=64)[0]) & set(exact(vectors, q, k))) for q in queries)
+    assert found / (len(queries) * k) >= 0.95
+
+
+def test_distances_are_cosine_distances_closest_first(vectors, index):
+    query = normalized(1, seed=2)[0]
+    nodes, distances = index.search(query, k=5)
+    assert np.allclose(distances, 1.0 - vectors[nodes] @ query, atol=1e-5)
+    assert list(distances) == sorted(distances)
+
+
+def test_search_only_returns_allowed_nodes(vectors, index):
+    allowed = np.zeros(len(vectors), dtype=bool)
+    allowed[::3] = True
+    nodes, _ = index.search(normalized(1, seed=3)[0], k=10, allowed=allowed)
+    assert len(nodes) == 10 and allowed[nodes].all()
+
+
+def test_a_saved_graph_answers_like_the_built_one(vectors, index, tmp_path):
+    index.save(str(tmp_path / "graph"))
+    loaded = hnsw.HNSWIndex.load(str(tmp_path / "graph"), vectors)
+    assert len(loaded) == len(index)
+    for query in normalized(5, seed=4):
+        assert list(loaded.search(query, k=10)[0]) == list(index.search(query, k=10)[0])
+
+
+def test_an_empty_index_finds_nothing():
+    nodes, distances = hnsw.HNSWIndex.build(np.empty((0, 4), dtype=np.float32)).search(np.ones(4, dtype=np.float32))
+    assert len(nodes) == len(distances) == 0
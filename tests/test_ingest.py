@@ -0,0 +1,139 @@
+import asyncio
+
+import cohere
+import numpy as np
+import pytest
+from aiohttp import web
+from cohere.error import CohereAPIError
+
+import ingest
+import resilience
+import vectorstore
+from bench.fakes import FakeCohere
+
+
+def record(url, text, lang="en"):
+    return {"text": text, "title": url.title(), "url": url, "views": 1, "lang": lang}
+
+
+async def embed(texts):
+    return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+
+class FlakyCohere(FakeCohere):
+    """
+    Answers the first `failures` embed requests with `status`.
+    """
+    def __init__(self, status, failures, **kwargs):
+        super().__init__(dim=4, **kwargs)
+        self.status = status
+        self.failures = failures
+        self.embeds = 0
+
+    async def embed(self, request):
+        self.embeds += 1
+        if self.embeds <= self.failures:
+            return web.json_response({"message": "failed"}, status=self.status)
+        return await super().embed(request)
+
+
+def embed_with(server, texts, **kwargs):
+    async def run():
+        client = cohere.AsyncClient("key", api_url=server.url, check_api_key=False, max_retries=0)
+        try:
+            policy = resilience.RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.01)
+            return await ingest.cohere_embedder(client, "embed-multilingual-v2.0", retry_policy=policy, **kwargs)(texts)
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
+
+def test_chunk_splits_long_paragraphs():
+    text = "short paragraph\n\n" + " ".join(["word"] * 450)
+    chunks = ingest.chunk(text, max_words=200)
+    assert [len(chunk.split()) for chunk in chunks] == [2, 200, 200, 50]
+
+
+def test_chunk_packs_short_paragraphs():
+    assert ingest.chunk("one two\n\nthree\n\n\nfour five", max_words=3) == ["one two three", "four five"]
+
+
+def test_passage_ids_follow_the_earlier_passages_of_a_url():
+    records = [record("a", "first"), record("b", "second"), record("a", "third\n\n" + " ".join(["word"] * 300))]
+    ids = [passage["id"] for _, found in ingest.passages(records, max_words=200) for passage in found]
+    # 'a' coming back after 'b' does not overwrite its first passage
+    assert ids == ["a#0", "b#0", "a#1", "a#2", "a#3"]
+
+
+def test_passage_ids_of_records_with_an_id():
+    records = [dict(record("a", "first"), id=7), dict(record("a", "x\n\n" + " ".join(["y"] * 250)), id=8)]
+    ids = [passage["id"] for _, found in ingest.passages(records) for passage in found]
+    assert ids == ["7", "8#0", "8#1", "8#2"]
+
+
+def test_batches_resume_after_the_skipped_records():
+    records = [record(f"u{i}", f"paragraph {i}") for i in range(5)]
+    batches = list(ingest.batches(ingest.passages(records), batch_size=2, skip=1))
+    assert [(end, [p["url"] for p in batch]) for end, batch in batches] == [(3, ["u1", "u2"]), (5, ["u3", "u4"])]
+
+
+def test_checkpoints_belong_to_their_input(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    assert ingest.load_checkpoint(path, "dump.xml.bz2")["records"] == 0
+    ingest.save_checkpoint(path, {"source": "dump.xml.bz2", "records": 3, "passages": 5, "done": False})
+    assert ingest.load_checkpoint(path, "dump.xml.bz2")["passages"] == 5
+    with pytest.raises(ValueError):
+        ingest.load_checkpoint(path, "other.jsonl")
+
+
+def test_aingest_writes_interleaved_urls_to_the_store(tmp_path):
+    records = [record("a", "first"), record("b", "second"), record("a", "third")]
+    state = asyncio.run(ingest.aingest(records, ingest.StoreSink(str(tmp_path / "store")), embed, batch_size=2))
+    assert state["records"] == 3 and state["passages"] == 3 and state["done"]
+    store = vectorstore.VectorStore(str(tmp_path / "store"))
+    assert [store.metadata(store.row(id))["text"] for id in ("a#0", "b#0", "a#1")] == ["first", "second", "third"]
+
+
+def test_aingest_resumes_from_its_checkpoint(tmp_path):
+    path, checkpoint = str(tmp_path / "store"), str(tmp_path / "checkpoint.json")
+    records = [record(f"u{i}", f"paragraph number {i}") for i in range(10)]
+    hashes = ingest.PassageHashes(str(tmp_path / "hashes.sqlite"))
+
+    class Interrupted(Exception):
+        pass
+
+    async def failing(texts):
+        if "paragraph number 6" in texts:
+            raise Interrupted()
+        return await embed(texts)
+    state = ingest.load_checkpoint(checkpoint, "corpus")
+    with pytest.raises(Interrupted):
+        asyncio.run(ingest.aingest(records, ingest.StoreSink(path, hashes=hashes), failing, checkpoint=checkpoint,
+                                   state=state, batch_size=2, concurrency=1, checkpoint_every=2))
+    state = ingest.load_checkpoint(checkpoint, "corpus")
+    assert 0 < state["records"] < 10
+    sink = ingest.StoreSink(path, resume_at=state["passages"], hashes=hashes)
+    state = asyncio.run(ingest.aingest(records, sink, embed, checkpoint=checkpoint, state=state, batch_size=2))
+    store = vectorstore.VectorStore(path)
+    assert len(store) == 10 and len(hashes) == 10
+    assert np.allclose(store.vectors[store.row("u9#0")], vectorstore.normalize(asyncio.run(embed(["paragraph number 9"]))[0]))
+    hashes.close()
+
+
+def test_embedder_keeps_the_order_of_the_texts():
+    with FakeCohere(dim=4) as server:
+        texts = [f"text {i}" for i in range(10)]
+        assert embed_with(server, texts, max_texts=3) == [server.embedding(text) for text in texts]
+
+
+def test_embedder_retries_transient_errors():
+    with FlakyCohere(503, failures=2) as server:
+        assert embed_with(server, ["text"]) == [server.embedding("text")]
+        assert server.embeds == 3
+
+
+def test_embedder_fails_fast_on_bad_requests():
+    with FlakyCohere(401, failures=5) as server:
+        with pytest.raises(CohereAPIError):
+            embed_with(server, ["text"])
+        assert server.embeds == 1
@@ -0,0 +1,68 @@
+import weaviate
+from aiohttp import web
+from weaviate.util import generate_uuid5
+
+import loader
+from bench.fakes import FakeWeaviate
+
+
+class InvalidWeaviate(FakeWeaviate):
+    """
+    Answers the batches holding an object titled 'invalid' with a 422, like a batch failing validation.
+    """
+    async def batch_objects(self, request):
+        objects = (await request.json())["objects"]
+        if any(obj["properties"]["title"] == "invalid" for obj in objects):
+            return web.json_response({"error": [{"message": "invalid object"}]}, status=422)
+        return await super().batch_objects(request)
+
+
+def load(server, titles, **options):
+    uuids = [generate_uuid5(i) for i in range(len(titles))]
+    bulk = loader.BulkLoader(weaviate.Client(server.url), **options)
+    for uuid, title in zip(uuids, titles):
+        bulk.add({"title": title, "text": "text"}, vector=[0.1, 0.2], uuid=uuid)
+    rejected = bulk.flush()
+    bulk.close()
+    return uuids, rejected, bulk.stats()
+
+
+def test_batch_sizes_grow_additively_and_shrink_multiplicatively():
+    sizer = loader.BatchSizer(initial=100, minimum=10, maximum=120, target_latency=1.0)
+    sizer.success(0.5)
+    sizer.success(0.5)
+    sizer.success(0.5)
+    assert sizer.size == 120
+    sizer.success(2.0)
+    assert sizer.size == 60
+    for _ in range(5):
+        sizer.failure()
+    assert sizer.size == 10
+
+
+def test_overloaded_servers_get_every_object_eventually():
+    with FakeWeaviate(capacity=1, object_latency=0.001) as server:
+        uuids, rejected, stats = load(server, ["title"] * 300, workers=4, batch_size=20, min_batch_size=5,
+                                      max_retries=20, max_backoff=0.05)
+        assert rejected == set()
+        assert set(server.objects) == set(uuids)
+        assert server.rejected > 0
+        assert stats["objects"] == 300 and stats["failed"] == 0
+        assert stats["retries"] == stats["errors"]["http_429"] > 0
+
+
+def test_flush_returns_the_objects_of_failed_batches():
+    with InvalidWeaviate() as server:
+        titles = ["valid"] * 20 + ["invalid"] + ["valid"] * 20
+        uuids, rejected, stats = load(server, titles, workers=1, batch_size=10, linger=0.2)
+        # only the batch holding the invalid object failed, without retries
+        assert uuids[20] in rejected and len(rejected) < len(uuids)
+        assert set(server.objects) == set(uuids) - rejected
+        assert stats["failed"] == len(rejected) and stats["retries"] == 0 and stats["errors"] == {"http_422": 1}
+
+
+def test_flush_returns_the_objects_still_failing_after_the_retries():
+    with FakeWeaviate(capacity=0) as server:
+        uuids, rejected, stats = load(server, ["title"] * 5, workers=1, max_retries=2, max_backoff=0.01)
+        assert rejected == set(uuids)
+        assert stats["objects"] == 0 and stats["failed"] == 5 and stats["retries"] == 2
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pytest
+
+import loadtest
+from bench.fakes import FakeCohere, FakeWeaviate, engine_for
+
+
+@pytest.fixture(scope="module")
+def engine():
+    with FakeWeaviate() as weaviate, FakeCohere(tokens=3, dim=8) as cohere:
+        engine = engine_for(weaviate, cohere)
+        yield engine
+        engine.close()
+
+
+def test_read_queries_fills_in_the_defaults(tmp_path):
+    path = tmp_path / "queries.jsonl"
+    path.write_text('{"query": "capital of France"}\n\n{"query": "東京", "lang": "ja", "mode": "bm25", "top_n": 3}\n',
+                    encoding="utf-8")
+    assert loadtest.read_queries(str(path), lang="fr") == [
+        {"query": "capital of France", "mode": "neartext", "lang": "fr", "top_n": 10},
+        {"query": "東京", "mode": "bm25", "lang": "ja", "top_n": 3},
+    ]
+    path.write_text('{"text": "no query"}\n')
+    with pytest.raises(ValueError):
+        loadtest.read_queries(str(path))
+
+
+def test_arrivals_follow_the_rate():
+    assert list(loadtest.arrivals(4, 3, "uniform")) == [0.0, 0.25, 0.5]
+    offsets = loadtest.arrivals(100, 10000, seed=0)
+    assert offsets[-1] == pytest.approx(100, rel=0.05) and (np.diff(offsets) >= 0).all()
+    with pytest.raises(ValueError):
+        loadtest.arrivals(1, 1, "bursty")
+
+
+def test_report_percentiles_histogram_and_errors():
+    report = loadtest.LoadReport(rate=10, model="threads", concurrency=2)
+    for ms in (1, 7, 30, 40):
+        report.record(ms / 1000, {"total": ms / 1000})
+    report.record(0.5, error="CohereAPIError")
+    report.elapsed = 1.0
+    result = report.as_dict()
+    assert result["completed"] == 5 and result["achieved_qps"] == 4.0 and result["error_rate"] == 0.2
+    assert result["stages"]["end_to_end"]["max_ms"] == 40
+    assert result["stages"]["end_to_end"]["histogram"]["5"] == 1
+    assert result["stages"]["end_to_end"]["histogram"]["50"] == 2
+    assert "rerank" not in result["stages"]
+    assert "errors 20.0% {'CohereAPIError': 1}" in report.summary()
+
+
+def test_hit_rates_count_the_lookups_of_the_run_only():
+    before = {"search": (10, 10)}
+    after = {"search": (13, 11), "rerank": (0, 0)}
+    assert loadtest.hit_rates(before, after) == {"search": 0.75, "rerank": 0.0}
+
+
+@pytest.mark.parametrize("model", ["threads", "asyncio"])
+def test_loadtest_replays_the_queries_through_the_pipeline(engine, model):
+    queries = [{"query": f"{model} query {i}", "mode": "neartext", "lang": "en", "top_n": 3} for i in range(3)]
+    report = loadtest.loadtest(queries, rate=200, count=9, model=model, concurrency=3, process="uniform", engine=engine)
+    result = report.as_dict()
+    assert result["completed"] == 9 and result["errors"] == {}
+    assert {"end_to_end", "total", "presearch", "rerank", "generation"} <= set(result["stages"])
+    # every query is sent three times: the repeats completing after the first one hit the search cache
+    assert 0 < result["cache_hit_rates"]["search"] <= 6 / 9
+    json.dumps(result)
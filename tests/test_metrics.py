@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+from bench.fakes import FakeCohere, FakeWeaviate, engine_for
+
+
+def test_render_in_the_prometheus_text_format():
+    registry = metrics.Registry()
+    calls = registry.counter("app_calls_total", "Calls", ("method", "status"))
+    calls.inc(("search", "ok"))
+    calls.inc(("search", "ok"), 2)
+    calls.inc(("rerank", 'bad "quote"\n'))
+    in_flight = registry.gauge("app_in_flight", "Calls in progress")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    latency = registry.histogram("app_seconds", "Latency", ("method",), buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(("search",), seconds)
+    registry.collector("app_cache_entries", "Entries", "gauge", ("cache",), lambda: {("search",): 7, ("rerank",): 0.5})
+    assert registry.render() == "\n".join([
+        "# HELP app_calls_total Calls",
+        "# TYPE app_calls_total counter",
+        'app_calls_total{method="rerank",status="bad \\"quote\\"\\n"} 1',
+        'app_calls_total{method="search",status="ok"} 3',
+        "# HELP app_in_flight Calls in progress",
+        "# TYPE app_in_flight gauge",
+        "app_in_flight 1",
+        "# HELP app_seconds Latency",
+        "# TYPE app_seconds histogram",
+        'app_seconds_bucket{method="search",le="0.1"} 1',
+        'app_seconds_bucket{method="search",le="1.0"} 3',
+        'app_seconds_bucket{method="search",le="+Inf"} 4',
+        'app_seconds_sum{method="search"} 4.05',
+        'app_seconds_count{method="search"} 4',
+        "# HELP app_cache_entries Entries",
+        "# TYPE app_cache_entries gauge",
+        'app_cache_entries{cache="rerank"} 0.5',
+        'app_cache_entries{cache="search"} 7',
+    ]) + "\n"
+
+
+def test_the_values_of_every_thread_add_up_after_they_ended():
+    registry = metrics.Registry()
+    calls = registry.counter("app_calls_total", "Calls")
+
+    def work():
+        for _ in range(1000):
+            calls.inc()
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    del threads, thread
+    calls.inc()
+    assert calls.samples() == [("", {}, 8001)]
+
+
+def test_a_failing_collector_does_not_hide_the_other_metrics():
+    registry = metrics.Registry()
+    registry.collector("app_broken", "Broken", "gauge", (), lambda: 1 / 0)
+    registry.counter("app_calls_total", "Calls").inc()
+    assert registry.render() == "# HELP app_calls_total Calls\n# TYPE app_calls_total counter\napp_calls_total 1\n"
+    with pytest.raises(ValueError):
+        registry.counter("app_calls_total", "Calls again")
+
+
+class Engine:
+    def __init__(self):
+        self.request_metrics = metrics.RequestMetrics(metrics.Registry(), prefix="app")
+
+    @metrics.measured("search", lambda self, query, lang="en": ("bm25", lang))
+    def search(self, query, lang="en"):
+        if not query:
+            raise ValueError("empty query")
+        return [query]
+
+    @metrics.measured("search", lambda self, query, lang="en": ("bm25", lang))
+    async def asearch(self, query, lang="en"):
+        return [query]
+
+
+def test_measured_methods_count_their_calls_and_outcomes():
+    engine = Engine()
+    engine.search("q")
+    asyncio.run(engine.asearch("q", lang="fr"))
+    with pytest.raises(ValueError):
+        engine.search("")
+    requests = {tuple(labels.values()): value for _, labels, value in engine.request_metrics.requests.samples()}
+    assert requests == {("search", "bm25", "en", "ok"): 1, ("search", "bm25", "fr", "ok"): 1,
+                        ("search", "bm25", "en", "error"): 1}
+    assert engine.request_metrics.in_flight.samples() == [("", {"method": "search"}, 0)]
+    counts = [value for suffix, _, value in engine.request_metrics.latency.samples() if suffix == "_count"]
+    assert sorted(counts) == [1, 2]
+
+
+def test_the_engine_serves_its_metrics(monkeypatch):
+    monkeypatch.setenv("METRICS_PORT", "0")
+    monkeypatch.setenv("METRICS_HOST", "127.0.0.1")
+    with FakeWeaviate() as weaviate, FakeCohere() as cohere:
+        engine = engine_for(weaviate, cohere)
+        try:
+            engine.with_bm25("metrics query", top_n=3)
+            url = f"http://127.0.0.1:{engine.metrics_server.port}"
+            with urllib.request.urlopen(f"{url}/metrics") as response:
+                assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+                body = response.read().decode()
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{url}/other")
+        finally:
+            engine.close()
+    assert 'wikisearch_requests_total{method="with_bm25",model="",lang="en",status="ok"} 1' in body
+    assert "# TYPE wikisearch_request_duration_seconds histogram" in body
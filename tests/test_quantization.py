@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import quantization
+import vectorstore
+
+
+def clustered(rows, dim=32, clusters=20, seed=0):
+    # correlated dimensions of unequal variance, like text embeddings
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    mixing = rng.standard_normal((dim, dim)) * np.linspace(1.0, 0.1, dim)
+    points = centers[rng.integers(clusters, size=rows)] + 0.5 * rng.standard_normal((rows, dim)) @ mixing
+    return vectorstore.normalize(points)
+
+
+def exact(vectors, query, k):
+    return np.argsort(-(vectors @ query), kind="stable")[:k]
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return clustered(3000)
+
+
+@pytest.fixture(scope="module")
+def queries():
+    return clustered(40, seed=1)
+
+
+@pytest.fixture(scope="module", params=["pq", "opq", "int8"])
+def index(request, vectors, tmp_path_factory):
+    return quantization.QuantizedIndex.build(vectors, str(tmp_path_factory.mktemp(request.param)), kind=request.param,
+                                             m=8, opq_iterations=4)
+
+
+def recall(index, vectors, queries, k=10, candidates=100):
+    found = sum(len(set(index.search(q, vectors, k=k, candidates=candidates)[0]) & set(exact(vectors, q, k)))
+                for q in queries)
+    return found / (len(queries) * k)
+
+
+def test_recall_against_exact_search(index, vectors, queries):
+    assert recall(index, vectors, queries) >= 0.95
+    # without re-scoring more candidates than k, only the compressed scores rank the results
+    assert recall(index, vectors, queries, candidates=10) <= recall(index, vectors, queries, candidates=200)
+
+
+def test_distances_are_the_exact_cosine_distances(index, vectors, queries):
+    ids, distances = index.search(queries[0], vectors, k=5)
+    assert np.allclose(distances, 1.0 - vectors[ids] @ queries[0], atol=1e-5)
+    assert list(distances) == sorted(distances)
+
+
+def test_adc_scores_are_the_inner_products_with_the_decoded_vectors(index, vectors, queries):
+    quantizer = index.quantizer
+    if index.kind == "int8":
+        decoded, query = quantizer.encode(vectors).astype(np.float32) * quantizer.scale, queries[0]
+    else:
+        decoded = quantizer.decode(quantizer.encode(vectors))
+        query = queries[0] @ quantizer.rotation if quantizer.rotation is not None else queries[0]
+    assert np.allclose(index.scores(queries[0]), decoded @ query, atol=1e-4)
+
+
+def test_search_only_returns_allowed_vectors(index, vectors, queries):
+    allowed = np.zeros(len(vectors), dtype=bool)
+    allowed[::4] = True
+    ids, _ = index.search(queries[0], vectors, k=10, allowed=allowed)
+    assert len(ids) == 10 and allowed[ids].all()
+    assert list(ids) == [i for i in exact(vectors, queries[0], len(vectors)) if allowed[i]][:10]
+
+
+def test_opq_reconstructs_better_than_pq(vectors):
+    def error(quantizer):
+        x = vectors @ quantizer.rotation if quantizer.rotation is not None else vectors
+        return float(((x - quantizer.decode(quantizer.encode(vectors))) ** 2).sum(axis=1).mean())
+    pq = quantization.ProductQuantizer.train(vectors, 8)
+    opq = quantization.ProductQuantizer.train(vectors, 8, opq_iterations=4)
+    assert error(opq) < error(pq)
+
+
+def test_build_rejects_bad_parameters(vectors, tmp_path):
+    with pytest.raises(ValueError):
+        quantization.QuantizedIndex.build(vectors, str(tmp_path), kind="lsh")
+    with pytest.raises(ValueError):
+        quantization.QuantizedIndex.build(vectors, str(tmp_path), kind="pq", m=7)
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+from cohere.error import CohereAPIError, CohereConnectionError
+
+import resilience
+
+
+def policy(**kwargs):
+    kwargs = dict(dict(max_attempts=3, deadline=5.0, base_delay=0.001, max_delay=0.001), **kwargs)
+    return resilience.RetryPolicy(**kwargs)
+
+
+def failing(*errors, result="ok"):
+    # raises the errors one call after the other, then returns the result
+    errors, calls = list(errors), []
+
+    def fn():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    fn.calls = calls
+    return fn
+
+
+def test_transient_errors():
+    assert resilience.transient(requests.ConnectionError())
+    assert resilience.transient(CohereConnectionError("reset"))
+    assert resilience.transient(CohereAPIError("overloaded", http_status=503))
+    assert resilience.transient(CohereAPIError("slow down", http_status=429))
+    assert not resilience.transient(CohereAPIError("invalid api token", http_status=401))
+    assert not resilience.transient(ValueError("bad request"))
+
+
+def test_retries_transient_errors():
+    retry_policy = policy()
+    fn = failing(CohereConnectionError("reset"), CohereAPIError("overloaded", http_status=503))
+    assert retry_policy.call("rerank", fn) == "ok"
+    assert len(fn.calls) == 3
+    assert retry_policy.stats()["rerank"] == {"calls": 1, "retries": 2, "failures": 0,
+                                              "budget_exhausted": 0, "deadline_exceeded": 0}
+
+
+def test_does_not_retry_bad_requests():
+    retry_policy = policy()
+    fn = failing(CohereAPIError("invalid api token", http_status=401))
+    with pytest.raises(CohereAPIError):
+        retry_policy.call("embed", fn)
+    assert len(fn.calls) == 1
+    assert retry_policy.stats()["embed"]["failures"] == 1
+
+
+def test_gives_up_after_max_attempts():
+    fn = failing(*[CohereConnectionError("reset")] * 5)
+    with pytest.raises(CohereConnectionError) as raised:
+        policy(max_attempts=2).call("rerank", fn)
+    assert len(fn.calls) == 2
+    # a retried call nesting this one does not retry it again
+    assert not resilience.retryable(raised.value)
+
+
+def test_retries_stay_within_the_budget():
+    retry_policy = policy(max_attempts=10, budget=resilience.RetryBudget(ratio=0, min_per_sec=0, capacity=2))
+    fn = failing(*[CohereConnectionError("reset")] * 5)
+    with pytest.raises(CohereConnectionError):
+        retry_policy.call("rerank", fn)
+    assert len(fn.calls) == 3
+    assert retry_policy.stats()["rerank"]["budget_exhausted"] == 1
+
+
+def test_async_attempts_are_cancelled_at_the_deadline():
+    async def slow():
+        await asyncio.sleep(10)
+
+    started = time.monotonic()
+    with pytest.raises(resilience.DeadlineExceeded):
+        asyncio.run(policy(deadline=0.05).acall("agenerate", slow))
+    assert time.monotonic() - started < 1
+
+
+def test_nested_calls_share_the_outer_deadline():
+    retry_policy = policy(deadline=60)
+    outer = policy(deadline=0.05)
+
+    def nested():
+        return retry_policy.call("embed", lambda: resilience._deadline.get())
+    assert outer.call("with_neartext", nested) <= time.monotonic() + 0.05
+
+
+def breaker(**kwargs):
+    kwargs = dict(dict(window=4, min_calls=2, failure_rate=0.5, reset_timeout=0.05), **kwargs)
+    return resilience.CircuitBreaker("rerank", **kwargs)
+
+
+def trip(circuit):
+    for _ in range(circuit.min_calls):
+        with pytest.raises(CohereConnectionError):
+            circuit.call(failing(CohereConnectionError("reset")))
+    assert circuit.stats()["state"] == circuit.OPEN
+
+
+def test_breaker_opens_and_falls_back():
+    circuit = breaker()
+    trip(circuit)
+    fn = failing()
+    assert circuit.call(fn, fallback=lambda: "degraded") == "degraded"
+    assert not fn.calls
+    with pytest.raises(resilience.CircuitOpenError):
+        circuit.call(fn)
+    assert circuit.stats()["rejected"] == 2
+    assert circuit.stats()["fallbacks"] == 1
+
+
+def test_breaker_ignores_bad_requests():
+    circuit = breaker()
+    for _ in range(4):
+        with pytest.raises(CohereAPIError):
+            circuit.call(failing(CohereAPIError("too many tokens", http_status=400)))
+    assert circuit.stats()["state"] == circuit.CLOSED
+
+
+def test_breaker_closes_after_a_successful_trial():
+    circuit = breaker()
+    trip(circuit)
+    time.sleep(0.06)
+    assert circuit.call(failing()) == "ok"
+    assert circuit.stats()["state"] == circuit.CLOSED
+
+
+def test_breaker_lets_a_single_trial_through():
+    circuit = breaker()
+    trip(circuit)
+    time.sleep(0.06)
+    started, release = threading.Event(), threading.Event()
+
+    def trial():
+        started.set()
+        release.wait(5)
+        return "ok"
+    thread = threading.Thread(target=circuit.call, args=(trial,))
+    thread.start()
+    started.wait(5)
+    with pytest.raises(resilience.CircuitOpenError):
+        circuit.call(failing())
+    release.set()
+    thread.join()
+    assert circuit.stats()["state"] == circuit.CLOSED
+
+
+def test_breaker_frees_the_trial_of_a_cancelled_call():
+    circuit = breaker()
+    trip(circuit)
+    time.sleep(0.06)
+
+    async def cancelled():
+        task = asyncio.ensure_future(circuit.acall(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancelled())
+    assert circuit.stats()["state"] == circuit.HALF_OPEN
+    # the next call is the trial, instead of being rejected until the process restarts
+    assert circuit.call(failing()) == "ok"
+    assert circuit.stats()["state"] == circuit.CLOSED
+
+
+def test_breaker_frees_the_trial_of_an_interrupted_sync_call():
+    circuit = breaker()
+    trip(circuit)
+    time.sleep(0.06)
+    with pytest.raises(KeyboardInterrupt):
+        circuit.call(failing(KeyboardInterrupt()))
+    assert circuit.call(failing()) == "ok"
@@ -0,0 +1,68 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import local
+import shards
+import vectorstore
+
+LANGS = ["en", "fr", "de"]
+
+
+@pytest.fixture(scope="module")
+def index_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("index"))
+    rng = np.random.default_rng(0)
+    words = ["paris", "berlin", "river", "museum", "bridge", "tower", "station", "garden"]
+    rows = [{"text": " ".join(rng.choice(words, size=6)), "title": f"T{i}", "url": f"u{i}", "views": i,
+             "lang": LANGS[i % 3]} for i in range(90)]
+    with vectorstore.VectorStoreWriter(path, dim=8) as writer:
+        writer.append(rng.standard_normal((90, 8)), rows, ids=[f"p{i}" for i in range(90)])
+    local.build_dense_index(path, M=8, ef_construction=40)
+    for shard in shards.split_store(path, langs=["en", "fr"]):
+        local.build_dense_index(shards.shard_dirs(path)[shard], M=8, ef_construction=40)
+        local.build_sparse_index(shards.shard_dirs(path)[shard])
+    return path
+
+
+def test_split_store_keeps_the_rows_and_ids_of_each_language(index_dir):
+    store = vectorstore.VectorStore(index_dir)
+    assert list(shards.shard_dirs(index_dir)) == ["en", "fr"]
+    for lang, path in shards.shard_dirs(index_dir).items():
+        shard = vectorstore.VectorStore(path)
+        assert len(shard) == 30 and shard.lang_codes == [lang]
+        for id in ("p0", "p1", "p2", "p30", "p31"):
+            row = store.row(id)
+            if store.metadata(row)["lang"] == lang:
+                assert shard.metadata(shard.row(id)) == store.metadata(row)
+                assert np.array_equal(shard.vectors[shard.row(id)], store.vectors[row])
+            else:
+                assert shard.row(id) is None
+
+
+def test_a_shard_answers_like_the_filtered_index(index_dir):
+    # cosine distances, unlike BM25 scores, do not depend on the other passages of the index
+    sharded = shards.ShardedBackend(index_dir, "hnsw")
+    unsharded = local.LocalDenseBackend(index_dir)
+    query = np.random.default_rng(1).standard_normal(8).tolist()
+    for lang in ("en", "fr", ["en", "fr"]):
+        assert ([a["url"] for a in sharded.search(query, lang=lang, top_n=5)]
+                == [a["url"] for a in unsharded.search(query, lang=lang, top_n=5)])
+    # languages without a shard have no passages
+    assert sharded.search(query, lang="de") == []
+
+
+def test_cross_lingual_searches_run_on_the_pool(index_dir):
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        pooled = shards.ShardedBackend(index_dir, "bm25", pool=pool).search("river tower", lang=["en", "fr"], top_n=6)
+    inline = shards.ShardedBackend(index_dir, "bm25").search("river tower", lang=["en", "fr"], top_n=6)
+    assert pooled == inline
+    assert {article["lang"] for article in pooled} <= {"en", "fr"}
+
+
+def test_sharded_backend_rejects_missing_shards_and_backends(index_dir, tmp_path):
+    with pytest.raises(ValueError):
+        shards.ShardedBackend(index_dir, "faiss")
+    with pytest.raises(FileNotFoundError):
+        shards.ShardedBackend(str(tmp_path), "bm25")
@@ -0,0 +1,153 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+
+import tracing
+from bench.fakes import FakeCohere, FakeServer, FakeWeaviate, engine_for
+
+
+class MemoryExporter:
+    def __init__(self):
+        self.spans = []
+        self.closed = False
+
+    def export(self, spans):
+        self.spans += spans
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCollector(FakeServer):
+    """
+    Accepts OTLP/HTTP JSON exports on /v1/traces.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.payloads = []
+
+    def routes(self) -> list:
+        return [web.post("/v1/traces", self.traces)]
+
+    async def traces(self, request):
+        self.payloads.append(await request.json())
+        return web.json_response({})
+
+
+class Stage:
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    @tracing.traced("stage.sync", lambda query, top_n=10: {"stage.top_n": top_n})
+    def search(self, query, top_n=10):
+        with tracing.span("stage.request", kind="client") as span:
+            span.set_status_code(200)
+        return [query] * top_n
+
+    @tracing.traced("stage.async")
+    async def asearch(self, query):
+        raise KeyError(query)
+
+
+def test_spans_of_a_trace_are_linked_to_their_parents():
+    exporter = MemoryExporter()
+    tracer = tracing.Tracer(exporter, interval=0.01)
+    with tracer.span("pipeline", mode="neartext") as root:
+        Stage(tracer).search("q", top_n=3)
+        root.add("retries")
+        root.add("retries")
+    tracer.shutdown()
+    spans = {span.name: span for span in exporter.spans}
+    assert list(spans) == ["stage.request", "stage.sync", "pipeline"] and exporter.closed
+    assert len({span.trace_id for span in exporter.spans}) == 1
+    assert spans["pipeline"].parent_id is None
+    assert spans["stage.sync"].parent_id == spans["pipeline"].span_id
+    assert spans["stage.request"].parent_id == spans["stage.sync"].span_id
+    assert spans["stage.sync"].attributes == {"stage.top_n": 3, "result.count": 3}
+    assert spans["stage.request"].attributes == {"http.response.status_code": 200}
+    assert spans["pipeline"].attributes == {"mode": "neartext", "retries": 2}
+    assert spans["stage.request"].end_ns <= spans["stage.sync"].end_ns <= spans["pipeline"].end_ns
+
+
+def test_errors_are_recorded_on_their_span():
+    exporter = MemoryExporter()
+    tracer = tracing.Tracer(exporter)
+    with pytest.raises(KeyError):
+        asyncio.run(Stage(tracer).asearch("q"))
+    tracer.shutdown()
+    [span] = exporter.spans
+    assert span.status == tracing.STATUS_ERROR and span.attributes["error.type"] == "KeyError"
+    assert span.as_dict()["status"] == "error"
+
+
+def test_untraced_and_unsampled_calls_create_no_span():
+    assert tracing.current_span() is tracing.NO_SPAN
+    with tracing.span("orphan") as span:
+        assert span is tracing.NO_SPAN
+    exporter = MemoryExporter()
+    tracer = tracing.Tracer(exporter, sample_ratio=0.0)
+    with tracer.span("pipeline") as root:
+        assert root is tracing.NO_SPAN
+        assert Stage(tracer).search("q", top_n=1) == ["q"]
+    tracer.shutdown()
+    assert exporter.spans == []
+    assert Stage(tracing.Tracer()).search("q", top_n=2) == ["q", "q"]
+
+
+def test_file_traces_break_down_the_time_of_the_spans(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    tracer = tracing.create_tracer("file", path=path)
+    with tracer.span("pipeline"):
+        Stage(tracer).search("q")
+    tracer.shutdown()
+    with open(path) as f:
+        spans = [json.loads(line) for line in f]
+    assert [span["name"] for span in spans] == ["stage.request", "stage.sync", "pipeline"]
+    summary = tracing.summarize(path)
+    assert set(summary) == {"stage.request", "stage.sync", "pipeline"}
+    by_name = {span["name"]: span["duration_ms"] for span in spans}
+    assert summary["pipeline"]["self_ms"] == pytest.approx(by_name["pipeline"] - by_name["stage.sync"], abs=1e-6)
+    assert summary["stage.sync"]["count"] == 1 and summary["stage.sync"]["errors"] == 0
+
+
+def test_otlp_exports_follow_the_json_encoding():
+    with FakeCollector() as collector:
+        tracer = tracing.create_tracer("otlp", endpoint=collector.url, service_name="tests")
+        with tracer.span("pipeline", top_n=3, langs=["en", "fr"], hit=True, score=0.5) as span:
+            span.set_status_code(503)
+        tracer.shutdown()
+    [payload] = collector.payloads
+    [resource] = payload["resourceSpans"]
+    assert resource["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "tests"}}]
+    [span] = resource["scopeSpans"][0]["spans"]
+    assert span["name"] == "pipeline" and "parentSpanId" not in span and len(span["traceId"]) == 32
+    assert span["status"] == {"code": tracing.STATUS_ERROR, "message": "HTTP 503"}
+    attributes = {item["key"]: item["value"] for item in span["attributes"]}
+    assert attributes["top_n"] == {"intValue": "3"} and attributes["hit"] == {"boolValue": True}
+    assert attributes["langs"] == {"arrayValue": {"values": [{"stringValue": "en"}, {"stringValue": "fr"}]}}
+    assert attributes["score"] == {"doubleValue": 0.5}
+
+
+def test_create_tracer_rejects_unknown_exporters():
+    assert not tracing.create_tracer("none").enabled
+    with pytest.raises(ValueError):
+        tracing.create_tracer("zipkin")
+
+
+def test_engine_searches_are_traced_down_to_the_requests(tmp_path, monkeypatch):
+    path = str(tmp_path / "traces.jsonl")
+    monkeypatch.setenv("TRACE_EXPORTER", "file")
+    monkeypatch.setenv("TRACE_FILE", path)
+    with FakeWeaviate() as weaviate, FakeCohere() as cohere:
+        engine = engine_for(weaviate, cohere)
+        try:
+            engine.with_bm25("traced query", top_n=3)
+        finally:
+            engine.close()
+    with open(path) as f:
+        spans = {span["name"]: span for span in map(json.loads, f)}
+    root = [span for span in spans.values() if span["parent_id"] is None]
+    assert len(root) == 1 and root[0]["attributes"]["search.mode"] == "bm25"
+    assert spans["graphql.request"]["attributes"]["http.response.status_code"] == 200
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from cohere.error import CohereAPIError
+
+import resilience
+import transport
+from bench.fakes import FakeCohere, FakeWeaviate
+
+
+class FailingCohere(FakeCohere):
+    async def generate(self, request):
+        return web.json_response({"message": "internal server error"}, status=500)
+
+
+def client(server):
+    return transport.PooledCohereClient("key", api_url=server.url, check_api_key=False, max_retries=0, pool_size=2)
+
+
+def test_pooled_client_answers_over_the_pool():
+    with FakeCohere(tokens=3) as server:
+        co = client(server)
+        assert co.generate(prompt="hello").generations[0].text == "word0 word1 word2 "
+        assert "".join(token.text for token in co.generate(prompt="hello", stream=True)) == "word0 word1 word2 "
+        assert co.rerank(query="q", documents=["a", "b"], model="rerank-multilingual-v2.0").results
+        assert server.connections == 1
+        assert co.pool_stats()["requests"] == 3 and co.pool_stats()["connections_opened"] == 1
+
+
+def test_streamed_generation_raises_on_http_errors():
+    # instead of a stream of no tokens, that would be taken for an empty answer
+    with FailingCohere() as server:
+        with pytest.raises(CohereAPIError) as raised:
+            list(client(server).generate(prompt="hello", stream=True))
+        assert raised.value.http_status == 500
+        assert resilience.transient(raised.value)
+
+
+def test_async_pooled_client_answers_over_the_pool():
+    async def embed(server):
+        co = transport.PooledAsyncCohereClient("key", api_url=server.url, check_api_key=False, max_retries=0)
+        try:
+            for _ in range(3):
+                response = await co.embed(texts=["a", "b"], model="embed-multilingual-v2.0")
+            return response.embeddings, co.pool_stats()
+        finally:
+            await co.close()
+    with FakeCohere(dim=4) as server:
+        embeddings, stats = asyncio.run(embed(server))
+        assert embeddings == [server.embedding("a"), server.embedding("b")]
+        assert stats["requests"] == 3 and stats["connections_opened"] == 1
+        assert server.connections == 1
+
+
+def test_graphql_queries_share_the_connections_of_the_loop_thread():
+    loop = transport.EventLoopThread()
+    with FakeWeaviate() as server:
+        graphql = transport.AsyncGraphQLTransport(server.url, pool_size=4)
+        try:
+            for i in range(5):
+                data = loop.run(graphql.query(f'{{ Get {{ Articles(nearText: {{concepts: ["q{i}"]}}, limit: 2) '
+                                              f'{{ title }} }} }}'))
+                assert len(data["Get"]["Articles"]) == 2
+            assert graphql.pool_stats()["requests"] == 5 and graphql.pool_stats()["connections_opened"] == 1
+            assert server.connections == 1
+            # the session is bound to the loop that opened it
+            with pytest.raises(RuntimeError):
+                asyncio.run(graphql.query("{ Get { Articles { title } } }"))
+        finally:
+            loop.run(graphql.close())
+            loop.stop()
+
+
+def test_a_coroutine_of_the_loop_thread_cannot_block_on_it():
+    loop = transport.EventLoopThread()
+
+    async def nested():
+        return loop.run(asyncio.sleep(0))
+    try:
+        with pytest.raises(RuntimeError):
+            loop.run(nested())
+    finally:
+        loop.stop()
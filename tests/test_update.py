@@ -0,0 +1,190 @@
+import asyncio
+
+import pytest
+import weaviate
+from aiohttp import web
+
+import ingest
+import update
+from bench.fakes import FakeWeaviate
+
+
+def record(url, text, views=1, title="Title"):
+    return {"text": text, "title": title, "url": url, "views": views, "lang": "en"}
+
+
+async def embed(texts):
+    return [[float(len(text)), 1.0] for text in texts]
+
+
+class RecordingSink:
+    """
+    Update sink keeping the changes in memory, failing the upserts of the passages in `failing`.
+    """
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.upserted, self.updated, self.deleted = [], [], []
+        self.failed = set()
+
+    def upsert(self, vectors, passages):
+        assert len(vectors) == len(passages)
+        self.upserted += [p["id"] for p in passages]
+        self.failed |= {p["id"] for p in passages if p["id"] in self.failing}
+
+    def update_properties(self, passages):
+        self.updated += [p["id"] for p in passages]
+
+    def delete(self, ids):
+        self.deleted += ids
+
+    def flush(self):
+        failed, self.failed = self.failed, set()
+        return failed
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def hashes(tmp_path):
+    hashes = ingest.PassageHashes(str(tmp_path / "hashes.sqlite"))
+    yield hashes
+    hashes.close()
+
+
+def ingested(hashes, records):
+    hashes.begin_run()
+    hashes.record(passage for _, found in ingest.passages(records) for passage in found)
+
+
+def ids(records):
+    return [passage["id"] for _, found in ingest.passages(records) for passage in found]
+
+
+def test_diff_finds_new_and_changed_passages(hashes):
+    old = [record("a", "first"), record("b", "second"), record("c", "third")]
+    ingested(hashes, old)
+    new = [record("a", "first"), record("b", "second, edited"), record("c", "third", views=5), record("d", "fourth")]
+    hashes.begin_run()
+    counts = {"unchanged": 0, "added": 0, "changed": 0, "properties": 0}
+    changed = [(p["id"], p["embed"]) for _, found in update.diff(ingest.passages(new), hashes, counts) for p in found]
+    assert counts == {"unchanged": 1, "added": 1, "changed": 1, "properties": 1}
+    assert changed == [(ids(new)[1], True), (ids(new)[2], False), (ids(new)[3], True)]
+
+
+def test_aupdate_applies_the_changes_and_deletes_missing_articles(hashes):
+    ingested(hashes, [record("a", "first"), record("b", "second"), record("c", "third")])
+    new = [record("a", "first, edited"), record("b", "second", views=9)]
+    sink = RecordingSink()
+    counts = asyncio.run(update.aupdate(new, hashes, sink, embed, delete_missing=True))
+    assert counts["changed"] == 1 and counts["properties"] == 1 and counts["deleted"] == 1
+    assert counts["embedded"] == 1
+    assert sink.upserted == ids(new)[:1] and sink.updated == ids(new)[1:]
+    assert sink.deleted == ids([record("c", "third")])
+    assert len(hashes) == 2
+    # the second run finds nothing to do
+    counts = asyncio.run(update.aupdate(new, hashes, RecordingSink(), embed))
+    assert counts["unchanged"] == 2 and counts["embedded"] == 0
+
+
+def test_aupdate_does_not_record_the_hashes_of_failed_upserts(hashes):
+    ingested(hashes, [record("a", "first")])
+    new = [record("a", "first, edited"), record("b", "second")]
+    failed = ids(new)[1]
+    counts = asyncio.run(update.aupdate(new, hashes, RecordingSink(failing=[failed]), embed))
+    assert counts["added"] == 1 and counts["changed"] == 1
+    assert failed not in hashes.lookup([failed])
+    # the next update applies the failed passage again
+    sink = RecordingSink()
+    counts = asyncio.run(update.aupdate(new, hashes, sink, embed))
+    assert counts["added"] == 1 and counts["unchanged"] == 1
+    assert sink.upserted == [failed]
+
+
+class RejectingWeaviate(FakeWeaviate):
+    """
+    Rejects the objects titled 'rejected', one by one, like objects failing Weaviate's validation.
+    """
+    async def batch_objects(self, request):
+        results = []
+        for obj in (await request.json())["objects"]:
+            if obj["properties"]["title"] == "rejected":
+                results.append(dict(obj, result={"errors": {"error": [{"message": "invalid object"}]}}))
+            else:
+                self.objects[obj["id"]] = obj
+                results.append(dict(obj, result={}))
+        return web.json_response(results)
+
+
+def test_hashes_are_only_recorded_for_imported_objects(hashes):
+    records = [record("a", "first"), record("b", "second", title="rejected"), record("c", "third")]
+    with RejectingWeaviate() as server:
+        client = weaviate.Client(server.url)
+        hashes.begin_run()
+        asyncio.run(ingest.aingest(records, ingest.WeaviateSink(client, workers=1, hashes=hashes), embed))
+        assert len(server.objects) == 2
+        assert len(hashes) == 2
+
+        records[1]["title"] = "accepted"
+        counts = asyncio.run(update.aupdate(records, hashes, update.WeaviateUpdateSink(client, workers=1), embed))
+        assert counts["added"] == 1 and counts["unchanged"] == 2
+        assert len(server.objects) == 3
+        assert len(hashes) == 3
+
+        records[1]["title"] = "rejected"
+        records[1]["text"] = "second, edited"
+        counts = asyncio.run(update.aupdate(records, hashes, update.WeaviateUpdateSink(client, workers=1), embed))
+        assert counts["changed"] == 1 and counts["deleted"] == 0
+        # the failed passage keeps the hash of its object in the class, and is not deleted as stale
+        assert len(server.objects) == 3
+        failed = ids(records)[1]
+        assert hashes.lookup([failed])[failed][0] != ingest.passage_hashes(dict(records[1], id=failed))[0]
+
+
+def test_failed_property_updates_do_not_abort_the_update(hashes):
+    records = [record("a", "first"), record("b", "second")]
+    with FakeWeaviate() as server:
+        client = weaviate.Client(server.url)
+        hashes.begin_run()
+        asyncio.run(ingest.aingest(records, ingest.WeaviateSink(client, workers=1, hashes=hashes), embed))
+        # the PATCH of an object missing from the class fails with a 404
+        missing = ids(records)[1]
+        server.objects.pop(update.generate_uuid5(missing))
+
+        for r in records:
+            r["views"] = 7
+        counts = asyncio.run(update.aupdate(records, hashes, update.WeaviateUpdateSink(client, workers=1), embed))
+        assert counts["properties"] == 2 and counts["deleted"] == 0
+        assert next(iter(server.objects.values()))["properties"]["views"] == 7
+        # the failed passage keeps its previous hash, and is updated again by the next run
+        recorded = hashes.lookup(ids(records))
+        assert recorded[ids(records)[0]][1] == ingest.passage_hashes(dict(records[0], id=ids(records)[0]))[1]
+        assert recorded[missing][1] != ingest.passage_hashes(dict(records[1], id=missing))[1]
+        counts = asyncio.run(update.aupdate(records, hashes, update.WeaviateUpdateSink(client, workers=1), embed))
+        assert counts["properties"] == 1 and counts["unchanged"] == 1
+
+
+class CountingHashes(ingest.PassageHashes):
+    def __init__(self, path):
+        super().__init__(path)
+        self.sees = 0
+
+    def see(self, urls, ids):
+        self.sees += 1
+        super().see(urls, ids)
+
+
+def test_changed_batches_record_the_seen_passages_once_per_batch(tmp_path):
+    hashes = CountingHashes(str(tmp_path / "hashes.sqlite"))
+    old = [record(f"u{i}", f"text {i}") for i in range(10)]
+    ingested(hashes, old)
+    new = [record(f"u{i}", f"text {i}" if i % 2 else f"edited {i}") for i in range(10)]
+    hashes.begin_run()
+    counts = {"unchanged": 0, "added": 0, "changed": 0, "properties": 0}
+    batches = list(update.changed_batches(ingest.passages(new), hashes, counts, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert hashes.sees == 3
+    assert counts["unchanged"] == 5 and counts["changed"] == 5
+    # every unchanged passage was seen: only the changed ones, recorded once written, are not yet
+    assert sorted(hashes.stale(everywhere=True)) == sorted(p["id"] for batch in batches for p in batch)
+    hashes.close()
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pytest
+
+import local
+import vectorstore
+
+
+def rows(start, count):
+    return [{"text": f"passage {i}", "title": f"T{i}", "url": f"u{i}", "views": i, "lang": "en" if i % 2 else "fr"}
+            for i in range(start, start + count)]
+
+
+def vectors(start, count, dim=4):
+    return np.arange(start * dim, (start + count) * dim, dtype=np.float32).reshape(count, dim) + 1
+
+
+def test_written_rows_are_found_by_id(tmp_path):
+    with vectorstore.VectorStoreWriter(str(tmp_path), dim=4) as writer:
+        writer.append(vectors(0, 3), rows(0, 3), ids=["c", "a", "b"])
+        writer.append(vectors(3, 2), rows(3, 2), ids=["é", 7])
+    store = vectorstore.VectorStore(str(tmp_path))
+    assert len(store) == 5
+    assert [store.row(id) for id in ["c", "a", "b", "é", "7", "missing"]] == [0, 1, 2, 3, 4, None]
+    assert store.metadata(3) == rows(3, 1)[0]
+    assert [row["url"] for row in store.iter_metadata()] == [f"u{i}" for i in range(5)]
+    assert np.allclose(store.vectors, vectorstore.normalize(vectors(0, 5)))
+    assert np.allclose(np.linalg.norm(store.vectors, axis=1), 1.0)
+    assert list(store.row_hashes()) == [vectorstore.id_hash(id) for id in ["c", "a", "b", "é", 7]]
+    assert list(np.flatnonzero(store.lang_mask("en"))) == [1, 3]
+    assert not store.lang_mask("de").any()
+
+
+def test_float16_stores_and_empty_stores(tmp_path):
+    with vectorstore.VectorStoreWriter(str(tmp_path / "half"), dim=4, dtype="float16") as writer:
+        writer.append(vectors(0, 2), rows(0, 2))
+    store = vectorstore.VectorStore(str(tmp_path / "half"))
+    assert store.vectors.dtype == np.float16 and store.row(1) == 1
+    assert np.allclose(store.vectors, vectorstore.normalize(vectors(0, 2)), atol=1e-3)
+
+    vectorstore.VectorStoreWriter(str(tmp_path / "empty"), dim=4).close()
+    store = vectorstore.VectorStore(str(tmp_path / "empty"))
+    assert len(store) == 0 and store.row("a") is None
+
+
+def test_the_writer_rejects_bad_input(tmp_path):
+    with pytest.raises(ValueError):
+        vectorstore.VectorStoreWriter(str(tmp_path / "int"), dim=4, dtype="int8")
+    writer = vectorstore.VectorStoreWriter(str(tmp_path / "dup"), dim=4)
+    with pytest.raises(ValueError):
+        writer.append(vectors(0, 2), rows(0, 3))
+    writer.append(vectors(0, 2), rows(0, 2), ids=["a", "a"])
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_a_resumed_writer_drops_the_rows_after_the_checkpoint(tmp_path):
+    path = str(tmp_path)
+    writer = vectorstore.VectorStoreWriter(path, dim=4)
+    writer.append(vectors(0, 3), rows(0, 3), ids=["a", "b", "c"])
+    assert writer.checkpoint() == 3
+    writer.append(vectors(3, 2), rows(3, 2), ids=["d", "e"])
+    assert writer.checkpoint() == 5
+    del writer
+    # interrupted, while the caller's own checkpoint only covered the first two rows
+    with pytest.raises(ValueError):
+        vectorstore.VectorStoreWriter.resume(path, 6)
+    writer = vectorstore.VectorStoreWriter.resume(path, 2)
+    writer.append(vectors(5, 2), rows(5, 2), ids=["c", "f"])
+    store = writer.close()
+    assert [store.row(id) for id in "abcdef"] == [0, 1, 2, None, None, 3]
+    assert store.metadata(2)["url"] == "u5"
+    assert np.allclose(store.vectors[2], vectorstore.normalize(vectors(5, 1))[0])
+
+
+def test_import_store_reads_the_ids_of_the_metadata(tmp_path):
+    np.save(str(tmp_path / "vectors.npy"), vectors(0, 3))
+    with open(tmp_path / "metadata.jsonl", "w") as f:
+        for i, row in enumerate(rows(0, 3)):
+            f.write(json.dumps(dict(row, id=f"p{i}") if i else row) + "\n")
+    store = local.import_store(str(tmp_path / "index"), str(tmp_path / "vectors.npy"), str(tmp_path / "metadata.jsonl"),
+                               batch_size=2)
+    assert [store.row(id) for id in [0, "p1", "p2"]] == [0, 1, 2]
+    assert "id" not in store.metadata(1)
+
+
+def test_local_backends_answer_from_the_store(tmp_path):
+    index_dir = str(tmp_path)
+    embeddings = np.random.default_rng(0).standard_normal((40, 8)).astype(np.float32)
+    with vectorstore.VectorStoreWriter(index_dir, dim=8) as writer:
+        writer.append(embeddings, rows(0, 40), ids=[f"p{i}" for i in range(40)])
+    local.build_dense_index(index_dir, M=4, ef_construction=20)
+    local.build_sparse_index(index_dir)
+
+    found = local.LocalDenseBackend(index_dir).search(embeddings[7].tolist(), lang="en", top_n=3)
+    assert found[0]["url"] == "u7" and found[0]["_additional"]["distance"] == pytest.approx(0.0, abs=1e-5)
+    assert {article["lang"] for article in found} == {"en"}
+    assert local.LocalDenseBackend(index_dir).search(embeddings[7].tolist(), lang="fr", top_n=3)[0]["url"] != "u7"
+
+    found = local.LocalSparseBackend(index_dir).search("passage 12", lang=["en", "fr"], top_n=2)
+    assert found[0]["url"] == "u12" and float(found[0]["_additional"]["score"]) > 0
@@ -0,0 +1,157 @@
+import threading
+
+import pytest
+
+from aiohttp import web
+
+from bench.fakes import FakeCohere, FakeWeaviate, engine_for
+
+
+CONTEXT = [{"text": "Paris is the capital of France.", "title": "Paris", "url": "https://en.wikipedia.org/wiki/Paris"}]
+
+
+class DownCohere(FakeCohere):
+    """
+    Answers the rerank and generate requests with 503, like an API in an outage.
+    """
+    async def rerank(self, request):
+        return web.json_response({"message": "service unavailable"}, status=503)
+
+    async def generate(self, request):
+        return web.json_response({"message": "service unavailable"}, status=503)
+
+
+class LocalIndex:
+    """
+    Local index answering with the thread it searched on.
+    """
+    def search(self, query, lang='en', top_n=10):
+        return [{"url": threading.current_thread().name, "text": str(query)[:20], "title": "", "views": 0, "lang": lang}]
+
+
+@pytest.fixture(scope="module")
+def servers():
+    with FakeWeaviate() as weaviate, FakeCohere(tokens=3) as cohere:
+        yield weaviate, cohere
+
+
+@pytest.fixture(scope="module")
+def engine(servers):
+    engine = engine_for(*servers)
+    yield engine
+    engine.close()
+
+
+def test_with_llm_streams_the_tokens_of_the_answer(engine):
+    stream = engine.with_llm(CONTEXT, "capital of France?", stream=True)
+    assert list(stream) == ["word0 ", "word1 ", "word2 "]
+    assert stream.text == "word0 word1 word2 "
+    assert 0 <= stream.ttfb <= stream.total
+
+
+def test_awith_llm_streams_the_tokens_of_the_answer(engine):
+    async def tokens():
+        stream = await engine.awith_llm(CONTEXT, "largest city of France?", stream=True)
+        return [text async for text in stream], stream
+    texts, stream = engine.run(tokens())
+    assert "".join(texts) == stream.text == "word0 word1 word2 "
+    assert stream.ttfb is not None
+
+
+def test_rerank_only_sends_the_documents_not_scored_before(engine, servers):
+    cohere = servers[1]
+    documents = [{"text": f"paragraph {i}", "url": f"u{i}"} for i in range(4)]
+    requests = cohere.requests
+    first = engine.rerank("rerank query", documents[:3], top_n=3)
+    assert cohere.requests == requests + 1
+    again = engine.rerank(" Rerank  QUERY", documents[:3], top_n=3)
+    assert [(r.index, r.relevance_score) for r in again.results] == [(r.index, r.relevance_score) for r in first.results]
+    assert cohere.requests == requests + 1
+    scores = {r.document["url"]: r.relevance_score for r in engine.rerank("rerank query", documents, top_n=4).results}
+    assert cohere.requests == requests + 2
+    assert scores["u3"] == cohere.relevance("rerank query", "paragraph 3")
+    assert {r.document["url"]: r.relevance_score for r in first.results} == {u: scores[u] for u in ("u0", "u1", "u2")}
+
+
+@pytest.mark.parametrize("mode", ["bm25", "neartext"])
+def test_search_batch_searches_local_indexes_off_the_event_loop(engine, mode):
+    backends = engine.dense, engine.sparse
+    engine.dense = engine.sparse = LocalIndex()
+    try:
+        results = engine.search_batch([f"{mode} query {i}" for i in range(3)], mode=mode)
+    finally:
+        engine.dense, engine.sparse = backends
+    loop_thread = engine.run(_current_thread())
+    assert len(results) == 3
+    assert loop_thread not in {result[0]["url"] for result in results}
+
+
+async def _current_thread():
+    return threading.current_thread().name
+
+
+def test_embed_queries_only_sends_each_missing_query_once(engine, servers):
+    cohere = servers[1]
+    requests = cohere.requests
+    first = engine.embed_queries(["Embed me", "embed  ME", "another query"])
+    assert cohere.requests == requests + 1
+    assert first[0] == first[1] != first[2] and len(first[0]) == cohere.dim
+    queries = [f"query {i}" for i in range(engine.EMBED_BATCH_SIZE + 1)]
+    embeddings = engine.embed_queries(["another query"] + queries)
+    assert cohere.requests == requests + 3
+    assert embeddings[0] == first[2] and len(embeddings) == len(queries) + 1
+
+
+def test_failing_apis_degrade_to_the_fallbacks(monkeypatch):
+    monkeypatch.setenv("RETRY_ATTEMPTS", "1")
+    documents = [{"text": f"paragraph {i}", "url": f"u{i}"} for i in range(3)]
+    with FakeWeaviate() as weaviate, DownCohere() as cohere:
+        engine = engine_for(weaviate, cohere)
+        try:
+            for _ in range(engine.breakers["rerank"].min_calls + 1):
+                reranked = engine.rerank("query", documents, top_n=2)
+                assert [r.document["url"] for r in reranked.results] == ["u0", "u1"]
+                assert reranked.meta["fallback"] == "presearch"
+            # the open breaker falls back without calling the API
+            assert engine.breakers["rerank"].stats()["state"] == engine.breakers["rerank"].OPEN
+            assert engine.breakers["rerank"].stats()["rejected"] == 1
+            answer = engine.with_llm(CONTEXT, "What is the capital of France?").generations[0].text
+            assert answer == "Paris is the capital of France. (Paris, https://en.wikipedia.org/wiki/Paris)"
+            # a degraded answer is not cached
+            key = engine.generation_cache.context_key("command", 0.2, "english", CONTEXT)
+            assert engine.generation_cache.get(key, "What is the capital of France?") is None
+        finally:
+            engine.close()
+
+
+@pytest.mark.parametrize("mode", ["bm25", "neartext", "hybrid"])
+def test_async_searches_answer_like_the_sync_ones(engine, mode):
+    async def search():
+        return await getattr(engine, f"awith_{mode}")(f"async {mode} query", top_n=4)
+    articles = engine.run(search())
+    assert len(articles) == 4
+    engine.cache.clear()
+    assert getattr(engine, f"with_{mode}")(f"async {mode} query", top_n=4) == articles
+
+
+def test_search_batch_packs_the_queries_into_few_documents(engine, servers):
+    weaviate = servers[0]
+    queries = [f"batched query {i}" for i in range(5)]
+    requests = weaviate.requests
+    results = engine.search_batch(queries, mode="bm25", top_n=2, batch_size=2)
+    assert weaviate.requests == requests + 3
+    assert [len(articles) for articles in results] == [2] * 5
+    # in input order, each query answered by its own block
+    assert len({articles[0]["url"] for articles in results}) == 5
+
+
+def test_run_pipeline_yields_each_stage_as_it_completes(engine):
+    events = list(engine.run_pipeline("pipeline query", mode="bm25", top_n=4, context_size=2))
+    stages = [event.stage for event in events]
+    assert stages[:2] == ["presearch", "rerank"] and stages[-2:] == ["generation", "done"]
+    assert set(stages[2:-2]) == {"token"}
+    assert len(events[0].data) == 4 and len(events[1].data.results) == 4
+    assert "".join(event.data for event in events if event.stage == "token") == events[-2].data.text
+    timings = events[-1].data
+    assert {"presearch", "rerank", "ttfb", "generation", "total"} <= set(timings)
+    assert timings["presearch"] <= timings["total"]
@@ -0,0 +1,484 @@
+"""
+Tracing of the `SearchEngine` stages: every search, embedding, reranking and generation runs in a
+span, with child spans for the GraphQL build, the HTTP round-trips and the JSON decoding, so
+that the time of a request can be broken down into where it was actually spent.
+
+Spans follow the OpenTelemetry model (trace and span ids, parent span, attributes, status) and
+are exported in batches from a background thread, either to a JSON lines file or as OTLP/HTTP
+JSON to a collector (`/v1/traces` of an OpenTelemetry Collector, Jaeger, Tempo...), so no
+tracing SDK is needed. With no exporter, spans are not created at all.
+
+Usage:
+    tracer = Tracer(FileExporter("traces.jsonl"))
+    with tracer.span("search.bm25", lang="en") as span:
+        with tracing.span("graphql.request"):
+            ...
+        span.set("result.count", 10)
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+import requests
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+# the span in progress, if any; NO_SPAN in traces that were not sampled
+_current = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """
+    A timed operation of a trace, with the attributes describing it.
+    """
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "kind", "attributes", "status",
+                 "message", "start_ns", "end_ns", "_started")
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, kind="internal", attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.status = STATUS_UNSET
+        self.message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._started = time.perf_counter_ns()
+
+    def set(self, key, value):
+        """
+        Sets an attribute: a str, bool, int or float, or a list of them.
+        """
+        self.attributes[key] = value
+
+    def add(self, key, amount=1):
+        """
+        Adds to a counter attribute, e.g. the retries of the call.
+        """
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def set_status_code(self, status):
+        """
+        Sets the HTTP status of the response to a request; 4xx and 5xx are errors.
+        """
+        self.attributes["http.response.status_code"] = status
+        if status >= 400:
+            self.status = STATUS_ERROR
+            self.message = f"HTTP {status}"
+
+    def record_error(self, error):
+        self.status = STATUS_ERROR
+        self.message = repr(error)
+        self.attributes["error.type"] = type(error).__name__
+
+    def end(self):
+        self.end_ns = self.start_ns + time.perf_counter_ns() - self._started
+        if self.status == STATUS_UNSET:
+            self.status = STATUS_OK
+        self.tracer.finished(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def as_dict(self) -> dict:
+        """
+        Returns:
+        - dict: The span as a line of a `FileExporter` file.
+        """
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": self.duration_ms,
+            "status": "error" if self.status == STATUS_ERROR else "ok",
+            "message": self.message,
+            "attributes": self.attributes,
+        }
+
+    def as_otlp(self) -> dict:
+        """
+        Returns:
+        - dict: The span in the OTLP/JSON encoding.
+        """
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+            "status": {"code": self.status},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        if self.message is not None:
+            span["status"]["message"] = self.message
+        return span
+
+
+class _NoSpan:
+    """
+    Stands for the span in progress outside of a sampled trace, ignoring its attributes.
+    """
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+    def set_status_code(self, status):
+        pass
+
+    def record_error(self, error):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def current_span():
+    """
+    Returns:
+    - Span: The span in progress, or `NO_SPAN` (whose attributes are ignored) outside of a sampled trace.
+    """
+    return _current.get() or NO_SPAN
+
+
+@contextlib.contextmanager
+def span(name, kind="internal", **attributes):
+    """
+    Runs the body in a child span of the span in progress, e.g. around a request made on behalf of
+    a traced call. Outside of a sampled trace, the body runs untraced and gets `NO_SPAN`.
+
+    Parameters:
+    - name (str): The name of the span.
+    - kind (str, optional): 'internal', 'client' (a request to another service) or 'server'. Default is 'internal'.
+    - **attributes: The attributes of the span.
+    """
+    parent = _current.get()
+    if parent is None or parent is NO_SPAN:
+        yield NO_SPAN
+        return
+    with parent.tracer.start(name, parent, kind, attributes) as child:
+        yield child
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes) -> list:
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items()]
+
+
+class Tracer:
+    """
+    Creates the spans of sampled traces, and exports the ended ones in batches from a background
+    thread. Spans are dropped, and counted, when the exporter falls behind by `max_queue` spans.
+
+    Usage:
+        tracer = Tracer(OTLPExporter("http://localhost:4318"), sample_ratio=0.1)
+        with tracer.span("pipeline", mode="neartext") as span:
+            ...
+        tracer.shutdown()
+    """
+    def __init__(self, exporter=None, sample_ratio=1.0, batch_size=512, interval=2.0, max_queue=8192):
+        """
+        Parameters:
+        - exporter (FileExporter | OTLPExporter, optional): Where spans are exported. Default is None (tracing disabled).
+        - sample_ratio (float, optional): Fraction of the traces recorded. Default is 1.
+        - batch_size (int, optional): Largest number of spans per export. Default is 512.
+        - interval (float, optional): Seconds between exports. Default is 2.
+        - max_queue (int, optional): Ended spans waiting for export beyond which spans are dropped. Default is 8192.
+        """
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self.exported = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        if exporter is not None:
+            self._thread = threading.Thread(target=self.__export_loop, name="wikisearch-tracer", daemon=True)
+            self._thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextlib.contextmanager
+    def span(self, name, kind="internal", **attributes):
+        """
+        Runs the body in a span: a child of the span in progress, or the root of a new trace, which
+        is sampled with `sample_ratio`. Errors raised by the body are recorded on the span.
+
+        Parameters:
+        - name (str): The name of the span.
+        - kind (str, optional): 'internal', 'client' or 'server'. Default is 'internal'.
+        - **attributes: The attributes of the span.
+        """
+        parent = _current.get()
+        if self.exporter is None or parent is NO_SPAN:
+            yield NO_SPAN
+            return
+        if parent is None and random.random() >= self.sample_ratio:
+            token = _current.set(NO_SPAN)
+            try:
+                yield NO_SPAN
+            finally:
+                _current.reset(token)
+            return
+        with self.start(name, parent, kind, attributes) as started:
+            yield started
+
+    @contextlib.contextmanager
+    def start(self, name, parent, kind, attributes):
+        # the span, current while the body runs
+        trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        started = Span(self, name, trace_id, parent.span_id if parent is not None else None, kind, attributes)
+        token = _current.set(started)
+        try:
+            yield started
+        except BaseException as e:
+            if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+                started.record_error(e)
+            else:
+                started.set("cancelled", True)
+            raise
+        finally:
+            _current.reset(token)
+            started.end()
+
+    def finished(self, ended):
+        try:
+            self._queue.put_nowait(ended)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self, timeout=10):
+        """
+        Exports the spans already ended and stops the export thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        if self.dropped:
+            logging.warning(f"Tracer dropped {self.dropped} span(s), the exporter could not keep up")
+        self.exporter.close()
+
+    def __export_loop(self):
+        # exports every `interval` seconds, or as soon as a batch is full
+        batch, deadline = [], time.monotonic() + self.interval
+        while True:
+            try:
+                ended = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                ended = False
+            if ended:
+                batch.append(ended)
+            if ended is None or len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    self.__export(batch)
+                    batch = []
+                deadline = time.monotonic() + self.interval
+            if ended is None:
+                return
+
+    def __export(self, batch):
+        try:
+            self.exporter.export(batch)
+            self.exported += len(batch)
+        except Exception as e:
+            # tracing never fails the traced calls
+            logging.warning(f"Failed to export {len(batch)} span(s): {e!r}")
+
+
+class FileExporter:
+    """
+    Appends spans to a JSON lines file, one `Span.as_dict` per line (see `summarize`). Every batch
+    is appended in a single write, so that the engines of several processes can share the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def export(self, spans):
+        os.write(self._fd, "".join(json.dumps(span.as_dict()) + "\n" for span in spans).encode())
+
+    def close(self):
+        os.close(self._fd)
+
+
+class OTLPExporter:
+    """
+    Sends spans to an OTLP/HTTP endpoint in the JSON encoding of the OpenTelemetry protocol.
+    """
+    def __init__(self, endpoint="http://localhost:4318", headers=None, service_name="wikisearch", timeout=10):
+        """
+        Parameters:
+        - endpoint (str, optional): The collector URL, to which `/v1/traces` is appended. Default is 'http://localhost:4318'.
+        - headers (dict, optional): Headers of the export requests, e.g. an API key. Default is None.
+        - service_name (str, optional): The `service.name` resource attribute. Default is 'wikisearch'.
+        - timeout (float, optional): Seconds per export request. Default is 10.
+        """
+        self.url = endpoint.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"content-type": "application/json"})
+        self.session.headers.update(headers or {})
+
+    def export(self, spans):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": otlp_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "wikisearch"}, "spans": [span.as_otlp() for span in spans]}],
+            }]
+        }
+        response = self.session.post(self.url, data=json.dumps(payload), timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+def create_tracer(exporter="none", path="traces.jsonl", endpoint="http://localhost:4318", headers=None,
+                  service_name="wikisearch", sample_ratio=1.0) -> Tracer:
+    """
+    Creates a tracer from its configuration.
+
+    Parameters:
+    - exporter (str, optional): 'none', 'file' or 'otlp'. Default is 'none'.
+    - path (str, optional): The JSON lines file of the 'file' exporter. Default is 'traces.jsonl'.
+    - endpoint (str, optional): The collector URL of the 'otlp' exporter. Default is 'http://localhost:4318'.
+    - headers (dict, optional): Headers of the OTLP requests. Default is None.
+    - service_name (str, optional): The service name of the OTLP spans. Default is 'wikisearch'.
+    - sample_ratio (float, optional): Fraction of the traces recorded. Default is 1.
+
+    Returns:
+    - Tracer: The tracer.
+    """
+    if exporter == "none":
+        return Tracer()
+    if exporter == "file":
+        return Tracer(FileExporter(path), sample_ratio=sample_ratio)
+    if exporter == "otlp":
+        return Tracer(OTLPExporter(endpoint, headers=headers, service_name=service_name), sample_ratio=sample_ratio)
+    raise ValueError(f"Unknown trace exporter '{exporter}', expected 'none', 'file' or 'otlp'")
+
+
+def traced(name, attributes=None):
+    """
+    Runs a (sync or async) method of an instance with a `tracer` in a span, recording the size of
+    its result as `result.count`.
+
+    Parameters:
+    - name (str): The name of the span.
+    - attributes (callable, optional): Maps the arguments of the method to attributes of the span. Default is None.
+    """
+    def decorator(method):
+        def started(self, args, kwargs):
+            return self.tracer.span(name, **(attributes(*args, **kwargs) if attributes is not None else {}))
+
+        def ended(span, result):
+            if hasattr(result, "__len__"):
+                span.set("result.count", len(result))
+            return result
+
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                if not self.tracer.enabled:
+                    return await method(self, *args, **kwargs)
+                with started(self, args, kwargs) as span:
+                    return ended(span, await method(self, *args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.tracer.enabled:
+                return method(self, *args, **kwargs)
+            with started(self, args, kwargs) as span:
+                return ended(span, method(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def summarize(path) -> dict:
+    """
+    Breaks down the time of the spans of a `FileExporter` file by span name.
+
+    Parameters:
+    - path (str): The JSON lines file.
+
+    Returns:
+    - dict: For each span name, its `count`, `errors`, mean and p50/p95/p99 duration in ms, and
+      its `self_ms`: the time spent in the spans themselves rather than in their children, in
+      total and as a `share` of the time of all the spans.
+    """
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                spans.append(json.loads(line))
+    children = {}
+    for item in spans:
+        if item["parent_id"] is not None:
+            children[item["parent_id"]] = children.get(item["parent_id"], 0.0) + item["duration_ms"]
+    names = {}
+    for item in spans:
+        # concurrent children (e.g. hedged requests) may add up to more than their parent
+        own = max(item["duration_ms"] - children.get(item["span_id"], 0.0), 0.0)
+        stats = names.setdefault(item["name"], {"durations": [], "errors": 0, "self_ms": 0.0})
+        stats["durations"].append(item["duration_ms"])
+        stats["errors"] += item["status"] == "error"
+        stats["self_ms"] += own
+    total = sum(stats["self_ms"] for stats in names.values()) or 1.0
+    summary = {}
+    for name, stats in sorted(names.items(), key=lambda item: -item[1]["self_ms"]):
+        durations = np.array(stats["durations"])
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+        summary[name] = {
+            "count": len(durations),
+            "errors": stats["errors"],
+            "mean_ms": float(durations.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "self_ms": stats["self_ms"],
+            "share": stats["self_ms"] / total,
+        }
+    return summary
@@ -0,0 +1,426 @@
+"""
+Pooled asynchronous transport to Weaviate's GraphQL endpoint, and a shared event loop that
+lets synchronous callers (e.g. concurrent Streamlit sessions) multiplex their queries over it.
+
+Also pooled keep-alive sessions for the Weaviate and Cohere clients, with explicit pool sizes and
+connect/read timeouts, and `PoolStats` counters of pool saturation and connection reuse.
+"""
+import asyncio
+import contextvars
+import json as jsonlib
+import logging
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import cohere
+import requests
+from cohere.client_async import AIOHTTPBackend
+from cohere.error import CohereAPIError, CohereConnectionError, CohereError
+from cohere.utils import np_json_dumps
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+from urllib3.connection import HTTPConnection
+
+import tracing
+
+
+class PoolStats:
+    """
+    Counters of an HTTP connection pool: requests sent, connections opened (every other request
+    reused an idle keep-alive connection), requests in flight, and requests that found every
+    connection of the pool busy and queued for one.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.requests = 0
+        self.opened = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.queued = 0
+        self.queue_time = 0.0
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def connected(self):
+        with self._lock:
+            self.opened += 1
+
+    def waited(self, seconds=0.0):
+        with self._lock:
+            self.queued += 1
+            self.queue_time += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "pool_size": self.size,
+                "requests": self.requests,
+                "connections_opened": self.opened,
+                "reuse_rate": 1 - self.opened / self.requests if self.requests else 0.0,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "saturation": self.in_flight / self.size if self.size else 0.0,
+                "queued": self.queued,
+                "queue_time": self.queue_time,
+            }
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    `requests` adapter keeping up to `pool_size` keep-alive connections per host, probed with TCP
+    keep-alive after `keepalive` idle seconds so that load balancers do not silently drop them.
+    Requests block for a free connection instead of opening throwaway ones beyond the pool.
+    """
+    def __init__(self, pool_size=100, keepalive=30, max_retries=0):
+        self.keepalive = keepalive
+        self.stats = PoolStats(pool_size)
+        super().__init__(pool_maxsize=pool_size, pool_block=True, max_retries=max_retries)
+
+    def init_poolmanager(self, *args, **kwargs):
+        options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            options += [(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(self.keepalive)),
+                        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, int(self.keepalive))]
+        super().init_poolmanager(*args, socket_options=options, **kwargs)
+
+    def mount(self, session) -> requests.Session:
+        """
+        Mounts the adapter on a session for every http(s) url.
+        """
+        session.mount("http://", self)
+        session.mount("https://", self)
+        return session
+
+    def send(self, request, **kwargs):
+        if self.stats.in_flight >= self.stats.size:
+            self.stats.waited()
+        self.stats.started()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            self.stats.finished()
+
+    def pool_stats(self) -> dict:
+        # urllib3 counts the connections each per-host pool opened
+        pools = self.poolmanager.pools
+        self.stats.opened = sum(pools[key].num_connections for key in list(pools.keys()))
+        return self.stats.as_dict()
+
+
+def client_session(stats, keepalive=30, connect_timeout=5, read_timeout=60, headers=None, **kwargs) -> aiohttp.ClientSession:
+    """
+    Opens an aiohttp session over a pool of `stats.size` keep-alive connections, recording its
+    requests, new connections and waits for a free connection in `stats`.
+
+    Parameters:
+    - stats (PoolStats): The counters of the pool, whose `size` is the pool size.
+    - keepalive (float, optional): Seconds an idle connection stays open. Default is 30.
+    - connect_timeout (float, optional): Seconds to open a connection. Default is 5.
+    - read_timeout (float, optional): Seconds to wait for each read of the response. Default is 60.
+    - headers (dict, optional): Headers of every request. Default is None.
+
+    Returns:
+    - aiohttp.ClientSession: The session, bound to the running event loop.
+    """
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        stats.started()
+
+    async def on_request_end(session, context, params):
+        stats.finished()
+
+    async def on_queued_start(session, context, params):
+        context.queued_at = time.perf_counter()
+
+    async def on_queued_end(session, context, params):
+        stats.waited(time.perf_counter() - context.queued_at)
+
+    async def on_connection_create_end(session, context, params):
+        stats.connected()
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_end)
+    trace.on_connection_queued_start.append(on_queued_start)
+    trace.on_connection_queued_end.append(on_queued_end)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    return aiohttp.ClientSession(
+        headers=headers,
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout),
+        connector=aiohttp.TCPConnector(limit=stats.size, keepalive_timeout=keepalive),
+        trace_configs=[trace],
+        **kwargs,
+    )
+
+
+class WeaviateQueryError(Exception):
+    """
+    Raised when Weaviate answers a GraphQL request with an error status or an `errors` payload.
+    """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class EventLoopThread:
+    """
+    Runs a single asyncio event loop on a daemon thread. Coroutines submitted from any thread
+    are multiplexed on that loop, so they all share the same pooled connections.
+    """
+    def __init__(self, name="wikisearch-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """
+        Schedules a coroutine on the shared loop.
+
+        Parameters:
+        - coro (coroutine): The coroutine to run.
+
+        Returns:
+        - concurrent.futures.Future: Future holding the coroutine's result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Runs a coroutine on the shared loop and blocks the calling thread until it completes.
+
+        Parameters:
+        - coro (coroutine): The coroutine to run.
+        - timeout (float, optional): Seconds to wait for the result. Default is None (no limit).
+
+        Returns:
+        - The coroutine's result.
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("EventLoopThread.run() cannot be called from the loop thread, await the coroutine instead")
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class AsyncGraphQLTransport:
+    """
+    Sends GraphQL documents to Weaviate over a pooled aiohttp session with keep-alive.
+    The session is opened lazily and bound to the event loop that first uses it.
+    """
+    def __init__(self, url, headers=None, pool_size=100, keepalive=30, connect_timeout=5, read_timeout=60):
+        self.url = url.rstrip("/") + "/v1/graphql"
+        self.headers = {"content-type": "application/json"}
+        self.headers.update(headers or {})
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.stats = PoolStats(pool_size)
+        self._session = None
+        self._loop = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None:
+            logging.info(f"Opening GraphQL connection pool (size={self.stats.size})")
+            self._session = client_session(self.stats, keepalive=self.keepalive, connect_timeout=self.connect_timeout,
+                                           read_timeout=self.read_timeout, headers=self.headers)
+            self._loop = loop
+        elif self._loop is not loop:
+            raise RuntimeError("AsyncGraphQLTransport is bound to a different event loop")
+        return self._session
+
+    async def query(self, gql) -> dict:
+        """
+        Executes a GraphQL document.
+
+        Parameters:
+        - gql (str): The GraphQL document, e.g. as produced by `GetBuilder.build()`.
+
+        Returns:
+        - dict: The `data` member of the GraphQL response.
+        """
+        session = await self.session()
+        with tracing.span("graphql.request", kind="client", **{"http.request.body.size": len(gql)}) as span:
+            async with session.post(self.url, json={"query": gql}) as response:
+                span.set_status_code(response.status)
+                if response.status != 200:
+                    raise WeaviateQueryError(f"GraphQL request failed with status {response.status}: "
+                                             f"{await response.text()}", status=response.status)
+                body = await response.read()
+            span.set("http.response.body.size", len(body))
+        with tracing.span("graphql.decode", **{"http.response.body.size": len(body)}):
+            payload = jsonlib.loads(body)
+        if payload.get("errors"):
+            raise WeaviateQueryError(f"GraphQL errors: {payload['errors']}")
+        return payload["data"]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._loop = None
+
+    def pool_stats(self) -> dict:
+        return self.stats.as_dict()
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Thread pool running every task in a copy of the context of the thread that submitted it, so
+    that the requests the Cohere SDK sends from its pool are traced within the calling span.
+    """
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class PooledCohereClient(cohere.Client):
+    """
+    `cohere.Client` sending every request over one pooled keep-alive session, where the SDK opens a
+    new session, and so a new connection and TLS handshake, per request.
+    """
+    def __init__(self, api_key, pool_size=100, keepalive=30, connect_timeout=5, read_timeout=60, **kwargs):
+        super().__init__(api_key, timeout=read_timeout, **kwargs)
+        self.connect_timeout = connect_timeout
+        # the SDK's retries, on the pooled adapter
+        retries = Retry(total=self.max_retries, backoff_factor=0.5, allowed_methods=["POST", "GET"],
+                        status_forcelist=cohere.RETRY_STATUS_CODES, raise_on_status=False)
+        self.adapter = PooledAdapter(pool_size, keepalive, max_retries=retries)
+        self.session = self.adapter.mount(requests.Session())
+        self._executor.shutdown(wait=False)
+        self._executor = ContextThreadPoolExecutor(self.num_workers)
+
+    def _request(self, endpoint, json=None, files=None, method="POST", stream=False, params=None):
+        headers = {
+            "Authorization": f"BEARER {self.api_key}",
+            "Request-Source": self.request_source,
+        }
+        if json:
+            headers["Content-Type"] = "application/json"
+        url = f"{self.api_url}/{self.api_version}/{endpoint}"
+        timeout = (self.connect_timeout, self.timeout)
+        if stream:
+            try:
+                response = self.session.request(method, url, headers=headers, json=json, timeout=timeout,
+                                                stream=True, **self.request_dict)
+            except requests.exceptions.ConnectionError as e:
+                raise CohereConnectionError(str(e)) from e
+            # the SDK reads an error body as a stream of zero tokens
+            if not 200 <= response.status_code < 300:
+                try:
+                    raise CohereAPIError.from_response(response)
+                finally:
+                    response.close()
+            return response
+        with tracing.span("cohere.request", kind="client", endpoint=endpoint) as span:
+            try:
+                response = self.session.request(method, url, headers=headers, json=json, files=files,
+                                                timeout=timeout, params=params, **self.request_dict)
+            except requests.exceptions.ConnectionError as e:
+                raise CohereConnectionError(str(e)) from e
+            except requests.exceptions.RequestException as e:
+                raise CohereError(f"Unexpected exception ({e.__class__.__name__}): {e}") from e
+            span.set_status_code(response.status_code)
+            span.set("http.request.body.size", len(response.request.body or b""))
+            span.set("http.response.body.size", len(response.content))
+        with tracing.span("cohere.decode", endpoint=endpoint, **{"http.response.body.size": len(response.content)}):
+            try:
+                json_response = response.json()
+            except jsonlib.decoder.JSONDecodeError:
+                raise CohereAPIError.from_response(response, message=f"Failed to decode json body: {response.text}")
+        self._check_response(json_response, response.headers, response.status_code)
+        return json_response
+
+    def pool_stats(self) -> dict:
+        return self.adapter.pool_stats()
+
+    def close(self):
+        self.session.close()
+
+
+class PooledAIOHTTPBackend(AIOHTTPBackend):
+    """
+    The HTTP backend of `cohere.AsyncClient`, over a bounded keep-alive pool (see `client_session`)
+    instead of the SDK's unbounded one.
+    """
+    def __init__(self, logger, stats, keepalive=30, connect_timeout=5, read_timeout=60, **kwargs):
+        super().__init__(logger, timeout=read_timeout, **kwargs)
+        self.stats = stats
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        if not self.max_retries:
+            # the SDK sleeps before raising a retryable status, for its own retries
+            self.SLEEP_AFTER_FAILURE = defaultdict(float)
+
+    async def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = client_session(self.stats, keepalive=self.keepalive, connect_timeout=self.connect_timeout,
+                                           read_timeout=self.timeout, json_serialize=np_json_dumps)
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+            self._requester = self.build_aio_requester()
+        return self._session
+
+
+class PooledAsyncCohereClient(cohere.AsyncClient):
+    """
+    `cohere.AsyncClient` on a `PooledAIOHTTPBackend`.
+    """
+    def __init__(self, api_key, pool_size=100, keepalive=30, connect_timeout=5, read_timeout=60, num_workers=64,
+                 **kwargs):
+        super().__init__(api_key, num_workers=num_workers, timeout=read_timeout, **kwargs)
+        self._backend = PooledAIOHTTPBackend(self._backend.logger, PoolStats(pool_size), keepalive=keepalive,
+                                             connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                             max_concurrent_requests=num_workers, max_retries=self.max_retries)
+
+    async def _request(self, endpoint, json=None, files=None, method="POST", full_url=None, stream=False,
+                       params=None):
+        # as the SDK's, with the round-trip and the decoding of the response traced apart
+        headers = {
+            "Authorization": f"BEARER {self.api_key}",
+            "Request-Source": self.request_source,
+        }
+        if json:
+            headers["Content-Type"] = "application/json"
+        if endpoint is None and full_url is not None:
+            url = full_url
+        else:
+            url = f"{self.api_url}/{self.api_version}/{endpoint}"
+        with tracing.span("cohere.request", kind="client", endpoint=endpoint) as span:
+            response = await self._backend.request(url, json, files, method, headers, stream=stream, params=params)
+            span.set_status_code(response.status)
+            if stream:
+                return response
+            try:
+                body = await response.read()
+            except aiohttp.ClientPayloadError as e:
+                raise CohereAPIError.from_aio_response(
+                    response, message=f"An unexpected error occurred while receiving the response: {e}")
+            span.set("http.response.body.size", len(body))
+        with tracing.span("cohere.decode", endpoint=endpoint, **{"http.response.body.size": len(body)}):
+            try:
+                json_response = jsonlib.loads(body)
+            except jsonlib.decoder.JSONDecodeError:
+                raise CohereAPIError.from_aio_response(
+                    response, message=f"Failed to decode json body: {body.decode(errors='replace')}")
+        self._check_response(json_response, response.headers, response.status)
+        return json_response
+
+    def pool_stats(self) -> dict:
+        return self._backend.stats.as_dict()
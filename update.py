@@ -0,0 +1,278 @@
+"""
+Incremental updates of an ingested corpus from a newer Wikipedia dump or JSON lines file of
+paragraphs, without re-embedding the whole corpus.
+
+The passages of the new input are diffed against the hashes recorded at ingestion (see
+`ingest.PassageHashes`), by passage id, i.e. url and paragraph position:
+- new passages, and passages whose text changed, are embedded and upserted;
+- passages whose other properties changed (e.g. views) are updated with their current vector;
+- passages past the new end of an article, and with `delete_missing` the passages of articles
+  missing from the input (a full dump), are deleted;
+- unchanged passages are left alone.
+
+A Weaviate class is updated in place, objects being identified by the uuid5 of the passage id.
+A local vector store is immutable, so the update writes a new store directory, with the new
+vectors and the unchanged ones copied from the current store, whose indexes are then built with
+`wikisearch.py index` before switching LOCAL_INDEX_DIR over.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from weaviate.util import generate_uuid5
+
+import ingest
+import vectorstore
+from loader import BulkLoader
+
+# uuids per batch delete request, below Weaviate's QUERY_MAXIMUM_RESULTS
+DELETE_BATCH_SIZE = 1000
+
+
+def diff(chunked, hashes, counts, seen=None):
+    """
+    Compares the passages of the records with their recorded hashes.
+
+    Parameters:
+    - chunked (generator): The (record number, passages) tuples of `ingest.passages`.
+    - hashes (ingest.PassageHashes): The recorded hashes, in a run started with `begin_run`.
+    - counts (dict): Counts of `unchanged`, `added`, `changed` and `properties` passages, updated in place.
+    - seen (tuple, optional): A (set, list) collecting the urls and unchanged passage ids of the
+      records, for the caller to record them in bulk with `hashes.see`. Default is None (recorded
+      for each record).
+
+    Returns:
+    - generator: (record number, passages) tuples, with only the new or changed passages of each
+      record, flagged with `embed` when their text changed.
+    """
+    for number, found in chunked:
+        known = hashes.lookup(passage["id"] for passage in found)
+        changed, unchanged = [], []
+        for passage in found:
+            text, properties = ingest.passage_hashes(passage)
+            if passage["id"] not in known:
+                counts["added"] += 1
+                changed.append(dict(passage, embed=True))
+            elif known[passage["id"]][0] != text:
+                counts["changed"] += 1
+                changed.append(dict(passage, embed=True))
+            elif known[passage["id"]][1] != properties:
+                counts["properties"] += 1
+                changed.append(dict(passage, embed=False))
+            else:
+                counts["unchanged"] += 1
+                unchanged.append(passage["id"])
+        if seen is None:
+            hashes.see({passage["url"] for passage in found}, unchanged)
+        else:
+            seen[0].update(passage["url"] for passage in found)
+            seen[1].extend(unchanged)
+        yield number, changed
+
+
+def changed_batches(chunked, hashes, counts, batch_size=96):
+    """
+    Batches the new or changed passages of `diff`, recording the urls and unchanged passages of
+    the records of each batch with a single `hashes.see`.
+
+    Returns:
+    - generator: Lists of at most about `batch_size` passages, possibly empty for the last one.
+    """
+    urls, unchanged = set(), []
+    for _, batch in ingest.batches(diff(chunked, hashes, counts, seen=(urls, unchanged)), batch_size):
+        hashes.see(urls, unchanged)
+        urls.clear()
+        unchanged.clear()
+        yield batch
+
+
+class StoreUpdateSink:
+    """
+    Writes the updated copy of a local vector store to a new directory.
+    """
+    def __init__(self, path, out):
+        self.store = vectorstore.VectorStore(path)
+        self.out = out
+        self.writer = vectorstore.VectorStoreWriter(out, self.store.dim, dtype=self.store.dtype.name,
+                                                    lang_codes=self.store.lang_codes)
+        # id hashes of the rows of the current store not to copy
+        self.replaced = []
+
+    def upsert(self, vectors, passages):
+        self.writer.append(np.asarray(vectors, dtype=np.float32),
+                           [{key: p[key] for key in ingest.PROPERTIES} for p in passages], ids=[p["id"] for p in passages])
+        self.replaced += [vectorstore.id_hash(p["id"]) for p in passages]
+
+    def update_properties(self, passages):
+        rows = [self.store.row(p["id"]) for p in passages]
+        missing = [p["id"] for p, row in zip(passages, rows) if row is None]
+        if missing:
+            raise KeyError(f"Passages {missing[:5]} are in the hashes but not in {self.store.path}")
+        self.upsert(np.asarray(self.store.vectors[rows], dtype=np.float32), passages)
+
+    def delete(self, ids):
+        self.replaced += [vectorstore.id_hash(id) for id in ids]
+
+    def flush(self) -> set:
+        return set()
+
+    def close(self, batch_size=65536):
+        replaced = np.array(self.replaced, dtype=np.uint64)
+        hashes = self.store.row_hashes()
+        rows = self.store.iter_metadata()
+        for start in range(0, len(self.store), batch_size):
+            metadata = list(islice(rows, batch_size))
+            kept = np.flatnonzero(~np.isin(hashes[start:start + batch_size], replaced))
+            if len(kept):
+                self.writer.append(np.asarray(self.store.vectors[start + kept], dtype=np.float32),
+                                   [metadata[i] for i in kept], id_hashes=hashes[start + kept])
+        store = self.writer.close()
+        logging.info(f"Wrote {len(store)} passages to {self.out}, build its indexes with "
+                     f"`wikisearch.py index hnsw|bm25|quantized --dir {self.out}`")
+
+
+class WeaviateUpdateSink:
+    """
+    Updates the objects of a Weaviate class in place: upserts with a `loader.BulkLoader`, property
+    updates without a vector as PATCH requests on a thread pool, and batch deletes by uuid.
+    """
+    def __init__(self, client, class_name="Articles", workers=4):
+        self.client = client
+        self.class_name = class_name
+        self.loader = BulkLoader(client, class_name, workers=workers)
+        self.pool = ThreadPoolExecutor(workers)
+        self.futures = []
+        # the passage ids of the upserts since the last flush, by uuid
+        self.upserted = {}
+
+    def upsert(self, vectors, passages):
+        for vector, passage in zip(vectors, passages):
+            uuid = generate_uuid5(passage["id"])
+            self.loader.add({key: passage[key] for key in ingest.PROPERTIES}, vector=vector, uuid=uuid)
+            self.upserted[uuid] = passage["id"]
+
+    def update_properties(self, passages):
+        self.futures += [(passage["id"], self.pool.submit(self.client.data_object.update,
+                                                          {key: passage[key] for key in ingest.PROPERTIES if key != "text"},
+                                                          self.class_name, generate_uuid5(passage["id"])))
+                         for passage in passages]
+
+    def delete(self, ids):
+        uuids = [generate_uuid5(id) for id in ids]
+        for start in range(0, len(uuids), DELETE_BATCH_SIZE):
+            self.client.batch.delete_objects(self.class_name, where={
+                "path": ["id"], "operator": "ContainsAny", "valueTextArray": uuids[start:start + DELETE_BATCH_SIZE]})
+
+    def flush(self) -> set:
+        """
+        Waits for the pending upserts and property updates.
+
+        Returns:
+        - set: The ids of the passages whose upsert or property update failed.
+        """
+        rejected = self.loader.flush()
+        upserted, self.upserted = self.upserted, {}
+        failed = {upserted[uuid] for uuid in rejected if uuid in upserted}
+        futures, self.futures = self.futures, []
+        errors = []
+        for id, future in futures:
+            try:
+                future.result()
+            except Exception as error:
+                failed.add(id)
+                errors.append(error)
+        if errors:
+            logging.warning(f"{len(errors)} of {len(futures)} property updates failed, e.g. {errors[0]!r}")
+        return failed
+
+    def close(self):
+        self.flush()
+        self.loader.close()
+        self.pool.shutdown()
+
+
+async def aupdate(records, hashes, sink, embed, batch_size=96, concurrency=8, max_words=ingest.CHUNK_WORDS,
+                  delete_missing=False, flush_every=10000) -> dict:
+    """
+    Applies the changes of a newer input to an ingested corpus. Changed batches are embedded
+    concurrently, and written to the sink in input order.
+
+    Parameters:
+    - records (iterable): The records (`text`, `title`, `url`, `views`, `lang`), e.g. from `ingest.read_corpus`.
+    - hashes (ingest.PassageHashes): The hashes recorded when the corpus was ingested or last updated.
+    - sink (StoreUpdateSink | WeaviateUpdateSink): Where the changes are applied.
+    - embed (coroutine function): Embeds a list of texts, e.g. from `ingest.cohere_embedder`.
+    - batch_size (int, optional): Changed passages per batch. Default is 96.
+    - concurrency (int, optional): Batches embedded concurrently. Default is 8.
+    - max_words (int, optional): The maximum number of words per passage, as when ingesting. Default is 200.
+    - delete_missing (bool, optional): Whether the input is a full corpus, whose missing articles are deleted. Default is False.
+    - flush_every (int, optional): Passages written between the recordings of their hashes. Default is 10000.
+
+    Returns:
+    - dict: The number of `unchanged`, `added`, `changed`, `properties` (updated without embedding)
+      and `deleted` passages, and the number of `embedded` passages.
+    """
+    hashes.begin_run()
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    counts = {"unchanged": 0, "added": 0, "changed": 0, "properties": 0, "deleted": 0, "embedded": 0}
+    pending, written = deque(), []
+
+    async def flush():
+        # hashes are only recorded once the sink holds the passages, so that an interrupted update
+        # run again applies what it had not, and a failed passage is applied by the next update
+        failed = await loop.run_in_executor(None, sink.flush)
+        if failed:
+            logging.warning(f"{len(failed)} passages failed to update, their hashes are not recorded")
+            # the previous version of a failed passage is still in the sink, and not stale
+            await loop.run_in_executor(None, hashes.see, (), failed)
+        recorded = [passage for passage in written if passage["id"] not in failed]
+        written.clear()
+        await loop.run_in_executor(None, hashes.record, recorded)
+
+    async def drain():
+        batch, vectors = pending.popleft()
+        vectors = await vectors
+        embedded = [passage for passage in batch if passage["embed"]]
+        if embedded:
+            await loop.run_in_executor(None, sink.upsert, vectors, embedded)
+        kept = [passage for passage in batch if not passage["embed"]]
+        if kept:
+            await loop.run_in_executor(None, sink.update_properties, kept)
+        written.extend(batch)
+        if len(written) >= flush_every:
+            await flush()
+
+    async def nothing():
+        return []
+
+    # reading the input and diffing it against the hashes runs off the event loop, so that the
+    # embeds in flight are not held up
+    batches = changed_batches(ingest.passages(records, max_words), hashes, counts, batch_size)
+    while True:
+        batch = await loop.run_in_executor(None, next, batches, None)
+        if batch is None:
+            break
+        texts = [passage["text"] for passage in batch if passage["embed"]]
+        counts["embedded"] += len(texts)
+        pending.append((batch, asyncio.ensure_future(embed(texts) if texts else nothing())))
+        if len(pending) >= concurrency:
+            await drain()
+    while pending:
+        await drain()
+    await flush()
+
+    stale = hashes.stale(everywhere=delete_missing)
+    for start in range(0, len(stale), DELETE_BATCH_SIZE):
+        await loop.run_in_executor(None, sink.delete, stale[start:start + DELETE_BATCH_SIZE])
+    await loop.run_in_executor(None, sink.close)
+    hashes.remove(stale)
+    counts["deleted"] = len(stale)
+    logging.info(f"Updated in {time.perf_counter() - started:.1f}s: {counts['added']} added, {counts['changed']} "
+                 f"changed, {counts['properties']} with new properties, {counts['deleted']} deleted, "
+                 f"{counts['unchanged']} unchanged passages ({counts['embedded']} embedded)")
+    return counts
@@ -0,0 +1,250 @@
+"""
+On-disk vector store for the passage embeddings: a fixed-stride float32 or float16 matrix, an
+id -> offset table and a JSON lines metadata sidecar. Everything is memory-mapped read-only, so the
+rows are zero-copy NumPy views and every worker process serving the same store shares the OS page
+cache instead of holding a private copy.
+
+A store directory contains:
+- store.json: row count, dimension, dtype and the language codes.
+- vectors.bin: row-major matrix of L2-normalized vectors, `dim * itemsize` bytes per row.
+- ids.npy, id_rows.npy: sorted 64-bit hashes of the passage ids and the row of each.
+- langs.npy: uint8 index of the language of each row into the `langs` of store.json.
+- metadata.jsonl, metadata_offsets.npy: one JSON object per row (`text`, `title`, `url`, `views`,
+  `lang`) and the byte offset of each line, plus the end of the file.
+While a store is being written, the directory also holds the `.part` files and writer.json of
+`VectorStoreWriter`.
+"""
+import hashlib
+import json
+import os
+from array import array
+
+import numpy as np
+
+
+def normalize(vectors) -> np.ndarray:
+    """
+    L2-normalizes a vector or the rows of a matrix, so that cosine distance is 1 - dot product.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def id_hash(id) -> int:
+    """
+    64-bit key of a passage id in the id -> offset table.
+    """
+    return int.from_bytes(hashlib.sha1(str(id).encode("utf-8")).digest()[:8], "little")
+
+
+def _memmap(path, dtype, shape=None):
+    # np.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return np.empty(shape or (0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class VectorStore:
+    """
+    Read-only view of a store directory written by `VectorStoreWriter`.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "store.json")) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.lang_codes = meta["langs"]
+        self.vectors = _memmap(os.path.join(path, "vectors.bin"), self.dtype, shape=(meta["count"], self.dim))
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.id_rows = np.load(os.path.join(path, "id_rows.npy"), mmap_mode="r")
+        self.langs = np.load(os.path.join(path, "langs.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "metadata_offsets.npy"), mmap_mode="r")
+        self.__sidecar = _memmap(os.path.join(path, "metadata.jsonl"), np.uint8)
+        self.__masks = {}
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def metadata(self, row) -> dict:
+        """
+        Reads the metadata of a row from the sidecar.
+
+        Parameters:
+        - row (int): The row offset.
+
+        Returns:
+        - dict: The `text`, `title`, `url`, `views` and `lang` of the passage.
+        """
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self.__sidecar[start:end].tobytes())
+
+    def iter_metadata(self):
+        """
+        Streams the metadata of every row, in row order.
+        """
+        with open(os.path.join(self.path, "metadata.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def row(self, id):
+        """
+        Looks up the row offset of a passage id.
+
+        Parameters:
+        - id (str): The passage id given to `VectorStoreWriter.append`.
+
+        Returns:
+        - int: The row offset, or None if the id is not in the store.
+        """
+        key = np.uint64(id_hash(id))
+        position = int(np.searchsorted(self.ids, key))
+        if position < len(self.ids) and self.ids[position] == key:
+            return int(self.id_rows[position])
+        return None
+
+    def row_hashes(self) -> np.ndarray:
+        """
+        The `id_hash` of the passage id of every row, in row order.
+        """
+        hashes = np.empty(len(self), dtype=np.uint64)
+        hashes[np.asarray(self.id_rows)] = self.ids
+        return hashes
+
+    def lang_mask(self, lang) -> np.ndarray:
+        """
+        Boolean mask of the rows in the given language.
+        """
+        if lang not in self.__masks:
+            code = self.lang_codes.index(lang) if lang in self.lang_codes else -1
+            self.__masks[lang] = np.asarray(self.langs) == code
+        return self.__masks[lang]
+
+
+class VectorStoreWriter:
+    """
+    Appends normalized vectors and their metadata to a new store directory with constant memory.
+    The id hashes, languages and line offsets go to `.part` files alongside, which `close` turns into
+    the tables and store.json. `checkpoint` makes the rows written so far durable, and `resume`
+    reopens an interrupted writer.
+    """
+    PARTS = {"ids": np.uint64, "langs": np.uint8, "offsets": np.uint64}
+
+    def __init__(self, path, dim, dtype="float32", lang_codes=None, mode="wb"):
+        if np.dtype(dtype) not in (np.float32, np.float16):
+            raise ValueError(f"Unsupported vector dtype '{dtype}', expected 'float32' or 'float16'")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.count = os.path.getsize(os.path.join(path, "ids.part")) // 8 if mode == "ab" else 0
+        self.__vectors = open(os.path.join(path, "vectors.bin"), mode)
+        self.__sidecar = open(os.path.join(path, "metadata.jsonl"), mode)
+        self.__parts = {name: open(os.path.join(path, f"{name}.part"), mode) for name in self.PARTS}
+        self.__end = self.__sidecar.tell()
+        self.__lang_codes = {lang: code for code, lang in enumerate(lang_codes or [])}
+
+    @classmethod
+    def resume(cls, path, count):
+        """
+        Reopens the writer of an interrupted store, dropping the rows after the first `count`
+        (e.g. those written after the last checkpoint of the caller).
+
+        Parameters:
+        - path (str): The store directory, with a writer.json written by `checkpoint`.
+        - count (int): The number of rows to keep.
+
+        Returns:
+        - VectorStoreWriter: The writer, appending after row `count`.
+        """
+        with open(os.path.join(path, "writer.json")) as f:
+            state = json.load(f)
+        if count > state["count"]:
+            raise ValueError(f"Cannot resume {path} at row {count}, only {state['count']} rows were checkpointed")
+        row_bytes = state["dim"] * np.dtype(state["dtype"]).itemsize
+        offsets = np.fromfile(os.path.join(path, "offsets.part"), dtype=np.uint64, count=count)
+        sizes = {"vectors.bin": count * row_bytes, "metadata.jsonl": int(offsets[-1]) if count else 0}
+        sizes.update({f"{name}.part": count * np.dtype(dtype).itemsize for name, dtype in cls.PARTS.items()})
+        for name, size in sizes.items():
+            os.truncate(os.path.join(path, name), size)
+        return cls(path, state["dim"], dtype=state["dtype"], lang_codes=state["langs"], mode="ab")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, vectors, rows, ids=None, id_hashes=None):
+        """
+        Appends a batch of passages.
+
+        Parameters:
+        - vectors (np.ndarray): The embeddings, shape (batch, dim). They are L2-normalized on write.
+        - rows (list): The metadata of each passage (`text`, `title`, `url`, `views`, `lang`).
+        - ids (list, optional): Unique passage ids. Default is None (the row offsets).
+        - id_hashes (list, optional): The `id_hash` of the ids instead, when copying rows from another store.
+        """
+        vectors = normalize(vectors).reshape(-1, self.dim)
+        if len(vectors) != len(rows):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(rows)} metadata rows")
+        if id_hashes is None:
+            ids = ids if ids is not None else range(self.count, self.count + len(rows))
+            id_hashes = [id_hash(id) for id in ids]
+        lines = [json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n" for row in rows]
+        offsets = array("Q")
+        for line in lines:
+            self.__end += len(line)
+            offsets.append(self.__end)
+        self.__vectors.write(vectors.astype(self.dtype).tobytes())
+        self.__sidecar.write(b"".join(lines))
+        self.__parts["ids"].write(array("Q", (int(key) for key in id_hashes)).tobytes())
+        self.__parts["langs"].write(array("B", (self.__lang_codes.setdefault(row["lang"], len(self.__lang_codes))
+                                                for row in rows)).tobytes())
+        self.__parts["offsets"].write(offsets.tobytes())
+        self.count += len(rows)
+
+    def checkpoint(self) -> int:
+        """
+        Flushes the rows written so far to disk and records the writer state in writer.json.
+
+        Returns:
+        - int: The number of rows written.
+        """
+        for f in [self.__vectors, self.__sidecar, *self.__parts.values()]:
+            f.flush()
+            os.fsync(f.fileno())
+        state = {"count": self.count, "dim": self.dim, "dtype": self.dtype.name, "langs": list(self.__lang_codes)}
+        with open(os.path.join(self.path, "writer.json.tmp"), "w") as f:
+            json.dump(state, f)
+        os.replace(os.path.join(self.path, "writer.json.tmp"), os.path.join(self.path, "writer.json"))
+        return self.count
+
+    def close(self) -> VectorStore:
+        """
+        Writes the id table, languages, line offsets and store.json.
+
+        Returns:
+        - VectorStore: The written store.
+        """
+        for f in [self.__vectors, self.__sidecar, *self.__parts.values()]:
+            f.close()
+        parts = {name: np.fromfile(os.path.join(self.path, f"{name}.part"), dtype=dtype)
+                 for name, dtype in self.PARTS.items()}
+        ids = parts["ids"]
+        order = np.argsort(ids, kind="stable")
+        if len(ids) and (ids[order][1:] == ids[order][:-1]).any():
+            raise ValueError("Duplicate passage ids in the vector store")
+        np.save(os.path.join(self.path, "ids.npy"), ids[order])
+        np.save(os.path.join(self.path, "id_rows.npy"), order.astype(np.int64))
+        np.save(os.path.join(self.path, "langs.npy"), parts["langs"])
+        np.save(os.path.join(self.path, "metadata_offsets.npy"),
+                np.concatenate([np.zeros(1, dtype=np.uint64), parts["offsets"]]))
+        with open(os.path.join(self.path, "store.json"), "w") as f:
+            json.dump({"count": self.count, "dim": self.dim, "dtype": self.dtype.name,
+                       "langs": list(self.__lang_codes)}, f)
+        for name in [*(f"{name}.part" for name in self.PARTS), "writer.json"]:
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+        return VectorStore(self.path)
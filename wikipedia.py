@@ -1,11 +1,119 @@
+import asyncio
 import logging
+import multiprocessing
 import os
+import queue
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 from dotenv import load_dotenv
-from tenacity import retry, wait_random_exponential, stop_after_attempt
 
 import cohere
 import weaviate
+from cohere.responses.generation import Generations, StreamingText
+from cohere.responses.rerank import Reranking
+from weaviate.exceptions import UnexpectedStatusCodeException
+
+import cache
+import fusion
+import hedging
+import local
+import metrics
+import resilience
+import shards
+import tracing
+import transport
+import vectorstore
+
+
+StageResult = namedtuple("StageResult", ["stage", "data", "elapsed"])
+StageResult.__doc__ = """
+Event emitted by `SearchEngine.run_pipeline` and `SearchEngine.arun_pipeline`:
+- stage (str): 'presearch', 'rerank', 'token', 'generation' or 'done'.
+- data: The stage output (articles, reranking, text chunk, TokenStream, or the timings dict for 'done').
+- elapsed (float): Seconds spent in the stage ('token' events report the time since generation started).
+"""
+
+
+class TokenStream:
+    """
+    Iterates (sync or async) over the text chunks of a streamed generation, recording the
+    time-to-first-byte and total latency measured from the start of the request.
+    """
+    def __init__(self, response, started, on_complete=None):
+        self.response = response
+        self.started = started
+        self.on_complete = on_complete
+        self.text = ""
+        self.ttfb = None
+        self.total = None
+
+    def __iter__(self):
+        for item in self.response:
+            yield self.__record(item.text)
+        self.__finish()
+
+    async def __aiter__(self):
+        if not hasattr(self.response, "__aiter__"):
+            for text in self:
+                yield text
+            return
+        async for item in self.response:
+            yield self.__record(item.text)
+        self.__finish()
+
+    def __record(self, text):
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self.started
+        self.text += text
+        return text
+
+    def __finish(self):
+        self.total = time.perf_counter() - self.started
+        if self.ttfb is None:
+            self.ttfb = self.total
+        logging.info(f"with_llm(stream) ttfb={self.ttfb * 1000:.0f}ms total={self.total * 1000:.0f}ms")
+        if self.on_complete is not None:
+            self.on_complete(self.text, self.total)
+
+
+def search_attributes(mode):
+    """
+    Returns:
+    - callable: The span attributes of a search `(query, lang, top_n)` in the given mode (see `tracing.traced`).
+    """
+    def attributes(query, lang='en', top_n=10, **options):
+        return {"search.mode": mode, "search.lang": lang if isinstance(lang, str) else list(lang), "search.top_n": top_n}
+    return attributes
+
+
+def rerank_attributes(query, documents, top_n=10, model='rerank-english-v2.0') -> dict:
+    return {"rerank.model": model, "rerank.documents": len(documents), "rerank.top_n": top_n}
+
+
+def generation_attributes(context, query, temperature=0.2, model="command", lang="english", stream=False) -> dict:
+    return {"generation.model": model, "generation.lang": lang, "generation.temperature": temperature,
+            "generation.stream": stream, "generation.context": len(context)}
+
+
+def search_labels(mode):
+    """
+    Returns:
+    - callable: The (model, lang) metric labels of a search `(query, lang, top_n)` in the given mode (see `metrics.measured`).
+    """
+    def labels(engine, query, lang='en', top_n=10, **options):
+        return engine.vars["EMBED_MODEL"] if mode != "bm25" else "", lang if isinstance(lang, str) else ",".join(lang)
+    return labels
+
+
+def rerank_labels(engine, query, documents, top_n=10, model='rerank-english-v2.0') -> tuple:
+    return model, ""
+
+
+def generation_labels(engine, context, query, temperature=0.2, model="command", lang="english", stream=False) -> tuple:
+    return model, lang
 
 
 class SearchEngine:
@@ -14,131 +122,306 @@ class SearchEngine:
     reranks responses using Cohere.
     """
     WIKIPEDIA_PROPERTIES = ["text", "title", "url", "views", "lang", "_additional { distance score }"]
+    EMBED_BATCH_SIZE = 96  # texts per Cohere embed request
 
     def __init__(self):
         logging.basicConfig(level=logging.INFO,
                             format="%(asctime)s [%(levelname)s] %(message)s")
         self.vars = self.__load_environment_vars()
+        self.metrics = metrics.Registry()
+        self.request_metrics = metrics.RequestMetrics(self.metrics)
+        self.retry_policy = resilience.RetryPolicy(max_attempts=int(self.vars["RETRY_ATTEMPTS"]),
+                                                   deadline=float(self.vars["RETRY_DEADLINE"]),
+                                                   budget=resilience.RetryBudget(ratio=float(self.vars["RETRY_BUDGET"])))
+        self.breakers = self.__circuit_breakers()
         self.cohere = self.__cohere_client(self.vars["COHERE_API_KEY"])
         self.weaviate = self.__weaviate_client(self.vars["WEAVIATE_API_KEY"], 
                                                self.vars["COHERE_API_KEY"], 
                                                self.vars["WEAVIATE_URL"])
+        self.cache = cache.create_cache(self.vars["SEARCH_CACHE"],
+                                        path=self.vars["SEARCH_CACHE_PATH"],
+                                        maxsize=int(self.vars["SEARCH_CACHE_SIZE"]),
+                                        ttl=float(self.vars["SEARCH_CACHE_TTL"]))
+        self.rerank_cache = cache.create_cache(self.vars["SEARCH_CACHE"],
+                                               path=self.vars["SEARCH_CACHE_PATH"],
+                                               maxsize=int(self.vars["RERANK_CACHE_SIZE"]),
+                                               ttl=float(self.vars["SEARCH_CACHE_TTL"]),
+                                               table="rerank")
+        self.embedding_cache = cache.create_cache(self.vars["SEARCH_CACHE"],
+                                                  path=self.vars["SEARCH_CACHE_PATH"],
+                                                  maxsize=int(self.vars["EMBEDDING_CACHE_SIZE"]),
+                                                  table="embedding")
+        threshold = self.vars["GENERATION_CACHE_THRESHOLD"]
+        self.generation_cache = cache.GenerationCache(
+            cache.create_cache(self.vars["SEARCH_CACHE"],
+                               path=self.vars["SEARCH_CACHE_PATH"],
+                               maxsize=int(self.vars["GENERATION_CACHE_SIZE"]),
+                               ttl=float(self.vars["SEARCH_CACHE_TTL"]),
+                               table="generation"),
+            threshold=float(threshold) if threshold else None,
+            maxsize=int(self.vars["GENERATION_CACHE_SIZE"]))
+        self.loop = transport.EventLoopThread()
+        self.graphql = transport.AsyncGraphQLTransport(self.vars["WEAVIATE_URL"],
+                                                       headers=self.__weaviate_headers(),
+                                                       **self.__pool_options())
+        # retried by the engine's retry policy rather than by the SDK
+        self.acohere = transport.PooledAsyncCohereClient(self.vars["COHERE_API_KEY"], num_workers=64,
+                                                         check_api_key=False, max_retries=0,
+                                                         **self.__pool_options())
+        self.hedger = self.__hedger()
+        self.tracer = self.__tracer()
+        self.store = None
+        self.shard_pool = None
+        self.dense = self.__dense_backend(self.vars["DENSE_BACKEND"])
+        self.sparse = self.__sparse_backend(self.vars["SPARSE_BACKEND"])
+        self.__register_metrics()
+        self.metrics_server = self.__metrics_server()
         logging.info("Initialized SearchEngine with Cohere and Weaviate clients")
 
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(5))
+    def run(self, coro, timeout=None):
+        """
+        Runs one of the `awith_*` / `arerank` coroutines on the engine's shared event loop, blocking
+        the calling thread until it completes. All callers share the same pooled connections.
+
+        Parameters:
+        - coro (coroutine): The coroutine to run.
+        - timeout (float, optional): Seconds to wait for the result. Default is None (no limit).
+
+        Returns:
+        - The coroutine's result.
+        """
+        return self.loop.run(coro, timeout=timeout)
+
+    def close(self):
+        """
+        Closes the pooled async connections and stops the shared event loop.
+        """
+        self.run(self.graphql.close())
+        self.run(self.acohere.close())
+        self.cohere.close()
+        self.weaviate._connection.close()
+        self.loop.stop()
+        if self.shard_pool is not None:
+            self.shard_pool.shutdown()
+        self.tracer.shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+    def pool_stats(self) -> dict:
+        """
+        Connection pool metrics of the HTTP clients (see `transport.PoolStats`).
+
+        Returns:
+        - dict: Requests, connections opened, reuse rate, requests in flight, saturation of the pool
+          and requests queued for a free connection, for each of 'weaviate', 'graphql', 'cohere'
+          and 'acohere' (the async Cohere client).
+        """
+        return {
+            "weaviate": self.weaviate._connection._session.get_adapter(self.vars["WEAVIATE_URL"]).pool_stats(),
+            "graphql": self.graphql.pool_stats(),
+            "cohere": self.cohere.pool_stats(),
+            "acohere": self.acohere.pool_stats(),
+        }
+
+    def cache_stats(self) -> dict:
+        """
+        Hit rates and counters of the engine caches (see `cache.CacheStats` and `cache.GenerationCache.stats`).
+
+        Returns:
+        - dict: The stats of the 'search', 'embedding', 'rerank' and 'generation' caches.
+        """
+        return {
+            "search": self.cache.stats(),
+            "embedding": self.embedding_cache.stats(),
+            "rerank": self.rerank_cache.stats(),
+            "generation": self.generation_cache.stats(),
+        }
+
+    def retry_stats(self) -> dict:
+        """
+        Retry counters of the remote calls (see `resilience.RetryPolicy.stats`).
+
+        Returns:
+        - dict: The calls, retries, failures, and failures not retried because the retry budget or the
+          deadline was exhausted, per method.
+        """
+        return self.retry_policy.stats()
+
+    def breaker_stats(self) -> dict:
+        """
+        Circuit breaker state and counters of the Cohere dependencies (see `resilience.CircuitBreaker.stats`).
+
+        Returns:
+        - dict: The state, calls, failures, slow calls, rejected calls, times opened and degraded
+          answers given (fallbacks), for each of 'embed', 'rerank' and 'generate'.
+        """
+        return {dependency: breaker.stats() for dependency, breaker in self.breakers.items()}
+
+    def hedge_stats(self) -> dict:
+        """
+        Hedging counters of the Weaviate searches (see `hedging.Hedger.stats`).
+
+        Returns:
+        - dict: The calls, hedged calls, calls won by the hedge and current hedge delay, for each of
+          'bm25', 'neartext' and 'hybrid'; empty unless HEDGE_QUERIES=true.
+        """
+        return self.hedger.stats() if self.hedger is not None else {}
+
+    @metrics.measured("with_bm25", search_labels("bm25"))
+    @tracing.traced("search.bm25", search_attributes("bm25"))
+    @cache.cached_search("bm25")
+    @resilience.retried
     def with_bm25(self, query, lang='en', top_n=10) -> list:
         """
-        Performs a keyword search (sparse retrieval) on Wikipedia Articles using embeddings stored in Weaviate.
+        Performs a keyword search (sparse retrieval) on Wikipedia Articles using embeddings stored in Weaviate,
+        or on the local BM25 index when SPARSE_BACKEND=bm25.
 
         Parameters:
         - query (str): The search query.
-        - lang (str, optional): The language of the articles. Default is 'en'.
+        - lang (str | list, optional): The language of the articles, or several for a cross-lingual search. Default is 'en'.
         - top_n (int, optional): The number of top results to return. Default is 10.
 
         Returns:
         - list: List of top articles based on BM25F scoring.
         """
         logging.info("with_bm25()")
-        where_filter = {
-            "path": ["lang"],
-            "operator": "Equal",
-            "valueString": lang
-        }
-        response = (
-            self.weaviate.query.get("Articles", self.WIKIPEDIA_PROPERTIES)
-            .with_bm25(query=query)
-            .with_where(where_filter)
-            .with_limit(top_n)
-            .do()
-        )
-        return response["data"]["Get"]["Articles"]
+        if self.sparse is not None:
+            return self.sparse.search(query, lang=lang, top_n=top_n)
+        return self.__get_articles("bm25", self.__bm25_query(query, None, lang, top_n))
         
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(5))
+    @metrics.measured("with_neartext", search_labels("neartext"))
+    @tracing.traced("search.neartext", search_attributes("neartext"))
+    @resilience.falls_back("embed", "with_bm25")
+    @cache.cached_search("neartext")
+    @resilience.retried
     def with_neartext(self, query, lang='en', top_n=10) -> list:
         """
-        Performs a semantic search (dense retrieval) on Wikipedia Articles using embeddings stored in Weaviate.
+        Performs a semantic search (dense retrieval) on Wikipedia Articles using embeddings stored in Weaviate,
+        or on the local HNSW (DENSE_BACKEND=hnsw) or quantized (DENSE_BACKEND=quantized) index.
+        The query is embedded once (see `embed_queries`) and sent as a nearVector search. Falls back
+        to `with_bm25` while the embedding API is failing.
 
         Parameters:
         - query (str): The search query.
-        - lang (str, optional): The language of the articles. Default is 'en'.
+        - lang (str | list, optional): The language of the articles, or several for a cross-lingual search. Default is 'en'.
         - top_n (int, optional): The number of top results to return. Default is 10.
 
         Returns:
         - list: List of top articles based on semantic similarity.
         """
         logging.info("with_neartext()")
-        nearText = {
-            "concepts": [query]
-        }
-        where_filter = {
-            "path": ["lang"],
-            "operator": "Equal",
-            "valueString": lang
-        }
-        response = (
-            self.weaviate.query.get("Articles", self.WIKIPEDIA_PROPERTIES)
-            .with_near_text(nearText)
-            .with_where(where_filter)
-            .with_limit(top_n)
-            .do()
-        )
-        return response['data']['Get']['Articles']
+        vector = self.embed_queries([query])[0]
+        if self.dense is not None:
+            return self.dense.search(vector, lang=lang, top_n=top_n)
+        return self.__get_articles("neartext", self.__neartext_query(query, vector, lang, top_n))
     
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(5))
+    @metrics.measured("with_hybrid", search_labels("hybrid"))
+    @tracing.traced("search.hybrid", search_attributes("hybrid"))
+    @resilience.falls_back("embed", "with_bm25")
+    @cache.cached_search("hybrid")
+    @resilience.retried
     def with_hybrid(self, query, lang='en', top_n=10) -> list:
         """
-        Performs a hybrid search on Wikipedia Articles using embeddings stored in Weaviate.
+        Performs a hybrid search on Wikipedia Articles using embeddings stored in Weaviate,
+        with the query vector from `embed_queries`. Falls back to `with_bm25` while the embedding
+        API is failing.
 
         Parameters:
         - query (str): The search query.
-        - lang (str, optional): The language of the articles. Default is 'en'.
+        - lang (str | list, optional): The language of the articles, or several for a cross-lingual search. Default is 'en'.
         - top_n (int, optional): The number of top results to return. Default is 10.
 
         Returns:
         - list: List of top articles based on hybrid scoring.
         """	
         logging.info("with_hybrid()")
-        where_filter = {
-            "path": ["lang"],
-            "operator": "Equal",
-            "valueString": lang
-        }
-        response = (
-            self.weaviate.query.get("Articles", self.WIKIPEDIA_PROPERTIES)
-            .with_hybrid(query=query)
-            .with_where(where_filter)
-            .with_limit(top_n)
-            .do()
-        )
-        return response["data"]["Get"]["Articles"]
+        return self.__get_articles("hybrid", self.__hybrid_query(query, self.embed_queries([query])[0], lang, top_n))
     
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(5))
-    def with_llm(self, context, query, temperature=0.2, model="command", lang="english") -> list:
+    @metrics.measured("with_llm", generation_labels)
+    @tracing.traced("generation", generation_attributes)
+    def with_llm(self, context, query, temperature=0.2, model="command", lang="english", stream=False):
+        """
+        Generates an answer to the query grounded on the context using Cohere's generation API.
+        Answers are cached per (model, temperature, lang, context documents, query), and optionally
+        reused for semantically similar queries on the same context (see `GenerationCache`).
+        While the generation API is failing, the answer is the sentence of the context sharing the
+        most words with the query.
+
+        Parameters:
+        - context (list): The (ranked) articles to ground the answer on.
+        - query (str): The user question.
+        - temperature (float, optional): The sampling temperature. Default is 0.2.
+        - model (str, optional): The generation model. Default is 'command'.
+        - lang (str, optional): The language of the answer. Default is 'english'.
+        - stream (bool, optional): Whether to stream the answer as it is generated. Default is False.
+
+        Returns:
+        - Generations, or a TokenStream of text chunks if stream is True.
+        """
         logging.info(f"with_llm(q={query}, t={temperature}, m={model}, l={lang})")	
-        prompt = f"""
-            Use the information provided below to answer the questions at the end. /
-            Include in the answer some curious or relevant facts extracted from the context. /
-            Generate the answer in {lang} language. /
-            If the answer to the question is not contained in the provided information, generate "The answer is not in the context".
-            ---
-            Context information:
-            {context}
-            ---
-            Question:
-            {query}
-            """
+        started = time.perf_counter()
+        context_key = self.generation_cache.context_key(model, temperature, lang, context)
+        cached, embedding = self.generation_cache.get(context_key, query), None
+        if cached is None and self.generation_cache.semantic:
+            try:
+                embedding = self.embed_queries([query])[0]
+                cached = self.generation_cache.get_similar(context_key, embedding)
+            except Exception as e:
+                if getattr(e, "dependency", None) != "embed":
+                    raise
+        tracing.current_span().set("cache.hit", cached is not None)
+        if cached is not None:
+            return self.__cached_generation(cached["text"], started, stream)
+
+        response = self.breakers["generate"].call(
+            lambda: self.__generate(self.__llm_prompt(context, query, lang), temperature, model, stream),
+            fallback=lambda: None)
+        if response is None:
+            return self.__extractive_generation(context, query, started, stream)
+        return self.__cache_generation(response, started, stream, context_key, query, embedding)
+
+    @resilience.retried
+    def __generate(self, prompt, temperature, model, stream):
         return self.cohere.generate(
             prompt=prompt,
             num_generations=1,
             max_tokens=1000,
             temperature=temperature,
             model=model,
+            stream=stream,
             )
-        
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(5))
+
+    @tracing.traced("embed", lambda queries: {"embed.queries": len(queries)})
+    def embed_queries(self, queries) -> list:
+        """
+        Embeds queries with Cohere's embedding API, using the model that vectorized the Wikipedia articles.
+        Embeddings are cached per (model, normalized query), so only queries not embedded before are sent
+        to the API, batched into as few requests as possible.
+
+        Parameters:
+        - queries (list): The queries to embed.
+
+        Returns:
+        - list: One embedding (list of floats) per query.
+        """
+        keys, vectors, misses = self.__cached_embeddings(queries)
+        embeddings = []
+        for start in range(0, len(misses), self.EMBED_BATCH_SIZE):
+            batch = [queries[i] for i in misses[start:start + self.EMBED_BATCH_SIZE]]
+            embeddings += self.breakers["embed"].call(lambda: self.__embed_misses(batch))
+        return self.__store_embeddings(keys, vectors, misses, embeddings)
+
+    @resilience.retried
+    def __embed_misses(self, queries):
+        return self.cohere.embed(texts=queries, model=self.vars["EMBED_MODEL"]).embeddings
+
+    @metrics.measured("rerank", rerank_labels)
+    @tracing.traced("rerank", rerank_attributes)
     def rerank(self, query, documents, top_n=10, model='rerank-english-v2.0') -> dict:
         """
-        Reranks a list of responses using Cohere's reranking API.
+        Reranks a list of responses using Cohere's reranking API. Relevance scores are cached per
+        (model, query, document), so only documents not scored before for this query are sent to the API.
+        While the reranking API is failing, the documents keep their order, without relevance scores.
 
         Parameters:
         - query (str): The search query.
@@ -149,8 +432,480 @@ class SearchEngine:
         Returns:
         - dict: Reranked documents from Cohere's API.
         """
-        return self.cohere.rerank(query=query, documents=documents, top_n=top_n, model=model)
-    
+        keys, scores, misses = self.__cached_scores(query, documents, model)
+        if misses:
+            response = self.breakers["rerank"].call(
+                lambda: self.__rerank_misses(query, [documents[i] for i in misses], model), fallback=lambda: None)
+            if response is None:
+                return self.__presearch_order(documents, top_n)
+            self.__store_scores(keys, scores, misses, response)
+        return self.__ranking(documents, scores, top_n)
+
+    @resilience.retried
+    def __rerank_misses(self, query, documents, model):
+        return self.cohere.rerank(query=query, documents=documents, model=model)
+
+    def with_fusion(self, query, lang='en', top_n=10, strategy="rrf", alpha=0.5) -> list:
+        """
+        Runs the keyword (bm25) and semantic (neartext) searches concurrently, and fuses their results locally.
+        Latency is that of the slower search rather than the sum of both.
+
+        Parameters:
+        - query (str): The search query.
+        - lang (str, optional): The language of the articles. Default is 'en'.
+        - top_n (int, optional): The number of top results to return. Default is 10.
+        - strategy (str, optional): 'rrf' (Reciprocal Rank Fusion) or 'weighted' (normalized score fusion). Default is 'rrf'.
+        - alpha (float, optional): Weight of the semantic scores with the 'weighted' strategy. Default is 0.5.
+
+        Returns:
+        - list: List of top articles based on the fused scores.
+        """
+        return self.run(self.awith_fusion(query, lang=lang, top_n=top_n, strategy=strategy, alpha=alpha))
+
+    def run_pipeline(self, query, mode="neartext", lang='en', top_n=10, rank_model='rerank-english-v2.0',
+                     gen_model="command", temperature=0.2, gen_lang="english", context_size=5):
+        """
+        Runs Pre-Search, Rerank and Generation on the shared event loop, yielding each stage's result as
+        soon as it completes, so that callers render earlier stages while later ones are still running.
+        Generation starts right after reranking, and its tokens are yielded as they are streamed.
+
+        Parameters:
+        - query (str): The search query.
+        - mode (str, optional): One of 'bm25', 'neartext', 'hybrid' or 'fusion'. Default is 'neartext'.
+        - lang (str, optional): The language of the articles. Default is 'en'.
+        - top_n (int, optional): The number of top results to search and rerank. Default is 10.
+        - rank_model (str, optional): The model to use for reranking. Default is 'rerank-english-v2.0'.
+        - gen_model (str, optional): The generation model. Default is 'command'.
+        - temperature (float, optional): The sampling temperature. Default is 0.2.
+        - gen_lang (str, optional): The language of the answer. Default is 'english'.
+        - context_size (int, optional): The number of reranked articles to ground the answer on. Default is 5.
+
+        Returns:
+        - generator: StageResult events, ending with a 'done' event whose data holds the per-stage timings.
+        """
+        events = queue.Queue()
+        future = self.loop.submit(self.__apipeline(events.put, query, mode, lang, top_n, rank_model,
+                                                   gen_model, temperature, gen_lang, context_size))
+        try:
+            while True:
+                event = events.get()
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+                if event.stage == "done":
+                    return
+        finally:
+            future.cancel()
+
+    def search_batch(self, queries, mode='neartext', lang='en', top_n=10, batch_size=32) -> list:
+        """
+        Runs many searches with few requests by packing up to `batch_size` aliased `Get { Articles }`
+        blocks into each GraphQL document. Documents are sent concurrently over the pooled transport.
+
+        Parameters:
+        - queries (list): The search queries.
+        - mode (str, optional): One of 'bm25', 'neartext' or 'hybrid'. Default is 'neartext'.
+        - lang (str, optional): The language of the articles. Default is 'en'.
+        - top_n (int, optional): The number of top results to return per query. Default is 10.
+        - batch_size (int, optional): The number of queries per GraphQL document. Default is 32.
+
+        Returns:
+        - list: One list of top articles per query, in input order.
+        """
+        return self.run(self.asearch_batch(queries, mode=mode, lang=lang, top_n=top_n, batch_size=batch_size))
+
+    @metrics.measured("with_bm25", search_labels("bm25"))
+    @tracing.traced("search.bm25", search_attributes("bm25"))
+    @cache.cached_search("bm25")
+    @resilience.retried
+    async def awith_bm25(self, query, lang='en', top_n=10) -> list:
+        """
+        Asynchronous counterpart of `with_bm25`, sent over the pooled GraphQL transport.
+        """
+        logging.info("awith_bm25()")
+        if self.sparse is not None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.sparse.search(query, lang=lang, top_n=top_n))
+        return await self.__aget_articles("bm25", self.__bm25_query(query, None, lang, top_n))
+
+    @metrics.measured("with_neartext", search_labels("neartext"))
+    @tracing.traced("search.neartext", search_attributes("neartext"))
+    @resilience.falls_back("embed", "awith_bm25")
+    @cache.cached_search("neartext")
+    @resilience.retried
+    async def awith_neartext(self, query, lang='en', top_n=10) -> list:
+        """
+        Asynchronous counterpart of `with_neartext`, sent over the pooled GraphQL transport.
+        """
+        logging.info("awith_neartext()")
+        vector = (await self.aembed_queries([query]))[0]
+        if self.dense is not None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.dense.search(vector, lang=lang, top_n=top_n))
+        return await self.__aget_articles("neartext", self.__neartext_query(query, vector, lang, top_n))
+
+    @metrics.measured("with_hybrid", search_labels("hybrid"))
+    @tracing.traced("search.hybrid", search_attributes("hybrid"))
+    @resilience.falls_back("embed", "awith_bm25")
+    @cache.cached_search("hybrid")
+    @resilience.retried
+    async def awith_hybrid(self, query, lang='en', top_n=10) -> list:
+        """
+        Asynchronous counterpart of `with_hybrid`, sent over the pooled GraphQL transport.
+        """
+        logging.info("awith_hybrid()")
+        vector = (await self.aembed_queries([query]))[0]
+        return await self.__aget_articles("hybrid", self.__hybrid_query(query, vector, lang, top_n))
+
+    @metrics.measured("with_llm", generation_labels)
+    @tracing.traced("generation", generation_attributes)
+    async def awith_llm(self, context, query, temperature=0.2, model="command", lang="english", stream=False):
+        """
+        Asynchronous counterpart of `with_llm`, sent through Cohere's aiohttp client.
+        With stream=True, the returned TokenStream is consumed with `async for`.
+        """
+        logging.info(f"awith_llm(q={query}, t={temperature}, m={model}, l={lang})")
+        started = time.perf_counter()
+        context_key = self.generation_cache.context_key(model, temperature, lang, context)
+        cached, embedding = self.generation_cache.get(context_key, query), None
+        if cached is None and self.generation_cache.semantic:
+            try:
+                embedding = (await self.aembed_queries([query]))[0]
+                cached = self.generation_cache.get_similar(context_key, embedding)
+            except Exception as e:
+                if getattr(e, "dependency", None) != "embed":
+                    raise
+        tracing.current_span().set("cache.hit", cached is not None)
+        if cached is not None:
+            return self.__cached_generation(cached["text"], started, stream)
+
+        response = await self.breakers["generate"].acall(
+            lambda: self.__agenerate(self.__llm_prompt(context, query, lang), temperature, model, stream),
+            fallback=lambda: None)
+        if response is None:
+            return self.__extractive_generation(context, query, started, stream)
+        return self.__cache_generation(response, started, stream, context_key, query, embedding)
+
+    @resilience.retried
+    async def __agenerate(self, prompt, temperature, model, stream):
+        return await self.acohere.generate(
+            prompt=prompt,
+            num_generations=1,
+            max_tokens=1000,
+            temperature=temperature,
+            model=model,
+            stream=stream,
+            )
+
+    @tracing.traced("embed", lambda queries: {"embed.queries": len(queries)})
+    async def aembed_queries(self, queries) -> list:
+        """
+        Asynchronous counterpart of `embed_queries`, sending the batches concurrently.
+        """
+        keys, vectors, misses = self.__cached_embeddings(queries)
+        chunks = [misses[start:start + self.EMBED_BATCH_SIZE] for start in range(0, len(misses), self.EMBED_BATCH_SIZE)]
+        batches = await asyncio.gather(*(self.breakers["embed"].acall(
+            lambda chunk=chunk: self.__aembed_misses([queries[i] for i in chunk])) for chunk in chunks))
+        return self.__store_embeddings(keys, vectors, misses, [vector for batch in batches for vector in batch])
+
+    @resilience.retried
+    async def __aembed_misses(self, queries):
+        return (await self.acohere.embed(texts=queries, model=self.vars["EMBED_MODEL"])).embeddings
+
+    def __cached_embeddings(self, queries):
+        model = self.vars["EMBED_MODEL"]
+        keys = [cache.cache_key("embedding", model, cache.normalize_query(query)) for query in queries]
+        vectors = [self.embedding_cache.get(key) for key in keys]
+        # one text per distinct missing query
+        misses = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                misses.setdefault(keys[i], i)
+        hits = sum(vector is not None for vector in vectors)
+        logging.info(f"embed(m={model}, hits={hits}, misses={len(misses)})")
+        span = tracing.current_span()
+        span.set("embed.model", model)
+        span.set("embed.misses", len(misses))
+        return keys, vectors, list(misses.values())
+
+    def __store_embeddings(self, keys, vectors, misses, embeddings):
+        fetched = dict(zip((keys[i] for i in misses), embeddings))
+        for key, vector in fetched.items():
+            self.embedding_cache.set(key, vector)
+        return [vector if vector is not None else fetched[key] for key, vector in zip(keys, vectors)]
+
+    def __cached_generation(self, text, started, stream):
+        logging.info(f"with_llm() cache hit in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return self.__text_generation(text, started, stream)
+
+    def __extractive_generation(self, context, query, started, stream):
+        # the sentence of the context sharing the most words with the query, the best ranked on ties
+        terms = set(re.findall(r"\w+", query.lower()))
+        best, overlap = None, -1
+        for item in context:
+            doc = getattr(item, "document", item)
+            for sentence in re.split(r"(?<=[.!?])\s+", doc["text"].strip()):
+                shared = len(terms & set(re.findall(r"\w+", sentence.lower())))
+                if shared > overlap:
+                    best, overlap = f'{sentence} ({doc["title"]}, {doc["url"]})', shared
+        return self.__text_generation(best or "The answer is not in the context", started, stream)
+
+    def __text_generation(self, text, started, stream):
+        if stream:
+            return TokenStream([StreamingText(index=0, text=text, is_finished=False)], started)
+        return Generations.from_dict({"generations": [{"id": None, "text": text}]}, return_likelihoods=None)
+
+    def __cache_generation(self, response, started, stream, context_key, query, embedding):
+        def store(text, latency):
+            # an empty answer is a failed generation, not one to serve for the whole TTL
+            if text:
+                self.generation_cache.set(context_key, query, text, latency, embedding)
+
+        if stream:
+            return TokenStream(response, started, on_complete=store)
+        latency = time.perf_counter() - started
+        logging.info(f"with_llm() total={latency * 1000:.0f}ms")
+        store(response.generations[0].text, latency)
+        return response
+
+    @metrics.measured("rerank", rerank_labels)
+    @tracing.traced("rerank", rerank_attributes)
+    async def arerank(self, query, documents, top_n=10, model='rerank-english-v2.0') -> dict:
+        """
+        Asynchronous counterpart of `rerank`, sent through Cohere's aiohttp client.
+        """
+        keys, scores, misses = self.__cached_scores(query, documents, model)
+        if misses:
+            response = await self.breakers["rerank"].acall(
+                lambda: self.__arerank_misses(query, [documents[i] for i in misses], model), fallback=lambda: None)
+            if response is None:
+                return self.__presearch_order(documents, top_n)
+            self.__store_scores(keys, scores, misses, response)
+        return self.__ranking(documents, scores, top_n)
+
+    @resilience.retried
+    async def __arerank_misses(self, query, documents, model):
+        return await self.acohere.rerank(query=query, documents=documents, model=model)
+
+    def __cached_scores(self, query, documents, model):
+        query = cache.normalize_query(query)
+        keys = [cache.cache_key("rerank", model, query, cache.document_id(doc)) for doc in documents]
+        scores = [self.rerank_cache.get(key) for key in keys]
+        misses = [i for i, score in enumerate(scores) if score is None]
+        logging.info(f"rerank(m={model}, hits={len(documents) - len(misses)}, misses={len(misses)})")
+        tracing.current_span().set("rerank.misses", len(misses))
+        return keys, scores, misses
+
+    def __store_scores(self, keys, scores, misses, response):
+        for result in response.results:
+            i = misses[result.index]
+            scores[i] = result.relevance_score
+            self.rerank_cache.set(keys[i], result.relevance_score)
+
+    def __presearch_order(self, documents, top_n):
+        return Reranking({
+            "id": None,
+            "results": [{"document": doc, "index": i, "relevance_score": None} for i, doc in enumerate(documents[:top_n])],
+            "meta": {"fallback": "presearch"},
+        })
+
+    def __ranking(self, documents, scores, top_n):
+        order = sorted(range(len(documents)), key=lambda i: -scores[i])[:top_n]
+        return Reranking({
+            "id": None,
+            "results": [{"document": documents[i], "index": i, "relevance_score": scores[i]} for i in order],
+            "meta": None,
+        })
+
+    @metrics.measured("with_fusion", search_labels("fusion"))
+    @tracing.traced("search.fusion", search_attributes("fusion"))
+    async def awith_fusion(self, query, lang='en', top_n=10, strategy="rrf", alpha=0.5) -> list:
+        """
+        Asynchronous counterpart of `with_fusion`.
+        """
+        logging.info(f"awith_fusion(s={strategy})")
+        if strategy not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion strategy '{strategy}', expected 'rrf' or 'weighted'")
+        sparse, dense = await asyncio.gather(self.awith_bm25(query, lang=lang, top_n=top_n),
+                                             self.awith_neartext(query, lang=lang, top_n=top_n))
+        if strategy == "rrf":
+            return fusion.reciprocal_rank_fusion([sparse, dense], top_n=top_n)
+        return fusion.weighted_score_fusion(sparse, dense, top_n=top_n, alpha=alpha)
+
+    async def arun_pipeline(self, query, mode="neartext", lang='en', top_n=10, rank_model='rerank-english-v2.0',
+                            gen_model="command", temperature=0.2, gen_lang="english", context_size=5):
+        """
+        Asynchronous counterpart of `run_pipeline`, an async generator of the same StageResult events.
+        """
+        events = asyncio.Queue()
+        task = asyncio.ensure_future(self.__apipeline(events.put_nowait, query, mode, lang, top_n, rank_model,
+                                                      gen_model, temperature, gen_lang, context_size))
+        try:
+            while True:
+                event = await events.get()
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+                if event.stage == "done":
+                    return
+        finally:
+            task.cancel()
+
+    async def __apipeline(self, emit, query, mode, lang, top_n, rank_model, gen_model, temperature, gen_lang,
+                          context_size):
+        searches = {
+            "bm25": self.awith_bm25,
+            "neartext": self.awith_neartext,
+            "hybrid": self.awith_hybrid,
+            "fusion": self.awith_fusion,
+        }
+        timings = {}
+        started = time.perf_counter()
+        with self.tracer.span("pipeline", **search_attributes(mode)(query, lang=lang, top_n=top_n)) as span:
+            try:
+                if mode not in searches:
+                    raise ValueError(f"Unknown search mode '{mode}', expected one of {list(searches)}")
+
+                data = await searches[mode](query, lang=lang, top_n=top_n)
+                timings["presearch"] = time.perf_counter() - started
+                emit(StageResult("presearch", data, timings["presearch"]))
+
+                if data:
+                    stage_started = time.perf_counter()
+                    ranked = await self.arerank(query=query, documents=data, top_n=top_n, model=rank_model)
+                    timings["rerank"] = time.perf_counter() - stage_started
+                    emit(StageResult("rerank", ranked, timings["rerank"]))
+
+                    stream = await self.awith_llm(context=ranked[:context_size], query=query,
+                                                  temperature=temperature, model=gen_model, lang=gen_lang, stream=True)
+                    with tracing.span("generation.stream", **{"generation.model": gen_model}) as streamed:
+                        async for text in stream:
+                            emit(StageResult("token", text, time.perf_counter() - stream.started))
+                        streamed.set("generation.ttfb_ms", stream.ttfb * 1000)
+                        streamed.set("generation.bytes", len(stream.text.encode()))
+                    timings["ttfb"] = stream.ttfb
+                    timings["generation"] = stream.total
+                    emit(StageResult("generation", stream, stream.total))
+
+                timings["total"] = time.perf_counter() - started
+                logging.info("run_pipeline() " + " ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()))
+                emit(StageResult("done", timings, timings["total"]))
+            except Exception as e:
+                span.record_error(e)
+                emit(e)
+
+    @tracing.traced("search_batch", lambda queries, mode='neartext', lang='en', top_n=10, batch_size=32: dict(
+        search_attributes(mode)(None, lang=lang, top_n=top_n), **{"search.queries": len(queries)}))
+    async def asearch_batch(self, queries, mode='neartext', lang='en', top_n=10, batch_size=32) -> list:
+        """
+        Asynchronous counterpart of `search_batch`.
+        """
+        logging.info(f"asearch_batch(n={len(queries)}, m={mode})")
+        builder = self.__query_builder(mode)
+        keys = [cache.cache_key(mode, cache.normalize_query(query), lang, top_n) for query in queries]
+        results = [self.cache.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        vectors = {}
+        if mode in ("neartext", "hybrid") and misses:
+            vectors = dict(zip(misses, await self.aembed_queries([queries[i] for i in misses])))
+        # the local indexes search on the default executor, off the event loop
+        loop = asyncio.get_running_loop()
+        if mode == "neartext" and self.dense is not None and misses:
+            found = await loop.run_in_executor(
+                None, lambda: [self.dense.search(vectors[i], lang=lang, top_n=top_n) for i in misses])
+            for i, result in zip(misses, found):
+                results[i] = result
+                self.cache.set(keys[i], result)
+            return results
+        if mode == "bm25" and self.sparse is not None:
+            found = await loop.run_in_executor(
+                None, lambda: [self.sparse.search(queries[i], lang=lang, top_n=top_n) for i in misses])
+            for i, result in zip(misses, found):
+                results[i] = result
+                self.cache.set(keys[i], result)
+            return results
+        chunks = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+        fetched = await asyncio.gather(*(self.__search_chunk(builder, queries, vectors, chunk, lang, top_n)
+                                         for chunk in chunks))
+        for chunk, articles in zip(chunks, fetched):
+            for i, result in zip(chunk, articles):
+                results[i] = result
+                self.cache.set(keys[i], result)
+        return results
+
+    @resilience.retried
+    async def __search_chunk(self, builder, queries, vectors, indices, lang, top_n) -> list:
+        with tracing.span("graphql.build", **{"search.queries": len(indices)}):
+            gql = self.weaviate.query.multi_get(
+                [builder(queries[i], vectors.get(i), lang, top_n).with_alias(f"q{i}") for i in indices]
+            ).build()
+        data = await self.graphql.query(gql)
+        return [data["Get"][f"q{i}"] for i in indices]
+
+    def __query_builder(self, mode):
+        builders = {
+            "bm25": self.__bm25_query,
+            "neartext": self.__neartext_query,
+            "hybrid": self.__hybrid_query,
+        }
+        if mode not in builders:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {list(builders)}")
+        return builders[mode]
+
+    def __lang_filter(self, lang):
+        if not isinstance(lang, str):
+            return {
+                "operator": "Or",
+                "operands": [self.__lang_filter(code) for code in lang]
+            }
+        return {
+            "path": ["lang"],
+            "operator": "Equal",
+            "valueString": lang
+        }
+
+    def __bm25_query(self, query, vector, lang, top_n):
+        return (
+            self.weaviate.query.get("Articles", self.WIKIPEDIA_PROPERTIES)
+            .with_bm25(query=query)
+            .with_where(self.__lang_filter(lang))
+            .with_limit(top_n)
+        )
+
+    def __neartext_query(self, query, vector, lang, top_n):
+        # the query is embedded by the engine (see `embed_queries`), so Weaviate does not call Cohere
+        nearVector = {
+            "vector": vector
+        }
+        return (
+            self.weaviate.query.get("Articles", self.WIKIPEDIA_PROPERTIES)
+            .with_near_vector(nearVector)
+            .with_where(self.__lang_filter(lang))
+            .with_limit(top_n)
+        )
+
+    def __hybrid_query(self, query, vector, lang, top_n):
+        return (
+            self.weaviate.query.get("Articles", self.WIKIPEDIA_PROPERTIES)
+            .with_hybrid(query=query, vector=vector)
+            .with_where(self.__lang_filter(lang))
+            .with_limit(top_n)
+        )
+
+    def __llm_prompt(self, context, query, lang):
+        return f"""
+            Use the information provided below to answer the questions at the end. /
+            Include in the answer some curious or relevant facts extracted from the context. /
+            Generate the answer in {lang} language. /
+            If the answer to the question is not contained in the provided information, generate "The answer is not in the context".
+            ---
+            Context information:
+            {context}
+            ---
+            Question:
+            {query}
+            """
+
     def __load_environment_vars(self):
         """
         Load environment variables from .env file
@@ -163,11 +918,53 @@ class SearchEngine:
         for var, value in env_vars.items():
             if not value:
                 raise EnvironmentError(f"{var} environment variable not set.")
+
+        optional_vars = {
+            "SEARCH_CACHE": "memory",
+            "SEARCH_CACHE_PATH": ".cache/wikisearch.sqlite",
+            "SEARCH_CACHE_SIZE": "1024",
+            "SEARCH_CACHE_TTL": "86400",
+            "RERANK_CACHE_SIZE": "16384",
+            "EMBEDDING_CACHE_SIZE": "4096",
+            "GENERATION_CACHE_SIZE": "256",
+            "GENERATION_CACHE_THRESHOLD": "",
+            "EMBED_MODEL": "multilingual-22-12",
+            "DENSE_BACKEND": "weaviate",
+            "SPARSE_BACKEND": "weaviate",
+            "LOCAL_INDEX_DIR": "index",
+            "HNSW_EF": "64",
+            "QUANTIZED_CANDIDATES": "100",
+            "LOCAL_SHARDS": "false",
+            "SHARD_PROCESSES": "4",
+            "HTTP_POOL_SIZE": "100",
+            "HTTP_KEEPALIVE": "30",
+            "HTTP_CONNECT_TIMEOUT": "5",
+            "HTTP_READ_TIMEOUT": "60",
+            "RETRY_ATTEMPTS": "3",
+            "RETRY_DEADLINE": "10",
+            "RETRY_BUDGET": "0.1",
+            "BREAKER_FAILURE_RATE": "0.5",
+            "BREAKER_SLOW_CALL": "5",
+            "BREAKER_WINDOW": "20",
+            "BREAKER_RESET_TIMEOUT": "30",
+            "HEDGE_QUERIES": "false",
+            "HEDGE_PERCENTILE": "95",
+            "HEDGE_WINDOW": "1000",
+            "TRACE_EXPORTER": "none",
+            "TRACE_FILE": "traces.jsonl",
+            "TRACE_SAMPLE_RATIO": "1",
+            "OTEL_EXPORTER_OTLP_ENDPOINT": "http://localhost:4318",
+            "OTEL_EXPORTER_OTLP_HEADERS": "",
+            "OTEL_SERVICE_NAME": "wikisearch",
+            "METRICS_PORT": "",
+            "METRICS_HOST": "0.0.0.0",
+        }
+        env_vars.update({var: os.getenv(var, default) for var, default in optional_vars.items()})
         
         logging.info("Environment variables loaded")
         return env_vars
 
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(5))
+    @resilience.retried
     def __cohere_client(self, cohere_api_key):
         """
         Initialize Cohere client
@@ -176,11 +973,12 @@ class SearchEngine:
         - cohere_api_key (str): Cohere API key
 
         Returns:
-        - cohere.Client: Cohere client
+        - transport.PooledCohereClient: Cohere client over a pooled keep-alive session
         """
-        return cohere.Client(cohere_api_key)
+        # retried by the engine's retry policy rather than by the SDK
+        return transport.PooledCohereClient(cohere_api_key, max_retries=0, **self.__pool_options())
 
-    @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(5))
+    @resilience.retried
     def __weaviate_client(self, weaviate_api_key, cohere_api_key, cohere_url):
         """
         Initialize Weaviate client
@@ -191,13 +989,224 @@ class SearchEngine:
         - cohere_url (str): Cohere URL
 
         Returns:
-        - weaviate.Client: Weaviate client
+        - weaviate.Client: Weaviate client over a pooled keep-alive session
         """
         auth_config = weaviate.auth.AuthApiKey(api_key=weaviate_api_key)
-        return weaviate.Client(
+        options = self.__pool_options()
+        client = weaviate.Client(
             url=cohere_url,
             auth_client_secret=auth_config,
+            timeout_config=(options["connect_timeout"], options["read_timeout"]),
             additional_headers={
                 "X-Cohere-Api-Key": cohere_api_key,
             }
         )
+        transport.PooledAdapter(options["pool_size"], options["keepalive"]).mount(client._connection._session)
+        return client
+
+    def __circuit_breakers(self):
+        """
+        Circuit breakers of the Cohere embedding, reranking and generation APIs
+        """
+        options = {
+            "failure_rate": float(self.vars["BREAKER_FAILURE_RATE"]),
+            "window": int(self.vars["BREAKER_WINDOW"]),
+            "reset_timeout": float(self.vars["BREAKER_RESET_TIMEOUT"]),
+        }
+        slow_call = float(self.vars["BREAKER_SLOW_CALL"])
+        return {
+            "embed": resilience.CircuitBreaker("embed", slow_call=slow_call, **options),
+            "rerank": resilience.CircuitBreaker("rerank", slow_call=slow_call, **options),
+            # the latency of a generation depends on the length of the answer
+            "generate": resilience.CircuitBreaker("generate", slow_call=None, **options),
+        }
+
+    def __hedger(self):
+        """
+        Hedger of the Weaviate searches when HEDGE_QUERIES=true, else None
+        """
+        if self.vars["HEDGE_QUERIES"] == "true":
+            return hedging.Hedger(percentile=float(self.vars["HEDGE_PERCENTILE"]),
+                                  window=int(self.vars["HEDGE_WINDOW"]))
+        if self.vars["HEDGE_QUERIES"] != "false":
+            raise EnvironmentError(f"HEDGE_QUERIES must be 'true' or 'false', got '{self.vars['HEDGE_QUERIES']}'.")
+        return None
+
+    def __tracer(self):
+        """
+        Tracer of the engine stages, exporting their spans to TRACE_EXPORTER ('none', 'file' or 'otlp')
+        """
+        # OTEL_EXPORTER_OTLP_HEADERS is a comma-separated list of key=value, as for OpenTelemetry SDKs
+        headers = dict(item.strip().split("=", 1) for item in self.vars["OTEL_EXPORTER_OTLP_HEADERS"].split(",")
+                       if item.strip())
+        return tracing.create_tracer(self.vars["TRACE_EXPORTER"],
+                                     path=self.vars["TRACE_FILE"],
+                                     endpoint=self.vars["OTEL_EXPORTER_OTLP_ENDPOINT"],
+                                     headers=headers,
+                                     service_name=self.vars["OTEL_SERVICE_NAME"],
+                                     sample_ratio=float(self.vars["TRACE_SAMPLE_RATIO"]))
+
+    def __register_metrics(self):
+        """
+        Metrics of the caches, connection pools, retries, circuit breakers and hedges, read when scraped
+        """
+        caches = {"search": self.cache, "embedding": self.embedding_cache, "rerank": self.rerank_cache,
+                  "generation": self.generation_cache.exact}
+        collectors = [
+            ("cache_entries", "Entries of the engine caches", "gauge", ("cache",),
+             lambda: {(name,): len(entries) for name, entries in caches.items()}),
+            ("cache_hits_total", "Lookups served by the engine caches", "counter", ("cache",),
+             lambda: {(name,): hits for name, (hits, misses) in self.__cache_lookups().items()}),
+            ("cache_misses_total", "Lookups missing the engine caches", "counter", ("cache",),
+             lambda: {(name,): misses for name, (hits, misses) in self.__cache_lookups().items()}),
+            ("http_requests_total", "Requests sent by the HTTP clients", "counter", ("client",),
+             lambda: {(client,): stats["requests"] for client, stats in self.pool_stats().items()}),
+            ("http_requests_in_flight", "Requests of the HTTP clients in progress", "gauge", ("client",),
+             lambda: {(client,): stats["in_flight"] for client, stats in self.pool_stats().items()}),
+            ("http_connections_opened_total", "Connections opened by the HTTP clients", "counter", ("client",),
+             lambda: {(client,): stats["connections_opened"] for client, stats in self.pool_stats().items()}),
+            ("http_requests_queued_total", "Requests that waited for a free pooled connection", "counter", ("client",),
+             lambda: {(client,): stats["queued"] for client, stats in self.pool_stats().items()}),
+            ("retries_total", "Retried attempts of the remote calls", "counter", ("method",),
+             lambda: {(method,): stats["retries"] for method, stats in self.retry_stats().items()}),
+            ("retry_failures_total", "Remote calls that failed after their retries", "counter", ("method",),
+             lambda: {(method,): stats["failures"] for method, stats in self.retry_stats().items()}),
+            ("breaker_state", "State of the circuit breakers of the Cohere APIs", "gauge", ("dependency", "state"),
+             lambda: {(dependency, state): int(stats["state"] == state) for dependency, stats in self.breaker_stats().items()
+                      for state in (resilience.CircuitBreaker.CLOSED, resilience.CircuitBreaker.OPEN,
+                                    resilience.CircuitBreaker.HALF_OPEN)}),
+            ("breaker_fallbacks_total", "Degraded answers given without a failing Cohere API", "counter", ("dependency",),
+             lambda: {(dependency,): stats["fallbacks"] for dependency, stats in self.breaker_stats().items()}),
+            ("hedged_requests_total", "Weaviate searches sent twice", "counter", ("kind",),
+             lambda: {(kind,): stats["hedged"] for kind, stats in self.hedge_stats().items()}),
+        ]
+        for name, help, kind, labels, read in collectors:
+            self.metrics.collector(f"wikisearch_{name}", help, kind, labels, read)
+
+    def __cache_lookups(self):
+        # (hits, misses) per cache
+        return {name: cache.lookups(stats) for name, stats in self.cache_stats().items()}
+
+    def __metrics_server(self):
+        """
+        HTTP endpoint of the engine metrics, in the Prometheus text format, on METRICS_PORT if set
+        """
+        if not self.vars["METRICS_PORT"]:
+            return None
+        try:
+            return metrics.MetricsServer(self.metrics, port=int(self.vars["METRICS_PORT"]), host=self.vars["METRICS_HOST"])
+        except OSError as e:
+            # e.g. the port is served by the engine of another process, such as a load test worker
+            logging.warning(f"Metrics endpoint not started on port {self.vars['METRICS_PORT']}: {e}")
+            return None
+
+    def __get_articles(self, kind, builder) -> list:
+        # hedged searches go through the pooled transport, where the slower attempt can be cancelled
+        if self.hedger is not None:
+            return self.run(self.__aget_articles(kind, builder))
+        # as `builder.do()`, with the build, the round-trip and the decoding of the response traced apart
+        with tracing.span("graphql.build"):
+            gql = builder.build()
+        with tracing.span("graphql.request", kind="client", **{"http.request.body.size": len(gql)}) as span:
+            response = self.weaviate._connection.post(path="/graphql", weaviate_object={"query": gql})
+            span.set_status_code(response.status_code)
+            span.set("http.response.body.size", len(response.content))
+        if not 200 <= response.status_code < 300:
+            raise UnexpectedStatusCodeException("Query was not successful", response)
+        with tracing.span("graphql.decode", **{"http.response.body.size": len(response.content)}):
+            return response.json()["data"]["Get"]["Articles"]
+
+    async def __aget_articles(self, kind, builder) -> list:
+        with tracing.span("graphql.build"):
+            gql = builder.build()
+        if self.hedger is None:
+            data = await self.graphql.query(gql)
+        else:
+            data = await self.hedger.call(kind, lambda: self.graphql.query(gql))
+        return data["Get"]["Articles"]
+
+    def __pool_options(self):
+        """
+        Connection pool size, keep-alive and timeouts of the HTTP clients
+        """
+        return {
+            "pool_size": int(self.vars["HTTP_POOL_SIZE"]),
+            "keepalive": float(self.vars["HTTP_KEEPALIVE"]),
+            "connect_timeout": float(self.vars["HTTP_CONNECT_TIMEOUT"]),
+            "read_timeout": float(self.vars["HTTP_READ_TIMEOUT"]),
+        }
+
+    def __dense_backend(self, backend):
+        """
+        Initialize the dense retrieval backend selected by DENSE_BACKEND
+
+        Parameters:
+        - backend (str): 'weaviate' (remote nearText), 'hnsw' or 'quantized' (local indexes in LOCAL_INDEX_DIR)
+
+        Returns:
+        - local.LocalDenseBackend | local.LocalQuantizedBackend | shards.ShardedBackend: Local backend, or None to query Weaviate
+        """
+        options = {
+            "hnsw": {"ef": int(self.vars["HNSW_EF"])},
+            "quantized": {"candidates": int(self.vars["QUANTIZED_CANDIDATES"])},
+        }
+        if backend == "weaviate":
+            return None
+        if backend in options:
+            return self.__local_backend(backend, options[backend])
+        raise EnvironmentError(f"Unknown DENSE_BACKEND '{backend}', expected 'weaviate', 'hnsw' or 'quantized'.")
+
+    def __sparse_backend(self, backend):
+        """
+        Initialize the keyword retrieval backend selected by SPARSE_BACKEND
+
+        Parameters:
+        - backend (str): 'weaviate' (remote BM25F) or 'bm25' (local index in LOCAL_INDEX_DIR)
+
+        Returns:
+        - local.LocalSparseBackend | shards.ShardedBackend: Local backend, or None to query Weaviate
+        """
+        if backend == "weaviate":
+            return None
+        if backend == "bm25":
+            return self.__local_backend(backend, {})
+        raise EnvironmentError(f"Unknown SPARSE_BACKEND '{backend}', expected 'weaviate' or 'bm25'.")
+
+    def __local_backend(self, kind, options):
+        """
+        Initialize a local backend over LOCAL_INDEX_DIR, or over its per-language shards when LOCAL_SHARDS=true
+
+        Parameters:
+        - kind (str): 'hnsw', 'quantized' or 'bm25'
+        - options (dict): Keyword arguments of the backend
+
+        Returns:
+        - local.LocalDenseBackend | local.LocalQuantizedBackend | local.LocalSparseBackend | shards.ShardedBackend: Local backend
+        """
+        if self.vars["LOCAL_SHARDS"] == "true":
+            return shards.ShardedBackend(self.vars["LOCAL_INDEX_DIR"], kind, options, pool=self.__shard_pool())
+        if self.vars["LOCAL_SHARDS"] != "false":
+            raise EnvironmentError(f"LOCAL_SHARDS must be 'true' or 'false', got '{self.vars['LOCAL_SHARDS']}'.")
+        return local.BACKENDS[kind](self.vars["LOCAL_INDEX_DIR"], store=self.__local_store(), **options)
+
+    def __shard_pool(self):
+        # worker processes of cross-lingual searches, shared by the dense and sparse backends;
+        # spawned rather than forked since the engine already runs threads
+        if self.shard_pool is None and int(self.vars["SHARD_PROCESSES"]) > 0:
+            self.shard_pool = ProcessPoolExecutor(max_workers=int(self.vars["SHARD_PROCESSES"]),
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return self.shard_pool
+
+    def __local_store(self):
+        if self.store is None:
+            self.store = vectorstore.VectorStore(self.vars["LOCAL_INDEX_DIR"])
+        return self.store
+
+    def __weaviate_headers(self):
+        """
+        Headers for GraphQL requests sent outside the Weaviate client (see `AsyncGraphQLTransport`)
+        """
+        return {
+            "authorization": f"Bearer {self.vars['WEAVIATE_API_KEY']}",
+            "X-Cohere-Api-Key": self.vars["COHERE_API_KEY"],
+        }
@@ -0,0 +1,291 @@
+"""
+Command line tools for the local Wikipedia search indexes and corpus ingestion.
+
+Usage:
+    python wikisearch.py index store --dir index --vectors vectors.npy --metadata metadata.jsonl
+    python wikisearch.py index hnsw --dir index
+    python wikisearch.py index bm25 --dir index
+    python wikisearch.py index quantized --dir index --kind opq --m 64
+    python wikisearch.py index shards --dir index
+    python wikisearch.py index hnsw --dir index --shards
+    python wikisearch.py ingest --input enwiki-latest-pages-articles.xml.bz2 --lang en --target store --dir index
+    python wikisearch.py ingest --input paragraphs.jsonl --target weaviate
+    python wikisearch.py update --input enwiki-20240101-pages-articles.xml.bz2 --lang en --dir index --out index-20240101
+    python wikisearch.py update --input paragraphs.jsonl --target weaviate
+    python wikisearch.py loadtest --input queries.jsonl --rate 20 --duration 300 --model threads --concurrency 32
+    python wikisearch.py traces --input traces.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+import cohere
+import weaviate
+from dotenv import load_dotenv
+
+import ingest
+import loadtest
+import local
+import shards
+import tracing
+import update
+
+
+def index_store(args):
+    local.import_store(args.dir, args.vectors, args.metadata, dtype=args.dtype)
+
+
+def index_dirs(args) -> list:
+    # the index directory itself, or each of its per-language shards with --shards
+    if not args.shards:
+        return [args.dir]
+    dirs = list(shards.shard_dirs(args.dir).values())
+    if not dirs:
+        raise SystemExit(f"No shards in {args.dir}, run `wikisearch.py index shards --dir {args.dir}` first")
+    return dirs
+
+
+def index_hnsw(args):
+    for path in index_dirs(args):
+        local.build_dense_index(path, M=args.M, ef_construction=args.ef_construction)
+
+
+def index_bm25(args):
+    for path in index_dirs(args):
+        local.build_sparse_index(path, k1=args.k1, b=args.b)
+
+
+def index_quantized(args):
+    for path in index_dirs(args):
+        local.build_quantized_index(path, kind=args.kind, m=args.m, train_size=args.train_size,
+                                    opq_iterations=args.opq_iterations)
+
+
+def index_shards(args):
+    shards.split_store(args.dir, langs=args.langs)
+
+
+def env(var, default=None) -> str:
+    value = os.getenv(var, default)
+    if not value:
+        raise EnvironmentError(f"{var} environment variable not set.")
+    return value
+
+
+def ingest_corpus(args):
+    load_dotenv()
+    checkpoint = args.checkpoint or (os.path.join(args.dir, "ingest.checkpoint.json") if args.target == "store"
+                                     else "ingest.checkpoint.json")
+    state = ingest.load_checkpoint(checkpoint, os.path.abspath(args.input))
+    if state["done"]:
+        logging.info(f"{args.input} is already ingested (see {checkpoint})")
+        return
+    if state["records"]:
+        logging.info(f"Resuming {args.input} after {state['records']} docs ({state['passages']} passages)")
+    if args.target == "store":
+        os.makedirs(args.dir, exist_ok=True)
+        hashes = ingest.PassageHashes(args.hashes or os.path.join(args.dir, ingest.HASHES_FILE))
+        sink = ingest.StoreSink(args.dir, dtype=args.dtype, resume_at=state["passages"], hashes=hashes)
+    else:
+        hashes = ingest.PassageHashes(args.hashes or ingest.HASHES_FILE)
+        sink = ingest.WeaviateSink(weaviate_client(), class_name=args.class_name, workers=args.workers, hashes=hashes)
+    if not state["records"]:
+        hashes.begin_run()
+
+    async def ingest_with(embed):
+        return await ingest.aingest(ingest.read_corpus(args.input, lang=args.lang), sink, embed,
+                                    checkpoint=checkpoint, state=state, batch_size=args.batch_size,
+                                    concurrency=args.concurrency, max_words=args.max_words,
+                                    checkpoint_every=args.checkpoint_every)
+
+    asyncio.run(with_embedder(args, ingest_with))
+    hashes.close()
+
+
+def update_corpus(args):
+    load_dotenv()
+    if args.target == "store":
+        if not args.out:
+            raise SystemExit("The updated copy of a local vector store needs a new directory (--out)")
+        os.makedirs(args.out, exist_ok=True)
+        hashes = ingest.PassageHashes(args.hashes or os.path.join(args.dir, ingest.HASHES_FILE))
+        # the copy only describes the new store once it is complete
+        hashes = hashes.copy(os.path.join(args.out, ingest.HASHES_FILE))
+        sink = update.StoreUpdateSink(args.dir, args.out)
+    else:
+        hashes = ingest.PassageHashes(args.hashes or ingest.HASHES_FILE)
+        sink = update.WeaviateUpdateSink(weaviate_client(), class_name=args.class_name, workers=args.workers)
+    if not len(hashes):
+        raise SystemExit(f"No passage hashes in {hashes.path}, ingest the corpus with `wikisearch.py ingest` first")
+
+    async def update_with(embed):
+        return await update.aupdate(ingest.read_corpus(args.input, lang=args.lang), hashes, sink, embed,
+                                    batch_size=args.batch_size, concurrency=args.concurrency,
+                                    max_words=args.max_words, delete_missing=args.delete_missing)
+
+    asyncio.run(with_embedder(args, update_with))
+    hashes.close()
+
+
+def load_test(args):
+    queries = loadtest.read_queries(args.input, mode=args.mode, lang=args.lang, top_n=args.top_n)
+    count = int(args.rate * args.duration) if args.duration else args.requests
+    engine = None
+    if args.model != "processes":
+        import wikipedia
+        engine = wikipedia.SearchEngine()
+    if not args.verbose:
+        # the engine logs every stage of every query
+        logging.getLogger().setLevel(logging.WARNING)
+    report = loadtest.loadtest(queries, args.rate, count=count, model=args.model, concurrency=args.concurrency,
+                               process=args.arrivals, seed=args.seed, engine=engine)
+    if engine is not None:
+        engine.close()
+    print(report.summary())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report.as_dict(), f, indent=2)
+
+
+def trace_summary(args):
+    summary = tracing.summarize(args.input)
+    print(f"{'span':>18} {'count':>7} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'self ms':>10} {'share':>6}")
+    for name, stats in summary.items():
+        print(f"{name:>18} {stats['count']:>7} {stats['errors']:>6} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['self_ms']:>10.1f} {stats['share']:>6.1%}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def weaviate_client() -> weaviate.Client:
+    return weaviate.Client(url=env("WEAVIATE_URL"),
+                           auth_client_secret=weaviate.auth.AuthApiKey(api_key=env("WEAVIATE_API_KEY")))
+
+
+async def with_embedder(args, run):
+    # runs a coroutine function with a Cohere embedder of EMBED_MODEL
+    # retried by the embedder's retry policy only
+    client = cohere.AsyncClient(env("COHERE_API_KEY"), num_workers=args.concurrency, check_api_key=False,
+                                max_retries=0)
+    try:
+        return await run(ingest.cohere_embedder(client, env("EMBED_MODEL", "multilingual-22-12"),
+                                                concurrency=args.concurrency))
+    finally:
+        await client.close()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(prog="wikisearch", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="Build the local indexes of LOCAL_INDEX_DIR")
+    kinds = index.add_subparsers(dest="kind", required=True)
+    store = kinds.add_parser("store", help="Memory-mapped vector store, from a .npy matrix and a JSON lines file")
+    store.add_argument("--dir", default="index", help="Local index directory (LOCAL_INDEX_DIR)")
+    store.add_argument("--vectors", required=True, help="Embeddings of the passages, shape (N, dim)")
+    store.add_argument("--metadata", required=True, help="One JSON line per passage: text, title, url, views, lang")
+    store.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="Vector storage type")
+    store.set_defaults(func=index_store)
+    hnsw = kinds.add_parser("hnsw", help="HNSW graph for DENSE_BACKEND=hnsw")
+    hnsw.add_argument("--dir", default="index", help="Local index directory (LOCAL_INDEX_DIR)")
+    hnsw.add_argument("--M", type=int, default=16, help="Neighbors per node on upper layers")
+    hnsw.add_argument("--ef-construction", type=int, default=100, help="Candidate list size while inserting")
+    hnsw.add_argument("--shards", action="store_true", help="Build the graph of every per-language shard")
+    hnsw.set_defaults(func=index_hnsw)
+    bm25 = kinds.add_parser("bm25", help="Inverted index for SPARSE_BACKEND=bm25")
+    bm25.add_argument("--dir", default="index", help="Local index directory (LOCAL_INDEX_DIR)")
+    bm25.add_argument("--k1", type=float, default=1.2, help="BM25 term frequency saturation")
+    bm25.add_argument("--b", type=float, default=0.75, help="BM25 document length normalization")
+    bm25.add_argument("--shards", action="store_true", help="Build the index of every per-language shard")
+    bm25.set_defaults(func=index_bm25)
+    quantized = kinds.add_parser("quantized", help="Compressed codes for DENSE_BACKEND=quantized")
+    quantized.add_argument("--dir", default="index", help="Local index directory (LOCAL_INDEX_DIR)")
+    quantized.add_argument("--kind", default="opq", choices=["pq", "opq", "int8"], help="Quantization scheme")
+    quantized.add_argument("--m", type=int, default=64, help="Bytes per PQ/OPQ code, an even divisor of the dimension")
+    quantized.add_argument("--train-size", type=int, default=65536, help="Vectors sampled to train the quantizer")
+    quantized.add_argument("--opq-iterations", type=int, default=8, help="Rotation updates of OPQ")
+    quantized.add_argument("--shards", action="store_true", help="Build the codes of every per-language shard")
+    quantized.set_defaults(func=index_quantized)
+    shard = kinds.add_parser("shards", help="Per-language copies of the vector store for LOCAL_SHARDS=true")
+    shard.add_argument("--dir", default="index", help="Local index directory (LOCAL_INDEX_DIR)")
+    shard.add_argument("--langs", nargs="+", help="Language codes to shard (default: every language of the store)")
+    shard.set_defaults(func=index_shards)
+
+    corpus = commands.add_parser("ingest", help="Chunk, embed and write a Wikipedia dump or JSON lines corpus")
+    corpus.add_argument("--input", required=True, help="MediaWiki XML dump (.xml[.bz2|.gz]) or JSON lines file of "
+                                                        "paragraphs with text, title, url, views, lang")
+    corpus.add_argument("--lang", help="Language code of a Wikipedia dump")
+    corpus.add_argument("--target", default="store", choices=["store", "weaviate"],
+                        help="Local vector store (--dir) or Weaviate (WEAVIATE_URL) batch import")
+    corpus.add_argument("--dir", default="index", help="Local index directory (LOCAL_INDEX_DIR)")
+    corpus.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="Vector storage type")
+    corpus.add_argument("--class-name", default="Articles", help="Weaviate class of the passages")
+    corpus.add_argument("--batch-size", type=int, default=96, help="Passages per embedding batch")
+    corpus.add_argument("--concurrency", type=int, default=8, help="Embedding requests in flight")
+    corpus.add_argument("--workers", type=int, default=4, help="Weaviate import threads")
+    corpus.add_argument("--max-words", type=int, default=ingest.CHUNK_WORDS, help="Maximum words per passage")
+    corpus.add_argument("--checkpoint", help="Checkpoint file (default: ingest.checkpoint.json in --dir, "
+                                             "or in the working directory for Weaviate)")
+    corpus.add_argument("--checkpoint-every", type=int, default=10000, help="Passages written between checkpoints")
+    corpus.add_argument("--hashes", help="Passage hashes for `update` (default: hashes.sqlite in --dir, "
+                                         "or in the working directory for Weaviate)")
+    corpus.set_defaults(func=ingest_corpus)
+
+    changes = commands.add_parser("update", help="Apply a newer dump or JSON lines corpus to an ingested one, "
+                                                 "embedding only the new and changed passages")
+    changes.add_argument("--input", required=True, help="MediaWiki XML dump (.xml[.bz2|.gz]) or JSON lines file of "
+                                                         "paragraphs with text, title, url, views, lang")
+    changes.add_argument("--lang", help="Language code of a Wikipedia dump")
+    changes.add_argument("--target", default="store", choices=["store", "weaviate"],
+                         help="Local vector store (--dir, copied to --out) or Weaviate (WEAVIATE_URL), updated in place")
+    changes.add_argument("--dir", default="index", help="Local index directory (LOCAL_INDEX_DIR)")
+    changes.add_argument("--out", help="New local index directory of the updated store")
+    changes.add_argument("--class-name", default="Articles", help="Weaviate class of the passages")
+    changes.add_argument("--hashes", help="Passage hashes written by `ingest` (default: hashes.sqlite in --dir, "
+                                          "or in the working directory for Weaviate)")
+    changes.add_argument("--delete-missing", action="store_true",
+                         help="The input is a full corpus: delete the articles it no longer holds")
+    changes.add_argument("--batch-size", type=int, default=96, help="Passages per embedding batch")
+    changes.add_argument("--concurrency", type=int, default=8, help="Embedding requests in flight")
+    changes.add_argument("--workers", type=int, default=4, help="Weaviate import threads")
+    changes.add_argument("--max-words", type=int, default=ingest.CHUNK_WORDS,
+                         help="Maximum words per passage, as when ingesting")
+    changes.set_defaults(func=update_corpus)
+
+    load = commands.add_parser("loadtest", help="Replay a query log against the search pipeline at an open-loop "
+                                                "arrival rate")
+    load.add_argument("--input", required=True, help="JSON lines file of queries: query, and optionally lang, mode, "
+                                                      "top_n")
+    load.add_argument("--rate", type=float, required=True, help="Query arrivals per second")
+    load.add_argument("--duration", type=float, help="Seconds of arrivals, replaying the log from the start "
+                                                     "when exhausted (default: each query once)")
+    load.add_argument("--requests", type=int, help="Queries to send, instead of --duration")
+    load.add_argument("--arrivals", default="poisson", choices=["poisson", "uniform"], help="Inter-arrival times")
+    load.add_argument("--seed", type=int, help="Seed of the Poisson arrivals")
+    load.add_argument("--model", default="threads", choices=loadtest.MODELS,
+                      help="Threads sharing one engine, coroutines on its event loop, or processes with an engine each")
+    load.add_argument("--concurrency", type=int, default=16, help="Threads, queries in flight, or processes")
+    load.add_argument("--mode", default="neartext", choices=["bm25", "neartext", "hybrid", "fusion"],
+                      help="Search mode of the queries without one")
+    load.add_argument("--lang", default="en", help="Language of the queries without one")
+    load.add_argument("--top-n", type=int, default=10, help="Results of the queries without top_n")
+    load.add_argument("--json", help="Write the report, with the latency histograms, to this JSON file")
+    load.add_argument("--verbose", action="store_true", help="Keep the engine's per-query logs")
+    load.set_defaults(func=load_test)
+
+    traces = commands.add_parser("traces", help="Break down the time of the spans of a TRACE_EXPORTER=file trace file")
+    traces.add_argument("--input", default="traces.jsonl", help="JSON lines file of spans (TRACE_FILE)")
+    traces.add_argument("--json", help="Write the breakdown to this JSON file")
+    traces.set_defaults(func=trace_summary)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()